@@ -1,15 +1,15 @@
 """Главная точка входа приложения"""
+import argparse
 import asyncio
 import logging
+import os
+import shutil
+import tempfile
 from multiprocessing import Process
 
-import uvicorn
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
+from src.monitoring.startup import TIMELINE
 
 from src.config.settings import settings
-from src.bot.handlers import router as bot_router
-from src.database.models import Database
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,63 +18,185 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+TIMELINE.mark("settings")
 
+# Точки входа для --measure-startup: модули, импортом которых начинается процесс
+STARTUP_TARGETS = {
+    "bot": "src.bot.dispatcher",
+    "api": "src.api.app",
+}
 
-async def start_bot():
-    """Запуск Telegram-бота"""
+
+async def start_bot(handle_signals: bool = True, serve_metrics: bool = False):
+    """
+    Запуск Telegram-бота
+    
+    Args:
+        handle_signals: Обрабатывать SIGINT/SIGTERM (выключено, если сигналы ловит uvicorn)
+        serve_metrics: Поднять /metrics на BOT_METRICS_PORT (бот в отдельном от API процессе)
+    """
     logger.info("Запуск Telegram-бота...")
     
-    # Инициализация БД
-    db = Database(settings.database_path)
-    await db.init_db()
+    # aiogram и обработчики импортируются здесь: процессу API (RUN_MODE=multi) они не нужны
+    from src.bot.dispatcher import create_bot, create_dispatcher
+    from src.monitoring.server import start_metrics_server
     
-    # Инициализация бота
-    bot = Bot(token=settings.telegram_bot_token, parse_mode=ParseMode.HTML)
-    dp = Dispatcher()
+    TIMELINE.mark("imports")
     
-    # Регистрация роутеров
-    dp.include_router(bot_router)
+    # Инициализация бота и регистрация роутеров.
+    # Сервисы запускаются в startup-хуке диспетчера (src/bot/dispatcher.py)
+    bot = create_bot()
+    dp = create_dispatcher()
     
-    # Удаление старых webhook'ов
-    await bot.delete_webhook(drop_pending_updates=True)
+    try:
+        # Удаление старых webhook'ов
+        await bot.delete_webhook(drop_pending_updates=True)
+    except Exception:
+        await bot.session.close()
+        raise
+    
+    metrics_runner = None
+    if serve_metrics and settings.bot_metrics_port:
+        metrics_runner = await start_metrics_server(settings.bot_metrics_host, settings.bot_metrics_port)
     
     # Запуск бота
     logger.info("Бот запущен и готов к работе")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot, handle_signals=handle_signals)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 
 def start_api():
     """Запуск FastAPI сервера"""
-    logger.info(f"Запуск API сервера на {settings.api_host}:{settings.api_port}...")
-    uvicorn.run(
+    import uvicorn
+    from src.monitoring.multiprocess import prepare_metrics_dir
+    
+    logger.info(
+        f"Запуск API сервера на {settings.api_host}:{settings.api_port} "
+        f"(воркеров: {settings.api_workers})..."
+    )
+    temp_metrics_dir = None
+    if settings.api_workers > 1:
+        # Воркеры наследуют окружение и складывают метрики через общий каталог
+        metrics_dir = settings.metrics_dir
+        if not metrics_dir:
+            metrics_dir = temp_metrics_dir = tempfile.mkdtemp(prefix="vpnbot-metrics-")
+        prepare_metrics_dir(metrics_dir)
+        os.environ["METRICS_DIR"] = metrics_dir
+    try:
+        uvicorn.run(
+            "src.api.app:app",
+            host=settings.api_host,
+            port=settings.api_port,
+            workers=settings.api_workers,
+            log_level="info",
+            access_log=True
+        )
+    finally:
+        if temp_metrics_dir:
+            shutil.rmtree(temp_metrics_dir, ignore_errors=True)
+
+
+async def run_single_process():
+    """Запуск API и бота в одном event loop с общими сервисами"""
+    import uvicorn
+    
+    if settings.api_workers > 1:
+        logger.warning("RUN_MODE=single не поддерживает несколько воркеров, API_WORKERS игнорируется")
+    logger.info(f"Запуск API сервера на {settings.api_host}:{settings.api_port} (единый процесс)...")
+    server = uvicorn.Server(uvicorn.Config(
         "src.api.app:app",
         host=settings.api_host,
         port=settings.api_port,
         log_level="info",
         access_log=True
+    ))
+    
+    if settings.bot_mode == "webhook":
+        # Бот поднимается в lifespan приложения
+        await server.serve()
+        return
+    
+    # Сигналы обрабатывает uvicorn, после его остановки завершаем polling
+    bot_task = asyncio.create_task(start_bot(handle_signals=False))
+    
+    def on_bot_stopped(task: asyncio.Task):
+        # Если бот упал, останавливаем и API, чтобы процесс перезапустился целиком
+        if not task.cancelled() and task.exception():
+            logger.error("Бот остановился с ошибкой", exc_info=task.exception())
+            server.should_exit = True
+    
+    bot_task.add_done_callback(on_bot_stopped)
+    try:
+        await server.serve()
+    finally:
+        bot_task.cancel()
+        try:
+            await bot_task
+        except asyncio.CancelledError:
+            pass
+
+
+def measure_startup(args: argparse.Namespace):
+    """Стоимость импорта точек входа по модулям (python -X importtime)"""
+    from src.monitoring.startup import report_startup
+    
+    targets = STARTUP_TARGETS if args.target == "all" else {args.target: STARTUP_TARGETS[args.target]}
+    print(report_startup(targets, limit=args.top, json_path=args.json))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="VPN-бот и API платежей")
+    parser.add_argument(
+        "--measure-startup",
+        action="store_true",
+        help="Не запускаться, а показать стоимость импорта модулей при старте"
     )
+    parser.add_argument("--target", choices=["all", *STARTUP_TARGETS], default="all", help="Точка входа для --measure-startup")
+    parser.add_argument("--top", type=int, default=15, help="Сколько пакетов и модулей показать")
+    parser.add_argument("--json", help="Сохранить полный отчёт --measure-startup в JSON-файл")
+    return parser.parse_args(argv)
 
 
 def main():
     """Главная функция"""
+    args = parse_args()
+    if args.measure_startup:
+        measure_startup(args)
+        return
+    
+    api_process = None
     try:
         # Проверка настроек
         logger.info("Проверка конфигурации...")
         logger.info(f"Database: {settings.database_path}")
         logger.info(f"Webhook URL: {settings.webhook_url}")
         logger.info(f"Hiddify API: {settings.hiddify_api_url}")
+        logger.info(f"Режим бота: {settings.bot_mode}, режим запуска: {settings.run_mode}")
+        
+        if settings.run_mode == "single":
+            asyncio.run(run_single_process())
+            return
+        
+        if settings.bot_mode == "webhook":
+            # Бот получает апдейты через FastAPI, отдельный процесс не нужен
+            start_api()
+            return
         
         # Запуск API в отдельном процессе
         api_process = Process(target=start_api)
         api_process.start()
         
         # Запуск бота в основном процессе
-        asyncio.run(start_bot())
+        asyncio.run(start_bot(serve_metrics=True))
         
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
-        api_process.terminate()
-        api_process.join()
+        if api_process:
+            api_process.terminate()
+            api_process.join()
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}", exc_info=True)
         raise
@@ -0,0 +1,72 @@
+"""
+Резервная копия базы вручную (бот и API могут продолжать работать)
+
+    python scripts/backup_db.py                  # снять копию в BACKUP_DIR
+    python scripts/backup_db.py --archive        # то же для базы архива ARCHIVE_DATABASE_PATH
+    python scripts/backup_db.py --list           # архивы и их размеры
+    python scripts/backup_db.py --verify FILE    # распаковать и проверить целостность архива
+"""
+import argparse
+import json
+import logging
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Добавить корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config.settings import settings
+from src.services.backup import BackupError, BackupService
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    db_path = settings.archive_database_path if args.archive else settings.database_path
+    if not db_path:
+        print("❌ ARCHIVE_DATABASE_PATH не задан: архив хранится в основной базе")
+        sys.exit(1)
+    service = BackupService(
+        db_path,
+        args.dir or settings.backup_dir,
+        keep=args.keep or settings.backup_keep,
+        step_pages=settings.backup_step_pages,
+        step_sleep=settings.backup_step_sleep_ms / 1000
+    )
+
+    if args.list:
+        for path in service.list_backups():
+            stat = path.stat()
+            created = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{created}  {stat.st_size / 2**20:>10.1f} МБ  {path}")
+        return
+
+    try:
+        if args.verify:
+            service.verify_archive(Path(args.verify))
+            print(f"✅ {args.verify}: integrity_check ok")
+            return
+        report = service.backup()
+    except BackupError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"✅ {report['path']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Резервная копия базы SQLite (online backup API)")
+    parser.add_argument("--dir", help="Каталог архивов (по умолчанию BACKUP_DIR)")
+    parser.add_argument("--keep", type=int, help="Сколько последних архивов хранить (по умолчанию BACKUP_KEEP)")
+    parser.add_argument("--archive", action="store_true", help="Копия базы архива (ARCHIVE_DATABASE_PATH) вместо основной")
+    parser.add_argument("--list", action="store_true", help="Показать архивы")
+    parser.add_argument("--verify", metavar="FILE", help="Проверить целостность архива")
+    parser.add_argument("--json", action="store_true", help="Вывести отчёт в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
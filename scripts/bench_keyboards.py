@@ -0,0 +1,69 @@
+"""Микробенчмарк клавиатур: сборка на каждый вызов против готовой разметки"""
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+# Добавить корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config.settings import settings
+from src.bot import keyboards
+
+# Самые частые экраны: главное меню (/start, "Назад"), выбор тарифа, кнопка "Назад"
+SCREENS = {
+    "tariffs (trial)": (
+        lambda: keyboards._build_tariffs_keyboard(True, False, settings),
+        lambda: keyboards.get_tariffs_keyboard(show_trial=True),
+    ),
+    "tariffs (active)": (
+        lambda: keyboards._build_tariffs_keyboard(False, True, settings),
+        lambda: keyboards.get_tariffs_keyboard(has_active_subscription=True),
+    ),
+    "normal_tariffs": (
+        lambda: keyboards._build_normal_tariffs_keyboard(settings),
+        keyboards.get_normal_tariffs_keyboard,
+    ),
+    "back": (
+        keyboards._build_back_keyboard,
+        keyboards.get_back_keyboard,
+    ),
+    "admin": (
+        keyboards._build_admin_keyboard,
+        keyboards.get_admin_keyboard,
+    ),
+}
+
+
+def time_per_call(fn, number: int) -> float:
+    """Среднее время вызова в микросекундах (лучший из 5 прогонов)"""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def allocated_per_call(fn, number: int = 1000) -> float:
+    """Средний объём выделенной памяти за вызов в байтах"""
+    fn()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = [fn() for _ in range(number)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del results
+    stats = after.compare_to(before, "filename")
+    return sum(stat.size_diff for stat in stats if stat.size_diff > 0) / number
+
+
+def main(number: int = 20000):
+    print(f"{'экран':<20}{'сборка, мкс':>14}{'готовая, мкс':>14}{'сборка, Б':>12}{'готовая, Б':>12}")
+    for name, (build, prebuilt) in SCREENS.items():
+        print(
+            f"{name:<20}"
+            f"{time_per_call(build, number // 10):>14.2f}"
+            f"{time_per_call(prebuilt, number):>14.3f}"
+            f"{allocated_per_call(build):>12.0f}"
+            f"{allocated_per_call(prebuilt):>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
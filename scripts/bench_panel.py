@@ -0,0 +1,268 @@
+"""
+Бенчмарк разбора ответа панели 3x-ui и сборки VLESS-ссылок
+
+Генерирует ответы inbounds/list с разным числом клиентов (набор Reality,
+TLS и WebSocket inbound'ов, как в рабочей панели) и замеряет этапы выдачи
+ключа: разбор JSON, построение каталога (streamSettings), выбор inbound'а
+и сборку ссылки - время и пик выделенной памяти. Перед замерами ссылки
+и выбор inbound'а сверяются с эталоном scripts/fixtures/panel_golden.json,
+так что оптимизация не может незаметно изменить выдаваемые ключи.
+
+    python scripts/bench_panel.py
+    python scripts/bench_panel.py --clients 10,1000,100000 --json panel.json
+    python scripts/bench_panel.py --check   # только сверка с эталоном
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import timeit
+import tracemalloc
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import httpx
+
+# Добавить корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.services.inbounds import build_vless_link, choose_inbound, parse_inbounds
+
+GOLDEN = Path(__file__).parent / "fixtures" / "panel_golden.json"
+
+
+def _reality(public_key: str, server_name: str, network: str = "tcp") -> dict:
+    return {
+        "network": network,
+        "security": "reality",
+        "externalProxy": [],
+        "realitySettings": {
+            "show": False,
+            "xver": 0,
+            "dest": f"{server_name}:443",
+            "serverNames": [server_name, f"www.{server_name}"],
+            "privateKey": "cN4W6yNV4Lq2Ol2xVv9ZBoUeMx8gNm9W0mIh1qg3dH0",
+            "shortIds": ["6ba85179e30d4fc2", "0f", "ab12cd"],
+            "settings": {"publicKey": public_key, "fingerprint": "chrome", "serverName": "", "spiderX": "/"},
+            "publicKey": public_key,
+            "fingerprint": "chrome",
+        },
+        "tcpSettings": {"acceptProxyProtocol": False, "header": {"type": "none"}},
+    }
+
+
+def _tls(server_name: str, network: str = "tcp", path: str = "/") -> dict:
+    settings = {
+        "network": network,
+        "security": "tls",
+        "externalProxy": [],
+        "tlsSettings": {
+            "serverName": server_name,
+            "minVersion": "1.2",
+            "maxVersion": "1.3",
+            "cipherSuites": "",
+            "certificates": [{"certificateFile": "/root/cert.crt", "keyFile": "/root/private.key"}],
+            "alpn": ["h2", "http/1.1"],
+        },
+    }
+    if network == "ws":
+        settings["wsSettings"] = {"acceptProxyProtocol": False, "path": path, "headers": {"Host": f"cdn.{server_name}"}}
+    return settings
+
+
+# Inbound'ы синтетической панели: (remark, порт, streamSettings, доля клиентов)
+PANEL_INBOUNDS = [
+    ("VPN-Bot-Reality", 443, _reality("Zk1YbW9ub3JlYWxpdHlwdWJsaWNrZXk", "microsoft.com"), 0.55),
+    ("VPN-AntiBlock-Reality", 441, _reality("YW50aWJsb2NrcHVibGlja2V5", "dl.google.com"), 0.25),
+    ("VPN-Bot-XHTTP", 2053, _reality("eGh0dHBwdWJsaWNrZXk", "apple.com", network="xhttp"), 0.1),
+    ("VPN-AntiBlock-WS", 2096, _tls("example.com", network="ws", path="/vless-ws"), 0.05),
+    ("Legacy TLS", 2083, _tls("example.com"), 0.04),
+    ("CDN WS", 8443, _tls("example.net", network="ws", path="/ws?ed=2048"), 0.01),
+]
+
+
+def generate_payload(clients: int, seed: int = 42) -> dict:
+    """Ответ inbounds/list: клиенты в settings (JSON-строкой) и в clientStats"""
+    rng = random.Random(seed)
+    obj = []
+    for inbound_id, (remark, port, stream, share) in enumerate(PANEL_INBOUNDS, start=1):
+        count = round(clients * share)
+        security = stream["security"]
+        inbound_clients, stats = [], []
+        for n in range(count):
+            email = f"user_{1700000000 + inbound_id * 10**7 + n}@vpn.local"
+            expiry = 1700000000000 + rng.randrange(400 * 86400) * 1000
+            inbound_clients.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "flow": "xtls-rprx-vision" if security == "reality" else "",
+                "email": email,
+                "limitIp": 0,
+                "totalGB": 107374182400,
+                "expiryTime": expiry,
+                "enable": rng.random() > 0.1,
+                "tgId": "",
+                "subId": f"{rng.getrandbits(64):016x}",
+                "comment": "",
+                "reset": 0,
+            })
+            stats.append({
+                "id": inbound_id * 10**7 + n,
+                "inboundId": inbound_id,
+                "enable": True,
+                "email": email,
+                "up": rng.randrange(10**9),
+                "down": rng.randrange(10**10),
+                "expiryTime": expiry,
+                "total": 107374182400,
+                "reset": 0,
+            })
+        obj.append({
+            "id": inbound_id,
+            "up": sum(s["up"] for s in stats),
+            "down": sum(s["down"] for s in stats),
+            "total": 0,
+            "remark": remark,
+            "enable": True,
+            "expiryTime": 0,
+            "clientStats": stats,
+            "listen": "",
+            "port": port,
+            "protocol": "vless",
+            "settings": json.dumps({"clients": inbound_clients, "decryption": "none", "fallbacks": []}, indent=2),
+            "streamSettings": json.dumps(stream, indent=2),
+            "tag": f"inbound-{port}",
+            "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls", "quic", "fakedns"]}, indent=2),
+        })
+    return {"success": True, "msg": "", "obj": obj}
+
+
+# Сверка с эталоном
+
+
+def check_golden() -> List[str]:
+    """Расхождения с эталоном (пустой список - всё совпадает)"""
+    golden = json.loads(GOLDEN.read_text())
+    errors = []
+    for case in golden["links"]:
+        # Через parse_inbounds, как в ответе панели: так проверяются и значения по умолчанию
+        inbound = parse_inbounds([case["inbound"]])[0]
+        link = build_vless_link(golden["client_uuid"], golden["server_host"], inbound, case["display_name"])
+        if link != case["expected"]:
+            errors.append(f"ссылка {case['name']}:\n  ожидалось {case['expected']}\n  получено  {link}")
+    for case in golden["selection"]:
+        inbound = choose_inbound(case["inbounds"], case["use_antiblock"])
+        selected = inbound["id"] if inbound else None
+        if selected != case["expected_id"]:
+            errors.append(f"выбор inbound'а {case['name']}: ожидался {case['expected_id']}, выбран {selected}")
+    return errors
+
+
+# Замеры
+
+
+def time_per_call(fn: Callable, budget: float = 0.5) -> float:
+    """Среднее время вызова в микросекундах (лучший из 5 прогонов, ~budget секунд на прогон)"""
+    started = timeit.default_timer()
+    fn()
+    once = timeit.default_timer() - started
+    number = max(1, int(budget / max(once, 1e-7)))
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def peak_allocated(fn: Callable) -> float:
+    """Пик выделенной за вызов памяти в килобайтах"""
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024
+
+
+def bench_size(clients: int) -> Dict:
+    """Этапы выдачи ключа для панели с clients клиентами"""
+    body = json.dumps(generate_payload(clients)).encode()
+    response = httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+    payload = response.json()
+    catalog = parse_inbounds(payload["obj"])
+    normal = choose_inbound(catalog, use_antiblock=False)
+    client_uuid = str(uuid.uuid4())
+
+    steps = {
+        # response.json() в _load_inbounds: декодирование и разбор всего ответа
+        "response.json": lambda: response.json(),
+        "parse_inbounds": lambda: parse_inbounds(payload["obj"]),
+        # Промах кэша каталога: всё вместе
+        "catalog_load": lambda: parse_inbounds(response.json()["obj"]),
+        "choose_inbound (normal)": lambda: choose_inbound(catalog, use_antiblock=False),
+        "choose_inbound (antiblock)": lambda: choose_inbound(catalog, use_antiblock=True),
+        "build_vless_link": lambda: build_vless_link(client_uuid, "vpn.example.org", normal, "🇳🇱 AI VPN | Netherlands"),
+    }
+    return {
+        "clients": clients,
+        "body_kb": len(body) / 1024,
+        "steps": {
+            name: {"us": time_per_call(fn), "peak_kb": peak_allocated(fn)}
+            for name, fn in steps.items()
+        },
+    }
+
+
+def bench_links() -> Dict[str, float]:
+    """Сборка ссылки для каждого типа inbound'а эталона (мкс)"""
+    golden = json.loads(GOLDEN.read_text())
+    return {
+        case["name"]: time_per_call(
+            lambda case=case: build_vless_link(golden["client_uuid"], golden["server_host"], case["inbound"], case["display_name"]),
+            budget=0.2
+        )
+        for case in golden["links"]
+    }
+
+
+def main(args):
+    # Выбор inbound'а и сборка ссылки пишут в лог на каждый вызов
+    logging.disable(logging.CRITICAL)
+
+    errors = check_golden()
+    if errors:
+        print("❌ Расхождение с эталоном scripts/fixtures/panel_golden.json:")
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    print("✅ Ссылки и выбор inbound'а совпадают с эталоном")
+    if args.check:
+        return
+
+    sizes = [int(float(value)) for value in args.clients.split(",")]
+    results = []
+    print(f"\n{'клиентов':>9}{'ответ, КБ':>11}  {'этап':<28}{'мкс':>14}{'пик, КБ':>10}")
+    for clients in sizes:
+        result = bench_size(clients)
+        results.append(result)
+        for i, (name, step) in enumerate(result["steps"].items()):
+            prefix = f"{clients:>9}{result['body_kb']:>11.0f}" if i == 0 else " " * 20
+            print(f"{prefix}  {name:<28}{step['us']:>14.1f}{step['peak_kb']:>10.1f}")
+
+    links = bench_links()
+    print("\nСборка ссылки по типам inbound'ов, мкс:")
+    for name, us in links.items():
+        print(f"  {name:<28}{us:>8.2f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"sizes": results, "links_us": links}, ensure_ascii=False, indent=2))
+        print(f"\nРезультаты сохранены в {args.json}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора ответа 3x-ui и сборки VLESS-ссылок")
+    parser.add_argument("--clients", default="10,100,1000,10000,100000", help="Размеры панели (клиентов), через запятую")
+    parser.add_argument("--check", action="store_true", help="Только сверить ссылки и выбор inbound'а с эталоном")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
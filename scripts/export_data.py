@@ -0,0 +1,55 @@
+"""
+Выгрузка платежей, подписок и пользователей для аналитики
+
+Строки читаются пачками по индексу created_at и сразу пишутся в файл:
+память не зависит от объёма, бот и API продолжают писать в базу.
+
+    python scripts/export_data.py payments --since 2025-01-01 --until 2025-02-01 -o payments.csv
+    python scripts/export_data.py users --format ndjson > users.ndjson
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Добавить корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config.settings import settings
+from src.database.models import EXPORT_COLUMNS, Database
+from src.services.export import EXPORT_FORMATS, export_rows, parse_period_bound
+
+
+async def export(args):
+    db = Database(settings.database_path)
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    started = time.perf_counter()
+    written = 0
+    try:
+        async for chunk in export_rows(db, args.table, args.format, since=args.since, until=args.until, batch_size=args.batch_size):
+            output.write(chunk)
+            written += len(chunk.encode())
+    finally:
+        if args.output:
+            output.close()
+    print(
+        f"✅ {args.table}: {written / 2**20:.1f} МБ за {time.perf_counter() - started:.1f} с"
+        + (f" -> {args.output}" if args.output else ""),
+        file=sys.stderr
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка таблиц в CSV или NDJSON")
+    parser.add_argument("table", choices=list(EXPORT_COLUMNS), help="Таблица")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", help="Формат выгрузки")
+    parser.add_argument("--since", type=parse_period_bound, help="Начало периода по created_at (UTC), включительно: 2025-01-01 или 2025-01-01T12:00:00")
+    parser.add_argument("--until", type=parse_period_bound, help="Конец периода по created_at (UTC), не включая")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Строк в пачке")
+    parser.add_argument("-o", "--output", help="Файл (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(export(parse_args()))
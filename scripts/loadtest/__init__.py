@@ -0,0 +1 @@
+"""Нагрузочный тест с локальными заглушками Telegram Bot API, ЮKassa и 3x-ui"""
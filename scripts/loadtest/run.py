@@ -0,0 +1,211 @@
+"""
+Нагрузочный тест бота и API на локальных заглушках
+
+Поднимает заглушки Telegram Bot API, ЮKassa и 3x-ui, запускает
+приложение (main.py) отдельным процессом с адресами заглушек и гоняет
+смесь сценариев от N виртуальных пользователей. Внешние сервисы не
+используются, база создаётся во временной директории.
+
+    python scripts/loadtest/run.py --users 50 --duration 60
+    python scripts/loadtest/run.py --mix start=50,purchase=50 --panel-latency 0.3 --panel-error-rate 0.02
+    python scripts/loadtest/run.py --run-mode single --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+# Добавить корневую директорию в путь
+ROOT = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(ROOT))
+
+from scripts.loadtest.scenarios import DEFAULT_MIX, Recorder, Scenarios, parse_mix
+from scripts.loadtest.stubs import PanelStub, TelegramStub, YooKassaStub, start_site
+
+ADMIN_ID = 999_999
+WEBHOOK_SECRET = "loadtest"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def app_environment(args, telegram_url: str, yookassa_url: str, panel_url: str, api_port: int, workdir: str) -> dict:
+    """Переменные окружения приложения: все внешние адреса указывают на заглушки"""
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "100000:LOADTEST",
+        "TELEGRAM_API_URL": telegram_url,
+        "YOOKASSA_SHOP_ID": "loadtest",
+        "YOOKASSA_SECRET_KEY": "loadtest",
+        "YOOKASSA_API_URL": f"{yookassa_url}/v3",
+        "HIDDIFY_API_URL": panel_url,
+        "HIDDIFY_API_TOKEN": "loadtest",
+        "SERVER_HOST": "vpn.loadtest",
+        "WEBHOOK_URL": f"http://127.0.0.1:{api_port}/webhook/yookassa",
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(api_port),
+        "API_WORKERS": str(args.api_workers),
+        "DATABASE_PATH": str(Path(workdir) / "loadtest.db"),
+        "ARCHIVE_DATABASE_PATH": str(Path(workdir) / "loadtest_archive.db"),
+        "BACKUP_DIR": str(Path(workdir) / "backups"),
+        "ADMIN_USERS": str(ADMIN_ID),
+        "RUN_MODE": args.run_mode,
+        "BOT_MODE": "polling",
+        "BOT_METRICS_PORT": "0",
+        "BROADCAST_RATE_LIMIT": str(args.broadcast_rate),
+    })
+    return env
+
+
+async def wait_ready(telegram: TelegramStub, api_url: str, app: subprocess.Popen, timeout: float = 60.0):
+    """Дождаться, пока бот начнёт polling, а API ответит 200 на /ready"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if app.poll() is not None:
+                raise RuntimeError(f"Приложение завершилось с кодом {app.returncode}")
+            try:
+                async with session.get(f"{api_url}/ready") as response:
+                    if response.status == 200 and telegram.polling.is_set():
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("Приложение не запустилось (нет polling или /ready)")
+
+
+def stop_app(app: subprocess.Popen):
+    if app.poll() is not None:
+        return
+    app.send_signal(signal.SIGINT)
+    try:
+        app.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        app.kill()
+        app.wait()
+
+
+def print_report(report: dict, recorder: Recorder, telegram: TelegramStub, yookassa: YooKassaStub, panel: PanelStub):
+    print()
+    print(f"{'сценарий':<18}{'ok':>7}{'ошибки':>8}{'в сек':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for flow, row in report["flows"].items():
+        errors = sum(row["errors"].values())
+        timings = "".join(
+            f"{row[key] * 1000:>10.0f}" if key in row else f"{'-':>10}"
+            for key in ("p50", "p95", "p99", "max")
+        )
+        print(f"{flow:<18}{row['ok']:>7}{errors:>8}{row['throughput']:>8.1f}{timings}")
+        for reason, count in row["errors"].items():
+            print(f"    {reason}: {count}")
+    for name, values in recorder.notes.items():
+        print(f"{name}: {', '.join(f'{v:.1f}' for v in values)}")
+
+    print()
+    print(f"Telegram: запросов {sum(telegram.requests.values())}, ответов 429: {telegram.retry_after}")
+    print(f"ЮKassa: {dict(yookassa.stats)}")
+    print(f"Панель: {dict(panel.stats)}")
+
+
+async def main(args):
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="vpnbot-loadtest-")
+    api_port = free_port()
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    telegram = TelegramStub(rate=args.telegram_rate, retry_after=args.retry_after)
+    yookassa = YooKassaStub(f"{api_url}/webhook/yookassa", WEBHOOK_SECRET, latency=args.yookassa_latency)
+    panel = PanelStub(latency=args.panel_latency, jitter=args.panel_jitter, error_rate=args.panel_error_rate)
+
+    runners = []
+    telegram_runner, telegram_port = await start_site(telegram.app())
+    yookassa_runner, yookassa_port = await start_site(yookassa.app())
+    panel_runner, panel_port = await start_site(panel.app())
+    runners += [telegram_runner, yookassa_runner, panel_runner]
+    yookassa.base_url = f"http://127.0.0.1:{yookassa_port}"
+
+    env = app_environment(
+        args,
+        f"http://127.0.0.1:{telegram_port}",
+        yookassa.base_url,
+        f"http://127.0.0.1:{panel_port}",
+        api_port,
+        workdir
+    )
+    log_path = Path(workdir) / "app.log"
+    print(f"Рабочая директория: {workdir} (лог приложения: {log_path})")
+
+    with open(log_path, "w") as log:
+        app = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            await wait_ready(telegram, api_url, app)
+            print(f"Приложение запущено, {args.users} пользователей на {args.duration} с, смесь {mix}")
+
+            recorder = Recorder()
+            scenarios = Scenarios(telegram, yookassa, recorder, ADMIN_ID, timeout=args.timeout)
+            deadline = time.perf_counter() + args.duration
+            await asyncio.gather(*(
+                scenarios.virtual_user(mix, deadline, args.think)
+                for _ in range(args.users)
+            ))
+            recorder.finish()
+        finally:
+            stop_app(app)
+            for runner in runners:
+                await runner.cleanup()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "json"},
+        "flows": recorder.report(),
+        "notes": dict(recorder.notes),
+        "stubs": {
+            "telegram_requests": dict(telegram.requests),
+            "telegram_429": telegram.retry_after,
+            "yookassa": dict(yookassa.stats),
+            "panel": dict(panel.stats),
+        },
+    }
+    print_report(report, recorder, telegram, yookassa, panel)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"\nРезультаты сохранены в {args.json}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест на локальных заглушках внешних сервисов")
+    parser.add_argument("--users", type=int, default=20, help="Одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность теста, сек.")
+    parser.add_argument(
+        "--mix",
+        default=",".join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()),
+        help="Веса сценариев: start, trial, purchase, broadcast"
+    )
+    parser.add_argument("--think", type=float, default=0.5, help="Средняя пауза между сценариями, сек.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Ожидание ответа бота, сек.")
+    parser.add_argument("--run-mode", choices=("multiprocess", "single"), default="multiprocess")
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--telegram-rate", type=float, default=30.0, help="Лимит Bot API, сообщений в секунду")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек.")
+    parser.add_argument("--broadcast-rate", type=float, default=28.0, help="BROADCAST_RATE_LIMIT приложения")
+    parser.add_argument("--yookassa-latency", type=float, default=0.1, help="Задержка создания платежа, сек.")
+    parser.add_argument("--panel-latency", type=float, default=0.1, help="Средняя задержка addClient, сек.")
+    parser.add_argument("--panel-jitter", type=float, default=0.5, help="Разброс задержки панели (доля)")
+    parser.add_argument("--panel-error-rate", type=float, default=0.0, help="Доля ошибок addClient")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
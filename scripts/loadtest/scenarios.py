@@ -0,0 +1,227 @@
+"""Сценарии нагрузочного теста и сбор результатов"""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from scripts.loadtest.stubs import TelegramStub, YooKassaStub
+from src.monitoring.tracing import percentile
+
+# Сценарии и их веса по умолчанию
+DEFAULT_MIX = {"start": 40, "trial": 25, "purchase": 30, "broadcast": 5}
+
+# Первая строка BROADCAST_XHTTP_TEXT из src/bot/handlers.py
+BROADCAST_MARKER = "Обновление VPN!"
+
+
+class FlowTimeout(Exception):
+    """Бот не ответил за отведённое время"""
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'start=40,trial=25' -> {'start': 40.0, 'trial': 25.0}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Неизвестный сценарий: {name} (доступны: {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def has_key(message: dict) -> bool:
+    return "vless://" in message["text"]
+
+
+def payment_url(message: dict) -> Optional[str]:
+    """URL оплаты из кнопки под сообщением"""
+    for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+        for button in row:
+            if "/pay/" in (button.get("url") or ""):
+                return button["url"]
+    return None
+
+
+class Recorder:
+    """Длительности и ошибки по сценариям (и их этапам)"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+        self.notes: Dict[str, List[float]] = defaultdict(list)
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    def add(self, flow: str, seconds: float):
+        self.samples[flow].append(seconds)
+
+    def note(self, name: str, value: float):
+        """Дополнительный показатель (не длительность)"""
+        self.notes[name].append(value)
+
+    def error(self, flow: str, reason: str):
+        self.errors[flow][reason] += 1
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def report(self) -> Dict[str, dict]:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        report = {}
+        for flow in sorted(set(self.samples) | set(self.errors)):
+            values = sorted(self.samples.get(flow, []))
+            row = {
+                "ok": len(values),
+                "errors": dict(self.errors.get(flow, {})),
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+            }
+            if values:
+                row.update(
+                    p50=percentile(values, 0.5),
+                    p95=percentile(values, 0.95),
+                    p99=percentile(values, 0.99),
+                    max=values[-1],
+                )
+            report[flow] = row
+        return report
+
+
+class Scenarios:
+    """
+    Поведение пользователей бота
+
+    Каждый сценарий - новый пользователь (у каждого свой пробный период
+    и свои лимиты антифлуда), время отсчитывается от отправки апдейта
+    до получения заглушкой Telegram нужного ответа бота.
+    """
+
+    def __init__(
+        self,
+        telegram: TelegramStub,
+        yookassa: YooKassaStub,
+        recorder: Recorder,
+        admin_id: int,
+        timeout: float = 30.0
+    ):
+        self.telegram = telegram
+        self.yookassa = yookassa
+        self.recorder = recorder
+        self.admin_id = admin_id
+        self.timeout = timeout
+        self.known_users: Set[int] = set()
+        self.broadcast_running = False
+        self._user_ids = itertools.count(1_000_000)
+
+    def new_user(self) -> int:
+        return next(self._user_ids)
+
+    async def _wait(self, chat_id: int, future: asyncio.Future) -> Tuple[float, dict]:
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.telegram.forget(chat_id, future)
+            raise FlowTimeout()
+
+    async def run(self, flow: str):
+        """Выполнить сценарий и записать результат"""
+        if flow == "broadcast" and self.broadcast_running:
+            # Рассылка одна на всех, вместо второй - обычный /start
+            flow = "start"
+        try:
+            await getattr(self, flow)()
+        except FlowTimeout:
+            self.recorder.error(flow, "timeout")
+        except Exception as e:
+            self.recorder.error(flow, type(e).__name__)
+
+    async def start(self, user_id: Optional[int] = None):
+        """/start -> главное меню"""
+        user_id = user_id or self.new_user()
+        answered = self.telegram.expect(user_id, lambda m: m["method"] == "sendMessage")
+        sent = time.perf_counter()
+        self.telegram.push_message(user_id, "/start")
+        answered_at, _ = await self._wait(user_id, answered)
+        self.recorder.add("start", answered_at - sent)
+        self.known_users.add(user_id)
+
+    async def trial(self):
+        """/start, затем "Попробовать бесплатно" -> сообщение с ключом"""
+        user_id = self.new_user()
+        await self.start(user_id)
+        key = self.telegram.expect(user_id, has_key)
+        sent = time.perf_counter()
+        self.telegram.push_callback(user_id, "get_trial")
+        delivered_at, _ = await self._wait(user_id, key)
+        self.recorder.add("trial", delivered_at - sent)
+
+    async def purchase(self):
+        """
+        Выбор тарифа -> ссылка на оплату (purchase.invoice), оплата ->
+        webhook -> ключ (purchase.key), purchase - весь путь
+        """
+        user_id = self.new_user()
+        invoice = self.telegram.expect(user_id, lambda m: payment_url(m) is not None)
+        sent = time.perf_counter()
+        self.telegram.push_callback(user_id, "tariff:1m")
+        invoiced_at, message = await self._wait(user_id, invoice)
+        self.recorder.add("purchase.invoice", invoiced_at - sent)
+
+        payment_id = urlparse(payment_url(message)).path.rsplit("/", 1)[-1]
+        key = self.telegram.expect(user_id, has_key)
+        paid = time.perf_counter()
+        if not await self.yookassa.pay(payment_id):
+            self.telegram.forget(user_id, key)
+            self.recorder.error("purchase", "webhook_failed")
+            return
+        delivered_at, _ = await self._wait(user_id, key)
+        self.recorder.add("purchase.key", delivered_at - paid)
+        self.recorder.add("purchase", delivered_at - sent)
+        self.known_users.add(user_id)
+
+    async def broadcast(self):
+        """
+        Рассылка всем пользователям от администратора
+
+        Время - до доставки рассылки всем пользователям, которые были
+        известны на момент запуска, и скорость рассылки (сообщений в секунду).
+        """
+        self.broadcast_running = True
+        expected = set(self.known_users)
+        delivered: Set[int] = set()
+        done = asyncio.get_running_loop().create_future()
+
+        def on_message(chat_id: int, message: dict) -> bool:
+            if message["method"] == "sendMessage" and BROADCAST_MARKER in message["text"]:
+                delivered.add(chat_id)
+                if expected <= delivered and not done.done():
+                    done.set_result(time.perf_counter())
+            return done.done()
+
+        self.telegram.listen(on_message)
+        sent = time.perf_counter()
+        self.telegram.push_callback(self.admin_id, "admin_broadcast_confirm:all")
+        try:
+            if not expected:
+                return
+            # Рассылка на тысячи пользователей идёт дольше обычного сценария
+            finished = await asyncio.wait_for(done, max(self.timeout, len(expected) / 10))
+            self.recorder.add("broadcast", finished - sent)
+            self.recorder.note("broadcast_msgs_per_sec", len(delivered) / (finished - sent))
+        except asyncio.TimeoutError:
+            self.recorder.error("broadcast", f"delivered {len(delivered & expected)}/{len(expected)}")
+        finally:
+            if not done.done():
+                done.cancel()
+            self.broadcast_running = False
+
+    async def virtual_user(self, mix: Dict[str, float], deadline: float, think: float):
+        """Выполнять случайные сценарии до deadline (perf_counter)"""
+        flows, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            await self.run(random.choices(flows, weights)[0])
+            if think:
+                await asyncio.sleep(random.expovariate(1 / think))
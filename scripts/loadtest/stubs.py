@@ -0,0 +1,396 @@
+"""Локальные заглушки внешних сервисов: Telegram Bot API, ЮKassa, панель 3x-ui"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from src.services.rate_limiter import TokenBucket
+
+# Методы Bot API, на которые распространяется лимит отправки (ответ 429)
+SEND_METHODS = frozenset({"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"})
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+MessagePredicate = Callable[[dict], bool]
+
+
+async def start_site(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, int]:
+    """Запустить приложение aiohttp, вернуть runner и фактический порт"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def _read_params(request: web.Request) -> dict:
+    # aiogram шлёт form-data (сложные поля - JSON-строками), httpx - JSON
+    if request.content_type == "application/json":
+        return await request.json()
+    params = {}
+    for key, value in (await request.post()).items():
+        if isinstance(value, str) and value[:1] in "{[":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class TelegramStub:
+    """
+    Заглушка Telegram Bot API
+
+    Отдаёт апдейты через long polling (getUpdates), принимает ответы бота
+    и ограничивает отправку общим token bucket: при превышении отвечает
+    429 с retry_after, как настоящий Bot API. Сценарии ждут нужные
+    сообщения через expect().
+    """
+
+    def __init__(self, rate: float = 30.0, burst: Optional[float] = None, retry_after: int = 1):
+        self.bucket = TokenBucket(rate=rate, capacity=burst or rate)
+        self.retry_after_seconds = retry_after
+        self.requests: Counter = Counter()
+        self.retry_after = 0
+        self.polling = asyncio.Event()
+        self._updates: deque = deque()
+        self._has_updates = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._waiters: Dict[int, List[Tuple[MessagePredicate, asyncio.Future]]] = defaultdict(list)
+        self._listeners: List[Callable[[int, dict], bool]] = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    # Апдейты
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "language_code": "ru"}
+
+    def _push(self, update: dict):
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._has_updates.set()
+
+    def push_message(self, user_id: int, text: str):
+        """Сообщение от пользователя (команды - с entity bot_command)"""
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._push({"message": message})
+
+    def push_callback(self, user_id: int, data: str):
+        """Нажатие inline-кнопки под сообщением бота"""
+        self._message_id += 1
+        self._push({"callback_query": {
+            "id": uuid.uuid4().hex,
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        }})
+
+    # Ответы бота
+
+    def expect(self, chat_id: int, predicate: MessagePredicate) -> asyncio.Future:
+        """
+        Future, которое завершится парой (время доставки по perf_counter,
+        сообщение) для первого подходящего сообщения в чат
+
+        Регистрировать до отправки апдейта, иначе ответ можно пропустить.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    def forget(self, chat_id: int, future: asyncio.Future):
+        """Убрать ожидание (по таймауту)"""
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            waiters[:] = [w for w in waiters if w[1] is not future]
+            if not waiters:
+                del self._waiters[chat_id]
+
+    def listen(self, listener: Callable[[int, dict], bool]):
+        """Получать все сообщения бота; слушатель удаляется, когда вернёт True"""
+        self._listeners.append(listener)
+
+    def _deliver(self, chat_id: int, message: dict):
+        delivered_at = time.perf_counter()
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            for waiter in list(waiters):
+                predicate, future = waiter
+                if future.done():
+                    waiters.remove(waiter)
+                elif predicate(message):
+                    future.set_result((delivered_at, message))
+                    waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[chat_id]
+        if self._listeners:
+            self._listeners[:] = [l for l in self._listeners if not l(chat_id, message)]
+
+    # HTTP
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await _read_params(request)
+        self.requests[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if method in SEND_METHODS and not self.bucket.try_acquire():
+            self.retry_after += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after_seconds}",
+                "parameters": {"retry_after": self.retry_after_seconds},
+            }, status=429)
+
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method not in SEND_METHODS:
+            # answerCallbackQuery, deleteWebhook, setMyCommands и т.п.
+            return True
+
+        chat_id = int(params["chat_id"])
+        if "message_id" in params:
+            message_id = int(params["message_id"])
+        else:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+        if isinstance(params.get("reply_markup"), dict):
+            message["reply_markup"] = params["reply_markup"]
+        self._deliver(chat_id, {**message, "method": method})
+        return message
+
+
+class YooKassaStub:
+    """
+    Заглушка API ЮKassa (/v3/payments)
+
+    Платёж создаётся в статусе pending; pay() переводит его в succeeded
+    и отправляет webhook payment.succeeded в приложение, как при оплате
+    пользователем.
+    """
+
+    def __init__(self, webhook_url: str, webhook_secret: str = "", latency: float = 0.0):
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.base_url = ""
+        self.payments: Dict[str, dict] = {}
+        self.stats: Counter = Counter()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self._create)
+        app.router.add_get("/v3/payments/{payment_id}", self._get)
+        app.router.add_get("/v3/me", self._me)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app: web.Application):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _me(self, request: web.Request) -> web.Response:
+        self.stats["me"] += 1
+        return web.json_response({"account_id": "loadtest", "test": True, "status": "enabled"})
+
+    async def _create(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "confirmation": {
+                "type": "redirect",
+                "confirmation_url": f"{self.base_url}/pay/{payment_id}",
+            },
+            "created_at": _now_iso(),
+            "description": body.get("description", ""),
+            "metadata": body.get("metadata", {}),
+            "recipient": {"account_id": "1", "gateway_id": "1"},
+            "refundable": False,
+            "test": True,
+        }
+        self.payments[payment_id] = payment
+        self.stats["created"] += 1
+        return web.json_response(payment)
+
+    async def _get(self, request: web.Request) -> web.Response:
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(payment)
+
+    async def pay(self, payment_id: str) -> bool:
+        """Оплатить платёж и доставить webhook в приложение"""
+        payment = self.payments[payment_id]
+        payment.update(status="succeeded", paid=True, captured_at=_now_iso())
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        try:
+            async with self._session.post(
+                self.webhook_url,
+                json={"type": "notification", "event": "payment.succeeded", "object": payment},
+                headers={"X-Webhook-Secret": self.webhook_secret}
+            ) as response:
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+        self.stats["webhooks_ok" if ok else "webhooks_failed"] += 1
+        return ok
+
+
+def _reality_inbound(inbound_id: int, remark: str, port: int) -> dict:
+    return {
+        "id": inbound_id,
+        "remark": remark,
+        "port": port,
+        "protocol": "vless",
+        "streamSettings": json.dumps({
+            "network": "tcp",
+            "security": "reality",
+            "realitySettings": {
+                "publicKey": "loadtestPublicKey",
+                "fingerprint": "chrome",
+                "serverNames": ["www.example.com"],
+                "shortIds": ["0123abcd"],
+            },
+        }),
+    }
+
+
+class PanelStub:
+    """
+    Заглушка панели 3x-ui
+
+    login, inbounds/list, addClient, updateClient и onlines (проверка /ready).
+    Добавленные клиенты хранятся и отдаются в inbounds/list. Задержка
+    addClient случайна в пределах latency * (1 ± jitter), доля error_rate
+    ответов - ошибка.
+    """
+
+    def __init__(self, latency: float = 0.1, jitter: float = 0.5, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stats: Counter = Counter()
+        self.inbounds = [
+            _reality_inbound(1, "VPN-Bot-Reality", 443),
+            _reality_inbound(2, "VPN-AntiBlock-Reality", 441),
+        ]
+        # inbound id -> {uuid клиента: клиент}
+        self.clients: Dict[int, Dict[str, dict]] = {inbound["id"]: {} for inbound in self.inbounds}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/login", self._login)
+        app.router.add_get("/panel/api/inbounds/list", self._list)
+        app.router.add_post("/panel/api/inbounds/addClient", self._add_client)
+        app.router.add_post("/panel/api/inbounds/updateClient/{client_id}", self._update_client)
+        app.router.add_post("/panel/api/inbounds/onlines", self._onlines)
+        return app
+
+    async def _login(self, request: web.Request) -> web.Response:
+        self.stats["login"] += 1
+        response = web.json_response({"success": True, "msg": "Login Successfully", "obj": None})
+        response.set_cookie("3x-ui", uuid.uuid4().hex)
+        return response
+
+    async def _list(self, request: web.Request) -> web.Response:
+        self.stats["list"] += 1
+        inbounds = [
+            {**inbound, "settings": json.dumps({"clients": list(self.clients[inbound["id"]].values())})}
+            for inbound in self.inbounds
+        ]
+        return web.json_response({"success": True, "msg": "", "obj": inbounds})
+
+    async def _onlines(self, request: web.Request) -> web.Response:
+        self.stats["onlines"] += 1
+        return web.json_response({"success": True, "msg": "", "obj": []})
+
+    async def _add_client(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(max(0.0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)))
+        if random.random() < self.error_rate:
+            self.stats["add_client_failed"] += 1
+            return web.json_response({"success": False, "msg": "loadtest: injected error", "obj": None})
+        clients = json.loads(body["settings"])["clients"]
+        self.clients.setdefault(body["id"], {}).update((client["id"], client) for client in clients)
+        self.stats["add_client"] += 1
+        self.stats["clients_added"] += len(clients)
+        return web.json_response({"success": True, "msg": "Client(s) added Successfully", "obj": None})
+
+    async def _update_client(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        client_id = request.match_info["client_id"]
+        inbound_clients = self.clients.get(body["id"], {})
+        if client_id not in inbound_clients:
+            return web.json_response({"success": False, "msg": "client not found", "obj": None})
+        inbound_clients[client_id] = json.loads(body["settings"])["clients"][0]
+        self.stats["update_client"] += 1
+        return web.json_response({"success": True, "msg": "Client updated", "obj": None})
@@ -0,0 +1,72 @@
+"""Служебные API endpoint'ы для администраторов"""
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from src.api.dependencies import get_container
+from src.config.settings import settings
+from src.database.models import EXPORT_COLUMNS
+from src.monitoring.profiler import SAMPLER, ProfilerBusy
+from src.services.container import ServiceContainer
+from src.services.export import EXPORT_FORMATS, export_rows, parse_period_bound
+
+
+def require_admin_token(authorization: Optional[str] = Header(None)):
+    """Проверить Bearer-токен ADMIN_API_TOKEN; без токена маршруты выключены"""
+    if not settings.admin_api_token:
+        raise HTTPException(status_code=404, detail="Admin API disabled")
+    if not hmac.compare_digest(authorization or "", f"Bearer {settings.admin_api_token}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin_token)])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(5.0, ge=1, le=100)
+):
+    """
+    Профиль event loop процесса в формате collapsed stacks
+
+    Результат можно передать в flamegraph.pl или открыть в speedscope.
+    При нескольких воркерах API профилируется воркер, принявший запрос.
+    """
+    try:
+        result = await SAMPLER.profile(min(seconds, settings.profile_max_seconds), interval_ms / 1000)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return result.collapsed()
+
+
+@router.get("/export/{table}")
+async def export_table(
+    table: str,
+    fmt: str = Query("csv", alias="format"),
+    since: Optional[str] = Query(None, description="Начало периода по created_at (UTC), включительно"),
+    until: Optional[str] = Query(None, description="Конец периода по created_at (UTC), не включая"),
+    services: ServiceContainer = Depends(get_container)
+):
+    """
+    Выгрузка payments, subscriptions или users в CSV или NDJSON
+
+    Ответ отдаётся по частям по мере чтения пачек из базы: память не
+    зависит от объёма, запись в базу ботом не блокируется.
+    """
+    if table not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown table, expected one of: {', '.join(EXPORT_COLUMNS)}")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, expected one of: {', '.join(EXPORT_FORMATS)}")
+    try:
+        since, until = parse_period_bound(since), parse_period_bound(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO dates, e.g. 2025-01-31 or 2025-01-31T12:00:00")
+
+    return StreamingResponse(
+        export_rows(services.db, table, fmt, since=since, until=until),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'}
+    )
@@ -1,12 +1,20 @@
 """FastAPI приложение"""
 import logging
 from contextlib import asynccontextmanager
+
+from src.monitoring.startup import TIMELINE
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.config.settings import settings
-from src.database.models import Database
+from src.services.container import container
+from src.services.lease import Lease
+from src.monitoring.multiprocess import MetricsExchange
 from src.api.webhook import router as webhook_router
+from src.api.metrics import router as metrics_router
+from src.api.admin import router as admin_router
+from src.api.subscription import router as subscription_router
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,15 +29,64 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Lifecycle events"""
     # Startup
-    logger.info("Инициализация базы данных...")
-    db = Database(settings.database_path)
-    await db.init_db()
-    logger.info("База данных инициализирована")
+    app.state.container = container
+    await container.startup()
+    
+    if settings.bot_mode == "webhook":
+        await start_webhook_bot(app)
+    # Проверки зависимостей для /ready идут в фоне, в каждом воркере свои
+    container.readiness.start()
+    app.state.metrics_exchange = None
+    if settings.metrics_dir:
+        app.state.metrics_exchange = MetricsExchange(settings.metrics_dir, settings.metrics_flush_seconds)
+        app.state.metrics_exchange.start()
+    TIMELINE.mark("ready")
     
     yield
     
     # Shutdown
     logger.info("Остановка приложения...")
+    if app.state.metrics_exchange is not None:
+        await app.state.metrics_exchange.stop()
+    await container.readiness.stop()
+    if settings.bot_mode == "webhook":
+        await stop_webhook_bot(app)
+    await container.shutdown()
+
+
+async def start_webhook_bot(app: FastAPI):
+    """Запуск бота в режиме webhook внутри API"""
+    from src.bot.dispatcher import create_bot, create_dispatcher
+    
+    bot = create_bot()
+    dispatcher = create_dispatcher()
+    app.state.bot = bot
+    app.state.dispatcher = dispatcher
+    
+    # При нескольких воркерах webhook регистрирует только один из них.
+    # Накопившиеся апдейты не сбрасываются: Telegram доставит их после деплоя
+    if await Lease(container.db, "telegram_set_webhook", ttl=60.0).acquire():
+        await bot.set_webhook(
+            url=settings.telegram_webhook_url,
+            secret_token=settings.telegram_webhook_secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            drop_pending_updates=False
+        )
+        logger.info(f"Webhook Telegram установлен: {settings.telegram_webhook_url}")
+    
+    # Те же хуки, что вызывает start_polling: запуск сервисов и внедрение их в обработчики
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+
+
+async def stop_webhook_bot(app: FastAPI):
+    """Остановка бота в режиме webhook"""
+    # Webhook не удаляем, чтобы апдейты копились у Telegram до следующего запуска
+    from src.api.telegram_webhook import drain_updates
+    
+    dispatcher = app.state.dispatcher
+    await drain_updates()
+    await dispatcher.emit_shutdown(bot=app.state.bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+    await app.state.bot.session.close()
 
 
 # Создание FastAPI приложения
@@ -51,6 +108,14 @@ app.add_middleware(
 
 # Подключение роутеров
 app.include_router(webhook_router, tags=["Webhooks"])
+app.include_router(metrics_router, tags=["Monitoring"])
+app.include_router(admin_router, tags=["Admin"])
+app.include_router(subscription_router, tags=["Subscriptions"])
+if settings.bot_mode == "webhook":
+    # Роутер тянет aiogram, в режиме polling он процессу API не нужен
+    from src.api.telegram_webhook import router as telegram_webhook_router
+    
+    app.include_router(telegram_webhook_router, tags=["Webhooks"])
 
 
 @app.get("/")
@@ -61,3 +126,6 @@ async def root():
         "version": "1.0.0",
         "status": "running"
     }
+
+
+TIMELINE.mark("imports")
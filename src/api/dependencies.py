@@ -0,0 +1,9 @@
+"""Зависимости FastAPI"""
+from fastapi import Request
+
+from src.services.container import ServiceContainer
+
+
+def get_container(request: Request) -> ServiceContainer:
+    """Контейнер сервисов приложения (создаётся в lifespan)"""
+    return request.app.state.container
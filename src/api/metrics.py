@@ -0,0 +1,33 @@
+"""API endpoint с метриками в формате Prometheus"""
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import Response
+
+from src.config.settings import settings
+from src.monitoring.metrics import REGISTRY, CONTENT_TYPE
+
+router = APIRouter()
+
+
+def check_metrics_token(authorization: Optional[str]) -> bool:
+    """Проверить Bearer-токен METRICS_TOKEN (если задан)"""
+    if not settings.metrics_token:
+        return True
+    return hmac.compare_digest(authorization or "", f"Bearer {settings.metrics_token}")
+
+
+@router.get("/metrics")
+async def metrics(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Метрики для Prometheus
+
+    При нескольких воркерах API (API_WORKERS > 1) запрос обслуживает один
+    из процессов, а он отдаёт сумму метрик всех воркеров (см. MetricsExchange).
+    """
+    if not check_metrics_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    exchange = getattr(request.app.state, "metrics_exchange", None)
+    body = exchange.render() if exchange is not None else REGISTRY.render()
+    return Response(body.encode(), headers={"Content-Type": CONTENT_TYPE})
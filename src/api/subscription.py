@@ -0,0 +1,49 @@
+"""Ссылка подписки для VPN-приложений"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
+
+from src.api.dependencies import get_container
+from src.monitoring.metrics import SUBSCRIPTION_FEED_TOTAL
+from src.services.container import ServiceContainer
+
+router = APIRouter()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадает ли ETag с одним из присланных в If-None-Match"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@router.get("/sub/{token}")
+async def subscription_feed(
+    token: str,
+    if_none_match: Optional[str] = Header(None),
+    services: ServiceContainer = Depends(get_container)
+):
+    """
+    Подписка в base64 (список vless-ссылок) для V2Box, v2rayNG и Happ
+
+    Приложение опрашивает её раз в profile-update-interval часов. Если
+    присланный ETag совпадает, отвечаем 304 без тела; ответы кэшируются
+    в памяти процесса (см. SubscriptionFeed).
+    """
+    feed, cached = await services.subscription_feed.get(token)
+    cache = "hit" if cached else "miss"
+    if feed is None:
+        SUBSCRIPTION_FEED_TOTAL.inc(cache, "404")
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+    headers = {**feed.headers, "ETag": feed.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, feed.etag):
+        SUBSCRIPTION_FEED_TOTAL.inc(cache, "304")
+        return Response(status_code=304, headers=headers)
+    SUBSCRIPTION_FEED_TOTAL.inc(cache, "200")
+    return Response(feed.body, media_type="text/plain", headers=headers)
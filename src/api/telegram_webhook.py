@@ -0,0 +1,65 @@
+"""API endpoint для webhook от Telegram (режим BOT_MODE=webhook)"""
+import asyncio
+import hmac
+import logging
+from fastapi import APIRouter, Request, HTTPException, Header
+from typing import Optional, Set
+
+from aiogram.types import Update
+
+from src.config.settings import settings
+from src.monitoring.metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Обработка апдейтов идёт в фоне, ссылки на задачи держим до завершения
+_update_tasks: Set[asyncio.Task] = set()
+QUEUE_DEPTH.track(lambda: len(_update_tasks), "telegram_updates")
+
+
+@router.post(settings.telegram_webhook_path)
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
+    """
+    Webhook для апдейтов Telegram
+
+    Telegram передаёт секрет из setWebhook в заголовке
+    X-Telegram-Bot-Api-Secret-Token. Апдейт передаётся диспетчеру в фоне,
+    чтобы Telegram сразу получил ответ и не копил очередь.
+    """
+    if not hmac.compare_digest(
+        x_telegram_bot_api_secret_token or "",
+        settings.telegram_webhook_secret
+    ):
+        logger.warning("Webhook Telegram с неверным секретом")
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+
+    bot = request.app.state.bot
+    dispatcher = request.app.state.dispatcher
+
+    update = Update.model_validate(await request.json(), context={"bot": bot})
+
+    task = asyncio.create_task(_process_update(dispatcher, bot, update))
+    _update_tasks.add(task)
+    task.add_done_callback(_update_tasks.discard)
+
+    return {"ok": True}
+
+
+async def _process_update(dispatcher, bot, update: Update):
+    """Передать апдейт диспетчеру aiogram"""
+    try:
+        await dispatcher.feed_update(bot, update)
+    except Exception as e:
+        logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+
+
+async def drain_updates(timeout: float = 10.0):
+    """Дождаться обработки принятых апдейтов перед остановкой"""
+    if _update_tasks:
+        logger.info(f"Ожидание обработки {len(_update_tasks)} апдейтов...")
+        await asyncio.wait(set(_update_tasks), timeout=timeout)
@@ -1,41 +1,36 @@
 """API endpoint для webhook от YooKassa"""
 import logging
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Request, HTTPException, Header
+from fastapi import APIRouter, Request, HTTPException, Header, Depends
+from fastapi.responses import JSONResponse
 from typing import Optional
 
 from src.config.settings import settings
-from src.database.models import Database
-from src.services.hiddify_service import HiddifyService
-from src.services.payment_service import PaymentService
-from src.services.notification_service import NotificationService
+from src.api.dependencies import get_container
+from src.monitoring.tracing import SPAN_PAYMENT_TO_KEY, parse_yookassa_time, record_since, span, trace
+from src.services.container import ServiceContainer
+from src.services.subscription_feed import user_key
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Инициализация сервисов
-db = Database(settings.database_path)
-hiddify_service = HiddifyService(
-    settings.hiddify_api_url,
-    settings.hiddify_api_token,
-    settings.server_host,
-    settings.vpn_data_limit_gb
-)
-payment_service = PaymentService(settings.yookassa_shop_id, settings.yookassa_secret_key)
-notification_service = NotificationService(settings.telegram_bot_token)
-
 
 @router.post("/webhook/yookassa")
 async def yookassa_webhook(
     request: Request,
-    x_webhook_secret: Optional[str] = Header(None)
+    x_webhook_secret: Optional[str] = Header(None),
+    services: ServiceContainer = Depends(get_container)
 ):
     """
     Webhook для обработки платежей от YooKassa
     
     Вызывается при изменении статуса платежа
     """
+    db = services.db
+    hiddify_service = services.hiddify_service
+    notification_service = services.notification_service
+    
     try:
         # Получить данные webhook
         webhook_data = await request.json()
@@ -72,58 +67,75 @@ async def yookassa_webhook(
             logger.info(f"Платёж {payment_id} уже обработан")
             return {"status": "ok", "message": "Already processed"}
         
-        # Обновить статус платежа в БД
-        await db.update_payment_status(payment_id, payment_status)
-        
-        if payment_status == "succeeded":
-            # Получить информацию о тарифе
-            tariff_info = settings.get_tariff_info(tariff_id)
-            if not tariff_info:
-                logger.error(f"Неизвестный тариф: {tariff_id}")
-                raise HTTPException(status_code=400, detail="Invalid tariff")
-            
-            # Создать VPN-пользователя в Hiddify (с антиглушилкой если нужно)
-            use_antiblock = tariff_info.get("antiblock", False)
-            vpn_result = await hiddify_service.create_user(
-                expire_days=tariff_info["days"],
-                use_antiblock=use_antiblock
-            )
-            
-            if not vpn_result:
-                logger.error(f"Ошибка создания VPN для платежа {payment_id}")
-                await notification_service.send_message(
-                    telegram_id,
-                    "❌ Ошибка создания VPN. Обратитесь в поддержку с ID платежа: " + payment_id
-                )
-                raise HTTPException(status_code=500, detail="Failed to create VPN")
-            
-            # Создать пользователя в БД (если не существует)
-            user_id = await db.create_user(telegram_id)
-            
-            # Создать подписку в БД
-            await db.create_subscription(
-                user_id=user_id,
-                tariff=tariff_id,
-                hiddify_uuid=vpn_result["uuid"],
-                subscription_url=vpn_result["subscription_url"],
-                days=tariff_info["days"]
-            )
+        async with trace(db, payment_id):
+            # Время от списания денег до получения webhook
+            captured_at = parse_yookassa_time(payment_obj.get("captured_at"))
+            if captured_at:
+                record_since("yookassa.delivery", captured_at)
             
-            # Рассчитать дату окончания
-            expires_at = datetime.now() + timedelta(days=tariff_info["days"])
+            # Обновить статус платежа в БД
+            with span("db.update_payment"):
+                await db.update_payment_status(payment_id, payment_status)
             
-            # Отправить VPN-ключ пользователю
-            success = await notification_service.send_vpn_subscription(
-                chat_id=telegram_id,
-                subscription_url=vpn_result["subscription_url"],
-                tariff_name=tariff_info["name"],
-                expires_at=expires_at.strftime("%d.%m.%Y %H:%M")
-            )
-            
-            if success:
-                logger.info(f"VPN-ключ отправлен пользователю {telegram_id}")
-            else:
-                logger.error(f"Не удалось отправить VPN-ключ пользователю {telegram_id}")
+            if payment_status == "succeeded":
+                # Получить информацию о тарифе
+                tariff = settings.get_tariff(tariff_id)
+                if not tariff:
+                    logger.error(f"Неизвестный тариф: {tariff_id}")
+                    raise HTTPException(status_code=400, detail="Invalid tariff")
+                
+                # Создать VPN-пользователя в Hiddify (с антиглушилкой если нужно)
+                with span("panel.create_user") as step:
+                    vpn_result = await hiddify_service.create_user(
+                        expire_days=tariff.days,
+                        use_antiblock=tariff.antiblock
+                    )
+                    if not vpn_result:
+                        step.fail("Панель не создала клиента")
+                
+                if not vpn_result:
+                    logger.error(f"Ошибка создания VPN для платежа {payment_id}")
+                    await notification_service.send_message(
+                        telegram_id,
+                        "❌ Ошибка создания VPN. Обратитесь в поддержку с ID платежа: " + payment_id
+                    )
+                    raise HTTPException(status_code=500, detail="Failed to create VPN")
+                
+                with span("db.create_subscription"):
+                    # Создать пользователя в БД (если не существует)
+                    user_id = await db.create_user(telegram_id)
+                    
+                    # Создать подписку в БД
+                    await db.create_subscription(
+                        user_id=user_id,
+                        tariff=tariff_id,
+                        hiddify_uuid=vpn_result["uuid"],
+                        subscription_url=vpn_result["subscription_url"],
+                        days=tariff.days,
+                        inbound_id=vpn_result["inbound_id"]
+                    )
+                    key = await user_key(db, telegram_id, vpn_result["subscription_url"])
+                
+                # Рассчитать дату окончания
+                expires_at = datetime.now() + timedelta(days=tariff.days)
+                
+                # Отправить VPN-ключ пользователю
+                with span("telegram.send_key") as step:
+                    success = await notification_service.send_vpn_subscription(
+                        chat_id=telegram_id,
+                        subscription_url=key,
+                        tariff_name=tariff.name,
+                        expires_at=expires_at.strftime("%d.%m.%Y %H:%M")
+                    )
+                    if not success:
+                        step.fail("Сообщение не доставлено")
+                
+                if success:
+                    logger.info(f"VPN-ключ отправлен пользователю {telegram_id}")
+                    if captured_at:
+                        record_since(SPAN_PAYMENT_TO_KEY, captured_at)
+                else:
+                    logger.error(f"Не удалось отправить VPN-ключ пользователю {telegram_id}")
         
         return {"status": "ok"}
         
@@ -140,3 +152,16 @@ async def health_check():
         "service": "vpn-bot-api",
         "timestamp": datetime.now().isoformat()
     }
+
+
+@router.get("/ready")
+async def readiness_check(services: ServiceContainer = Depends(get_container)):
+    """
+    Готовность инстанса принимать webhook'и
+    
+    Отдаёт кэшированные результаты фоновых проверок: запись в базу,
+    доступность панели и сессия, учётные данные ЮKassa, очереди.
+    503, если критичная проверка не прошла или давно не обновлялась.
+    """
+    ready, body = services.readiness.snapshot()
+    return JSONResponse(body, status_code=200 if ready else 503)
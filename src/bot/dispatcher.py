@@ -0,0 +1,86 @@
+"""Сборка бота и диспетчера aiogram"""
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+from src.config.settings import Settings, on_settings_reload, settings
+from src.bot.handlers import router as bot_router
+from src.bot.middlewares import MetricsMiddleware, TelegramRequestMetrics, ThrottlingMiddleware
+from src.monitoring.startup import TIMELINE
+from src.services.container import ServiceContainer, container
+from src.services.lease import LeasedJob
+
+logger = logging.getLogger(__name__)
+
+
+def create_bot() -> Bot:
+    """Создать экземпляр бота"""
+    session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    bot = Bot(token=settings.telegram_bot_token, session=session, parse_mode=ParseMode.HTML)
+    bot.session.middleware(TelegramRequestMetrics())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создать диспетчер с зарегистрированными роутерами и хуками жизненного цикла"""
+    throttling = ThrottlingMiddleware(
+        rate=settings.throttle_rate,
+        burst=settings.throttle_burst,
+        expensive_rate=settings.throttle_expensive_rate,
+        expensive_burst=settings.throttle_expensive_burst
+    )
+    
+    @on_settings_reload
+    def apply_throttle_limits(config: Settings):
+        throttling.configure(
+            config.throttle_rate,
+            config.throttle_burst,
+            config.throttle_expensive_rate,
+            config.throttle_expensive_burst
+        )
+    
+    dp = Dispatcher(container=container, throttling=throttling)
+    # Outer middleware диспетчера срабатывает до фильтров всех роутеров
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    # Inner middleware наследуются вложенными роутерами и видят найденный обработчик
+    metrics = MetricsMiddleware()
+    dp.message.middleware(metrics)
+    dp.callback_query.middleware(metrics)
+    dp.include_router(bot_router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher, container: ServiceContainer):
+    """Запуск сервисов и передача их в обработчики"""
+    await container.startup()
+    container.payment_service.configure()
+    dispatcher.workflow_data.update(container.handler_dependencies())
+    container.notification_service.attach_bot(bot)
+
+    # Продолжить рассылки, прерванные перезапуском или падением другого процесса
+    container.add_job(LeasedJob(
+        container.db,
+        "broadcast_supervisor",
+        interval=60.0,
+        job=lambda: container.broadcast_service.resume_interrupted(bot)
+    ))
+    # То же для массового перевода ключей
+    container.add_job(LeasedJob(
+        container.db,
+        "key_migration_supervisor",
+        interval=60.0,
+        job=lambda: container.key_migration_service.resume_interrupted(bot)
+    ))
+    logger.info("Сервисы бота запущены")
+    TIMELINE.mark("ready")
+
+
+async def on_shutdown(container: ServiceContainer):
+    """Остановка сервисов"""
+    await container.shutdown()
@@ -1,20 +1,33 @@
 """Обработчики команд Telegram-бота"""
+import html
 import logging
-import asyncio
-import aiosqlite
+import time
 from datetime import datetime, timedelta
-from functools import lru_cache
+from typing import Tuple
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, User, BufferedInputFile
 from aiogram.fsm.context import FSMContext
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from pydantic import ValidationError
 
-from src.config.settings import settings
+from src.config.settings import reload_settings, settings
 from src.database.models import Database
+from src.database.profiling import PROFILER, format_top
 from src.services.payment_service import PaymentService
 from src.services.hiddify_service import HiddifyService
-from src.services.notification_service import NotificationService
+from src.services.broadcast_service import BroadcastService, SEGMENT_TITLES, format_broadcast_status
+from src.services.key_migration import KeyMigrationService, format_key_migration_status
+from src.services.singleflight import ProvisioningGuard, ProvisioningInProgress
+from src.services.subscription_feed import user_key
+from src.monitoring.profiler import SAMPLER, ProfilerBusy, format_profile
+from src.monitoring.tracing import format_summary, format_trace, span, summarize, trace
+from src.bot.middlewares import ThrottlingMiddleware
+from src.bot.templates import (
+    SubscriptionView,
+    render_main_screen,
+    render_subscription_screen
+)
 from src.bot.keyboards import (
     get_tariffs_keyboard, 
     get_payment_keyboard, 
@@ -22,117 +35,58 @@ from src.bot.keyboards import (
     get_admin_keyboard,
     get_normal_tariffs_keyboard,
     get_antiblock_tariffs_keyboard,
-    get_upgrade_keyboard
+    get_upgrade_keyboard,
+    get_broadcast_control_keyboard,
+    get_broadcast_segments_keyboard,
+    get_broadcast_confirm_keyboard,
+    get_key_migration_confirm_keyboard,
+    get_key_migration_control_keyboard
 )
 
 logger = logging.getLogger(__name__)
 
 router = Router()
-db = Database(settings.database_path)
-payment_service = PaymentService(settings.yookassa_shop_id, settings.yookassa_secret_key)
-hiddify_service = HiddifyService(
-    settings.hiddify_api_url,
-    settings.hiddify_api_token,
-    settings.server_host,
-    settings.vpn_data_limit_gb
-)
-notification_service = NotificationService(settings.telegram_bot_token)
-
-# Кэшируем информацию о тарифах для ускорения работы
-@lru_cache(maxsize=10)
-def get_cached_tariff_info(tariff_id: str):
-    """Возвращает кэшированную информацию о конкретном тарифе"""
-    return settings.get_tariff_info(tariff_id)
 
 
-@router.message(Command("start"))
-async def cmd_start(message: Message):
-    """Обработчик команды /start"""
-    user = message.from_user
-    
-    # Создать пользователя в БД (если новый)
-    await db.create_user(user.id, user.username)
-    
-    # Получить информацию о подписке
+async def render_main_menu(db: Database, user: User, welcome: bool = True) -> Tuple[str, InlineKeyboardMarkup]:
+    """Главный экран: профиль, состояние подписки и меню"""
     subscription = await db.get_active_subscription(user.id)
+    view = SubscriptionView(subscription) if subscription else None
+    
+    # Пробный период доступен, если не использован и подписок ещё не было
+    trial_unused = settings.trial_enabled and not await db.has_used_trial(user.id)
+    show_trial = trial_unused and not await db.has_any_subscription(user.id)
     
     # Формируем имя пользователя
     user_name = user.first_name or user.username or "Пользователь"
     
-    # Формируем блок профиля
-    profile_text = f"""
-🛡️ <b>Добро пожаловать в AI VPN!</b>
-
-👤 <b>Профиль:</b>
-• ID: <code>{user.id}</code>
-• Имя: {user_name}
-"""
-    
-    # Формируем блок подписки
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        
-        if subscription["tariff"] == "trial":
-            tariff_name = f"🎁 Пробный период"
-        else:
-            tariff_info = get_cached_tariff_info(subscription["tariff"])
-            tariff_name = tariff_info["name"] if tariff_info else subscription["tariff"]
-        
-        if days_left > 0:
-            subscription_text = f"""
-📦 <b>Подписка:</b>
-• Тариф: {tariff_name}
-• Срок действия до: {expires_at.strftime("%d.%m.%Y")}
-• Осталось дней: <b>{days_left}</b>
-"""
-        else:
-            subscription_text = f"""
-⚠️ <b>Подписка:</b>
-• Срок действия истек: {expires_at.strftime("%d.%m.%Y")}
-
-<i>Ваш бесплатный пробный период закончился. Оформите подписку, чтобы продолжить пользоваться сервисом!</i>
-"""
-    else:
-        # Проверить доступность пробного периода
-        has_trial = await db.has_used_trial(user.id)
-        
-        if not has_trial and settings.trial_enabled:
-            subscription_text = f"""
-🎁 <b>Пробная подписка:</b>
-• Доступно <b>{settings.trial_period_days} дней бесплатно!</b>
+    text = render_main_screen(user.id, user_name, view, trial_unused, welcome)
+    keyboard = get_tariffs_keyboard(
+        show_trial=show_trial,
+        has_active_subscription=view is not None and view.is_active
+    )
+    return text, keyboard
 
-<i>Попробуйте наш VPN бесплатно без привязки карты.</i>
-"""
-        else:
-            subscription_text = """
-📭 <b>Подписка:</b>
-• Срок действия истек.
 
-<i>Выберите тариф для продолжения использования.</i>
-"""
-    
-    welcome_text = profile_text + subscription_text
+@router.message(Command("start"))
+async def cmd_start(message: Message, db: Database):
+    """Обработчик команды /start"""
+    user = message.from_user
     
-    # Проверить доступность пробного периода для кнопки
-    show_trial = False
-    if settings.trial_enabled:
-        has_trial = await db.has_used_trial(user.id)
-        has_subs = await db.has_any_subscription(user.id)
-        show_trial = not has_trial and not has_subs
+    # Создать пользователя в БД (если новый)
+    await db.create_user(user.id, user.username)
     
-    # Проверить наличие активной подписки для кнопки обновления
-    has_active_sub = False
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        has_active_sub = days_left > 0
-
-    await message.answer(welcome_text, reply_markup=get_tariffs_keyboard(show_trial=show_trial, has_active_subscription=has_active_sub))
+    text, keyboard = await render_main_menu(db, user)
+    await message.answer(text, reply_markup=keyboard)
 
 
 @router.callback_query(F.data == "get_trial")
-async def process_trial_request(callback: CallbackQuery):
+async def process_trial_request(
+    callback: CallbackQuery,
+    db: Database,
+    hiddify_service: HiddifyService,
+    provisioning_guard: ProvisioningGuard
+):
     """Обработчик запроса пробного периода"""
     user = callback.from_user
     
@@ -140,26 +94,48 @@ async def process_trial_request(callback: CallbackQuery):
     has_trial = await db.has_used_trial(user.id)
     
     if has_trial:
-        # Пробный период уже использован
         await callback.answer()
-        await callback.message.edit_text(
-            """
+        await show_trial_already_used(callback)
+        return
+    
+    # Выдать пробный период
+    await callback.answer()
+    
+    # Повторное нажатие, пока ключ создаётся, не создаёт второго клиента в панели
+    try:
+        await provisioning_guard.run("trial", user.id, lambda: issue_trial(callback, db, hiddify_service))
+    except ProvisioningInProgress:
+        pass
+
+
+async def show_trial_already_used(callback: CallbackQuery):
+    """Сообщить, что пробный период уже использован"""
+    await callback.message.edit_text(
+        """
 ❌ <b>Пробный период уже использован</b>
 
 Вы уже получали бесплатный пробный период ранее.
 
 Выберите один из платных тарифов, чтобы продолжить пользоваться VPN.
 """,
-            reply_markup=get_back_keyboard()
-        )
+        reply_markup=get_back_keyboard()
+    )
+
+
+async def issue_trial(callback: CallbackQuery, db: Database, hiddify_service: HiddifyService):
+    """Создать пробный доступ и отправить ключ"""
+    user = callback.from_user
+    
+    # Занять пробный период в БД до обращения к панели: защита от гонки между процессами
+    if not await db.claim_trial(user.id):
+        await show_trial_already_used(callback)
         return
     
-    # Выдать пробный период
-    await callback.answer()
     await callback.message.edit_text(
         "⏳ <b>Создание пробного доступа...</b>\n\nПодождите несколько секунд."
     )
     
+    issued = False
     try:
         # Получить user_id из БД
         user_data = await db.get_user_by_telegram_id(user.id)
@@ -186,11 +162,11 @@ async def process_trial_request(callback: CallbackQuery):
             tariff="trial",
             hiddify_uuid=vpn_result["uuid"],
             subscription_url=vpn_result["subscription_url"],
-            days=settings.trial_period_days
+            days=settings.trial_period_days,
+            inbound_id=vpn_result["inbound_id"]
         )
-        
-        # Отметить, что пробный период использован
-        await db.mark_trial_used(user.id)
+        issued = True
+        key = settings.subscription_link(user_data["sub_token"]) or vpn_result["subscription_url"]
         
         # Отправить VPN-ключ
         expires_at = datetime.now() + timedelta(days=settings.trial_period_days)
@@ -200,7 +176,7 @@ async def process_trial_request(callback: CallbackQuery):
 🎁 <b>Вы получили {settings.trial_period_days} дней бесплатного доступа!</b>
 
 🔑 <b>Ваш VPN-ключ:</b>
-<code>{vpn_result["subscription_url"]}</code>
+<code>{key}</code>
 
 📅 <b>Действует до:</b> {expires_at.strftime("%d.%m.%Y %H:%M")}
 
@@ -225,43 +201,53 @@ async def process_trial_request(callback: CallbackQuery):
         await callback.message.edit_text(
             "❌ <b>Произошла ошибка</b>\n\nПопробуйте позже или обратитесь в поддержку."
         )
+    finally:
+        if not issued:
+            # Доступ не выдан - пробный период можно запросить снова
+            await db.release_trial(user.id)
 
 
 @router.callback_query(F.data.startswith("tariff:"))
-async def process_tariff_selection(callback: CallbackQuery):
+async def process_tariff_selection(callback: CallbackQuery, db: Database, payment_service: PaymentService):
     """Обработчик выбора тарифа"""
     tariff_id = callback.data.split(":")[1]
-    tariff_info = get_cached_tariff_info(tariff_id)
+    tariff = settings.get_tariff(tariff_id)
     
-    if not tariff_info:
+    if not tariff:
         await callback.answer("❌ Тариф не найден")
         return
     
-    # Создать платёж
-    payment_data = payment_service.create_payment(
-        amount=tariff_info["price"],
-        telegram_id=callback.from_user.id,
-        tariff_id=tariff_id,
-        tariff_name=tariff_info["name"]
-    )
-    
-    if not payment_data:
-        await callback.message.answer("❌ Ошибка создания платежа. Попробуйте позже.")
-        return
-    
-    # Сохранить платёж в БД
-    await db.create_payment(
-        telegram_id=callback.from_user.id,
-        yookassa_payment_id=payment_data["payment_id"],
-        amount=tariff_info["price"],
-        tariff=tariff_id
-    )
+    # ID трассы - ID платежа, он известен только после создания
+    async with trace(db, None, root="payment.create") as payment_trace:
+        # Создать платёж
+        with span("yookassa.create_payment"):
+            payment_data = payment_service.create_payment(
+                amount=tariff.price,
+                telegram_id=callback.from_user.id,
+                tariff_id=tariff_id,
+                tariff_name=tariff.name
+            )
+        
+        if not payment_data:
+            await callback.message.answer("❌ Ошибка создания платежа. Попробуйте позже.")
+            return
+        
+        payment_trace.trace_id = payment_data["payment_id"]
+        
+        # Сохранить платёж в БД
+        with span("db.create_payment"):
+            await db.create_payment(
+                telegram_id=callback.from_user.id,
+                yookassa_payment_id=payment_data["payment_id"],
+                amount=tariff.price,
+                tariff=tariff_id
+            )
     
     payment_text = f"""
 💰 <b>Оплата подписки</b>
 
-📦 <b>Тариф:</b> {tariff_info["name"]}
-💵 <b>Стоимость:</b> {tariff_info["price_rub"]:.0f} ₽
+📦 <b>Тариф:</b> {tariff.name}
+💵 <b>Стоимость:</b> {tariff.price_rub:.0f} ₽
 
 После успешной оплаты вы автоматически получите VPN-ключ.
 
@@ -276,138 +262,20 @@ async def process_tariff_selection(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "my_subscription")
-async def show_subscription(callback: CallbackQuery):
+async def show_subscription(callback: CallbackQuery, db: Database):
     """Показать информацию о подписке"""
     subscription = await db.get_active_subscription(callback.from_user.id)
-    
-    if not subscription:
-        text = """
-📭 <b>У вас нет активной подписки</b>
-
-Выберите тариф, чтобы продолжить пользоваться VPN.
-"""
-    else:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        
-        # Определить название тарифа
-        if subscription["tariff"] == "trial":
-            tariff_name = f"🎁 Пробный период"
-        else:
-            tariff_info = get_cached_tariff_info(subscription["tariff"])
-            tariff_name = tariff_info["name"] if tariff_info else subscription["tariff"]
-        
-        # Статус подписки
-        if days_left > 0:
-            status_emoji = "✅"
-            status_text = f"Активна | Осталось <b>{days_left} дн.</b>"
-        else:
-            status_emoji = "⚠️"
-            status_text = f"Истекла {expires_at.strftime('%d.%m.%Y')}"
-        
-        text = f"""
-{status_emoji} <b>Ваша подписка</b>
-
-📦 <b>Тариф:</b> {tariff_name}
-📅 <b>Статус:</b> {status_text}
-📅 <b>Действует до:</b> {expires_at.strftime("%d.%m.%Y")}
-
-🔑 <b>Ваш VPN-ключ:</b>
-<code>{subscription["subscription_url"]}</code>
-
-📱 <b>Как подключиться:</b>
-1. Скопируйте ключ выше (нажмите на него)
-2. Откройте V2Box, Happ Plus или v2rayNG
-3. Нажмите "+" → "Вставить из буфера"
-
-❓ Вопросы? Пишите @tipss94
-"""
+    text = render_subscription_screen(SubscriptionView(subscription) if subscription else None)
     
     await callback.message.edit_text(text, reply_markup=get_back_keyboard())
     await callback.answer()
 
 
 @router.callback_query(F.data == "back_to_tariffs")
-async def back_to_tariffs(callback: CallbackQuery):
+async def back_to_tariffs(callback: CallbackQuery, db: Database):
     """Вернуться к выбору тарифов"""
-    user = callback.from_user
-    
-    # Получить информацию о подписке
-    subscription = await db.get_active_subscription(user.id)
-    
-    # Формируем имя пользователя
-    user_name = user.first_name or user.username or "Пользователь"
-    
-    # Формируем блок профиля
-    profile_text = f"""
-🛡️ <b>Добро пожаловать в AI VPN!</b>
-
-👤 <b>Профиль:</b>
-• ID: <code>{user.id}</code>
-• Имя: {user_name}
-"""
-    
-    # Формируем блок подписки
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        
-        if subscription["tariff"] == "trial":
-            tariff_name = f"🎁 Пробный период"
-        else:
-            tariff_info = get_cached_tariff_info(subscription["tariff"])
-            tariff_name = tariff_info["name"] if tariff_info else subscription["tariff"]
-        
-        if days_left > 0:
-            subscription_text = f"""
-📦 <b>Подписка:</b>
-• Тариф: {tariff_name}
-• Срок действия до: {expires_at.strftime("%d.%m.%Y")}
-• Осталось дней: <b>{days_left}</b>
-"""
-        else:
-            subscription_text = f"""
-⚠️ <b>Подписка:</b>
-• Срок действия истек: {expires_at.strftime("%d.%m.%Y")}
-
-<i>Ваш бесплатный пробный период закончился. Оформите подписку, чтобы продолжить пользоваться сервисом!</i>
-"""
-    else:
-        # Проверить доступность пробного периода
-        has_trial = await db.has_used_trial(user.id)
-        
-        if not has_trial and settings.trial_enabled:
-            subscription_text = f"""
-🎁 <b>Пробная подписка:</b>
-• Доступно <b>{settings.trial_period_days} дней бесплатно!</b>
-
-<i>Попробуйте наш VPN бесплатно без привязки карты.</i>
-"""
-        else:
-            subscription_text = """
-📭 <b>Подписка:</b>
-• Срок действия истек.
-
-<i>Выберите тариф для продолжения использования.</i>
-"""
-    
-    text = profile_text + subscription_text
-    
-    # Проверить доступность пробного периода для кнопки
-    show_trial = False
-    if settings.trial_enabled:
-        has_trial = await db.has_used_trial(callback.from_user.id)
-        has_subs = await db.has_any_subscription(callback.from_user.id)
-        show_trial = not has_trial and not has_subs
-    
-    # Проверить наличие активной подписки для кнопки обновления
-    has_active_sub = False
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        has_active_sub = days_left > 0
-    
-    await callback.message.edit_text(text, reply_markup=get_tariffs_keyboard(show_trial=show_trial, has_active_subscription=has_active_sub))
+    text, keyboard = await render_main_menu(db, callback.from_user)
+    await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
 
@@ -568,95 +436,245 @@ async def cmd_admin(message: Message):
     )
 
 
+@router.message(Command("reload"))
+async def cmd_reload(message: Message):
+    """Перечитать настройки из .env (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    try:
+        reload_settings()
+    except ValidationError as e:
+        errors = "\n".join(f"• {error['msg']}" for error in e.errors())
+        await message.answer(f"❌ <b>Настройки не применены</b>\n\n{errors}", parse_mode="HTML")
+        return
+    
+    await message.answer(
+        "✅ <b>Настройки перезагружены</b>\n\n"
+        "Тарифы, администраторы, пробный период и лимиты антифлуда, рассылок "
+        "и перевода ключей применены в этом процессе. "
+        "API в отдельном процессе подхватит их после перезапуска.",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("trace"))
+async def cmd_trace(message: Message, db: Database):
+    """Шаги обработки платежа: /trace <ID платежа ЮKassa> (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    args = message.text.split()
+    if len(args) != 2:
+        await message.answer("Использование: <code>/trace ID_платежа</code>", parse_mode="HTML")
+        return
+    
+    payment_id = args[1]
+    spans = await db.get_trace_spans(payment_id)
+    await message.answer(format_trace(payment_id, spans), parse_mode="HTML")
+
+
+@router.message(Command("trace_summary"))
+async def cmd_trace_summary(message: Message, db: Database):
+    """Перцентили времени "оплата -> ключ" по шагам: /trace_summary [дней] (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    args = message.text.split()
+    days = int(args[1]) if len(args) > 1 and args[1].isdigit() and int(args[1]) > 0 else 7
+    durations = await db.get_span_durations(time.time() - days * 86400)
+    await message.answer(format_summary(summarize(durations), days), parse_mode="HTML")
+
+
+@router.message(Command("slow_queries"))
+async def cmd_slow_queries(message: Message):
+    """Самые тяжёлые SQL-запросы процесса: /slow_queries [N] [total|max|avg] (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    args = message.text.split()[1:]
+    limit = int(args[0]) if args and args[0].isdigit() and int(args[0]) > 0 else 10
+    order = args[1] if len(args) > 1 and args[1] in ("total", "max", "avg") else "total"
+    await message.answer(
+        format_top(PROFILER.top(min(limit, 20), order), PROFILER.slow_ms),
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """Профилировать event loop процесса бота: /profile [секунд] (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    args = message.text.split()
+    seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() and int(args[1]) > 0 else 10
+    seconds = min(seconds, settings.profile_max_seconds)
+    
+    await message.answer(f"🔥 Профилирование {seconds} с...")
+    try:
+        profile = await SAMPLER.profile(seconds)
+    except ProfilerBusy:
+        await message.answer("⏳ Профилирование уже запущено")
+        return
+    
+    await message.answer(format_profile(profile), parse_mode="HTML")
+    await message.answer_document(
+        BufferedInputFile(profile.collapsed().encode(), filename=f"profile-{int(time.time())}.txt")
+    )
+
+
+@router.message(Command("migrate_keys"))
+async def cmd_migrate_keys(message: Message, hiddify_service: HiddifyService, key_migration_service: KeyMigrationService):
+    """Перевести активные подписки на другой inbound: /migrate_keys [ID inbound'а] (только для администраторов)"""
+    if not settings.is_admin(message.from_user.id):
+        await message.answer("⛔️ У вас нет доступа к админ-панели")
+        return
+    
+    args = message.text.split()
+    if len(args) != 2 or not args[1].isdigit():
+        inbounds = await hiddify_service.get_inbounds(force=True) or []
+        lines = [
+            f"• <code>{ib['id']}</code> {html.escape(ib['remark'])} "
+            f"({ib['streamSettings'].get('network', 'tcp')}/{ib['streamSettings'].get('security', 'none')})"
+            for ib in inbounds
+        ]
+        await message.answer(
+            "🔄 <b>Перевод ключей</b>\n\n"
+            "Использование: <code>/migrate_keys ID_inbound</code>\n\n"
+            "Активные подписки того же режима (обычный или антиглушилка) получат "
+            "клиентов на этом inbound'е, старые клиенты будут отключены, "
+            "пользователи получат новый ключ.\n\n"
+            "<b>Inbound'ы панели:</b>\n" + ("\n".join(lines) or "❌ Панель недоступна"),
+            parse_mode="HTML"
+        )
+        return
+    
+    inbound_id = int(args[1])
+    preview = await key_migration_service.preview(inbound_id)
+    if preview is None:
+        await message.answer(f"❌ Inbound {inbound_id} не найден в панели")
+        return
+    
+    mode = "🛡️ Антиглушилка" if preview["antiblock"] else "⚡️ Обычный VPN"
+    await message.answer(
+        "🔄 <b>Перевод ключей</b>\n\n"
+        f"🎯 Inbound: <b>{inbound_id}</b> {html.escape(preview['inbound']['remark'])}\n"
+        f"📦 Режим: {mode}\n"
+        f"👥 Подписок к переводу: <b>{preview['total']}</b>\n\n"
+        "❓ Запустить перевод?",
+        reply_markup=get_key_migration_confirm_keyboard(inbound_id),
+        parse_mode="HTML"
+    )
+
+
 @router.callback_query(F.data == "admin_stats")
-async def admin_stats(callback: CallbackQuery):
+async def admin_stats(callback: CallbackQuery, db: Database, throttling: ThrottlingMiddleware):
     """Показать статистику"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
         return
     
     # Получить статистику из БД
-    async with aiosqlite.connect(db.db_path) as conn:
-        cursor = await conn.execute("SELECT COUNT(*) FROM users")
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute("SELECT COUNT(*) FROM subscriptions WHERE is_active = 1")
-        active_subs = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute("SELECT COUNT(*) FROM payments WHERE status = 'succeeded'")
-        total_payments = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute("SELECT SUM(amount) FROM payments WHERE status = 'succeeded'")
-        total_revenue = (await cursor.fetchone())[0] or 0
-        
-        text = (
-            "📊 <b>Статистика бота</b>\n\n"
-            f"👥 Всего пользователей: <b>{total_users}</b>\n"
-            f"📝 Активных подписок: <b>{active_subs}</b>\n"
-            f"💰 Успешных платежей: <b>{total_payments}</b>\n"
-            f"💵 Общий доход: <b>{total_revenue / 100:.2f} ₽</b>"
+    stats = await db.get_stats()
+    text = (
+        "📊 <b>Статистика бота</b>\n\n"
+        f"👥 Всего пользователей: <b>{stats['total_users']}</b>\n"
+        f"📝 Активных подписок: <b>{stats['active_subscriptions']}</b>\n"
+        f"💰 Успешных платежей: <b>{stats['succeeded_payments']}</b>\n"
+        f"💵 Общий доход: <b>{stats['revenue'] / 100:.2f} ₽</b>"
+    )
+    
+    throttled = throttling.stats()
+    if throttled:
+        text += (
+            "\n\n🚦 <b>Антифлуд</b> (с запуска):\n"
+            f"• Отклонено запросов: <b>{throttled.get('default', 0)}</b>\n"
+            f"• Отклонено дорогих действий: <b>{throttled.get('expensive', 0)}</b>"
         )
-        
-        await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
-        await callback.answer()
+    
+    await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
+    await callback.answer()
 
 
 @router.callback_query(F.data == "admin_users")
-async def admin_users(callback: CallbackQuery):
+async def admin_users(callback: CallbackQuery, db: Database):
     """Показать список пользователей"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
         return
     
-    async with aiosqlite.connect(db.db_path) as conn:
-        cursor = await conn.execute(
-            "SELECT telegram_id, created_at FROM users ORDER BY created_at DESC LIMIT 20"
-        )
-        users = await cursor.fetchall()
-        
-        text = "👥 <b>Последние 20 пользователей:</b>\n\n"
-        for user in users:
-            text += f"ID: <code>{user[0]}</code> | {user[1]}\n"
-        
-        await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
-        await callback.answer()
+    users = await db.get_recent_users(20)
+    
+    text = "👥 <b>Последние 20 пользователей:</b>\n\n"
+    for telegram_id, created_at in users:
+        text += f"ID: <code>{telegram_id}</code> | {created_at}\n"
+    
+    await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
+    await callback.answer()
 
 
 @router.callback_query(F.data == "admin_subscriptions")
-async def admin_subscriptions(callback: CallbackQuery):
+async def admin_subscriptions(callback: CallbackQuery, db: Database):
     """Показать активные подписки"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
         return
     
-    async with aiosqlite.connect(db.db_path) as conn:
-        cursor = await conn.execute("""
-            SELECT s.id, u.telegram_id, s.tariff, s.expires_at, s.hiddify_uuid
-            FROM subscriptions s
-            JOIN users u ON s.user_id = u.id
-            WHERE s.is_active = 1
-            ORDER BY s.created_at DESC
-            LIMIT 15
-        """)
-        subs = await cursor.fetchall()
-        
-        if not subs:
-            text = "📝 <b>Нет активных подписок</b>"
-        else:
-            text = "📝 <b>Активные подписки (последние 15):</b>\n\n"
-            for sub in subs:
-                tariff_name = sub[2] if sub[2] != "trial" else "Пробный период"
-                text += (
-                    f"🆔 <code>{sub[1]}</code> | {tariff_name}\n"
-                    f"   Истекает: {sub[3]}\n\n"
-                )
-        
-        await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
-        await callback.answer()
+    subs = await db.get_recent_active_subscriptions(15)
+    
+    if not subs:
+        text = "📝 <b>Нет активных подписок</b>"
+    else:
+        text = "📝 <b>Активные подписки (последние 15):</b>\n\n"
+        for sub in subs:
+            tariff_name = sub["tariff"] if sub["tariff"] != "trial" else "Пробный период"
+            text += (
+                f"🆔 <code>{sub['telegram_id']}</code> | {tariff_name}\n"
+                f"   Истекает: {sub['expires_at']}\n\n"
+            )
+    
+    await callback.message.edit_text(text, reply_markup=get_admin_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+
+async def create_admin_test_vpn(
+    db: Database,
+    hiddify_service: HiddifyService,
+    telegram_id: int,
+    use_antiblock: bool,
+    tariff: str
+):
+    """Создать тестовый VPN на 30 дней и сохранить подписку администратора"""
+    vpn_data = await hiddify_service.create_user(expire_days=30, use_antiblock=use_antiblock)
+    if not vpn_data:
+        return None
+
+    user = await db.get_user_by_telegram_id(telegram_id)
+    if user:
+        await db.create_subscription(
+            user_id=user["id"],
+            tariff=tariff,
+            hiddify_uuid=vpn_data["uuid"],
+            subscription_url=vpn_data["subscription_url"],
+            days=30,
+            inbound_id=vpn_data["inbound_id"]
+        )
+    return vpn_data
 
 
 @router.callback_query(F.data == "admin_test_vpn")
-async def admin_test_vpn(callback: CallbackQuery):
+async def admin_test_vpn(
+    callback: CallbackQuery,
+    db: Database,
+    hiddify_service: HiddifyService,
+    provisioning_guard: ProvisioningGuard
+):
     """Создать тестовый VPN для админа (обычный)"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
@@ -664,28 +682,19 @@ async def admin_test_vpn(callback: CallbackQuery):
 
     await callback.answer("⏳ Создаю обычный VPN...", show_alert=False)
 
-    # Создать VPN на 30 дней
-    vpn_data = await hiddify_service.create_user(expire_days=30, use_antiblock=False)
+    # Двойное нажатие не создаёт второго клиента в панели
+    try:
+        vpn_data, shared = await provisioning_guard.run(
+            "admin_test_vpn",
+            callback.from_user.id,
+            lambda: create_admin_test_vpn(db, hiddify_service, callback.from_user.id, use_antiblock=False, tariff="admin_test")
+        )
+    except ProvisioningInProgress:
+        return
+    if shared:
+        return
 
     if vpn_data:
-        # Получить user_id
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute(
-                "SELECT id FROM users WHERE telegram_id = ?",
-                (callback.from_user.id,)
-            )
-            user = await cursor.fetchone()
-
-            if user:
-                # Сохранить подписку
-                await db.create_subscription(
-                    user_id=user[0],
-                    tariff="admin_test",
-                    hiddify_uuid=vpn_data["uuid"],
-                    subscription_url=vpn_data["subscription_url"],
-                    days=30
-                )
-
         text = (
             "✅ <b>Тестовый VPN создан!</b>\n\n"
             "⚡️ <b>Режим:</b> Обычный (Reality)\n"
@@ -712,7 +721,12 @@ async def admin_test_vpn(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "admin_test_antiblock")
-async def admin_test_antiblock(callback: CallbackQuery):
+async def admin_test_antiblock(
+    callback: CallbackQuery,
+    db: Database,
+    hiddify_service: HiddifyService,
+    provisioning_guard: ProvisioningGuard
+):
     """Создать тестовый VPN с обходом глушилок для админа"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
@@ -720,28 +734,19 @@ async def admin_test_antiblock(callback: CallbackQuery):
 
     await callback.answer("⏳ Создаю VPN с обходом глушилок...", show_alert=False)
 
-    # Создать VPN на 30 дней с режимом антиглушилки
-    vpn_data = await hiddify_service.create_user(expire_days=30, use_antiblock=True)
+    # Двойное нажатие не создаёт второго клиента в панели
+    try:
+        vpn_data, shared = await provisioning_guard.run(
+            "admin_test_antiblock",
+            callback.from_user.id,
+            lambda: create_admin_test_vpn(db, hiddify_service, callback.from_user.id, use_antiblock=True, tariff="admin_test_antiblock")
+        )
+    except ProvisioningInProgress:
+        return
+    if shared:
+        return
 
     if vpn_data:
-        # Получить user_id
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute(
-                "SELECT id FROM users WHERE telegram_id = ?",
-                (callback.from_user.id,)
-            )
-            user = await cursor.fetchone()
-
-            if user:
-                # Сохранить подписку
-                await db.create_subscription(
-                    user_id=user[0],
-                    tariff="admin_test_antiblock",
-                    hiddify_uuid=vpn_data["uuid"],
-                    subscription_url=vpn_data["subscription_url"],
-                    days=30
-                )
-
         text = (
             "✅ <b>Тестовый VPN создан!</b>\n\n"
             "🛡️ <b>Режим:</b> Обход глушилок (Reality)\n"
@@ -769,198 +774,224 @@ async def admin_test_antiblock(callback: CallbackQuery):
 
 
 @router.message()
-async def echo_handler(message: Message):
+async def echo_handler(message: Message, db: Database):
     """Обработчик остальных сообщений"""
-    user = message.from_user
-    
-    # Получить информацию о подписке
-    subscription = await db.get_active_subscription(user.id)
-    
-    # Формируем имя пользователя
-    user_name = user.first_name or user.username or "Пользователь"
-    
-    # Формируем блок профиля
-    profile_text = f"""
-🛡️ <b>AI VPN</b>
+    text, keyboard = await render_main_menu(db, message.from_user, welcome=False)
+    await message.answer(text, reply_markup=keyboard)
+
+
+# Текст рассылки о новом протоколе
+BROADCAST_XHTTP_TEXT = (
+    "🎉 <b>Обновление VPN!</b>\n\n"
+    "Мы добавили <b>новый протокол XHTTP</b> для еще более быстрого подключения!\n\n"
+    "⚡️ <b>Преимущества:</b>\n"
+    "• Пинг ниже на 20-30%\n"
+    "• Быстрее подключение\n"
+    "• Стабильнее работа\n"
+    "• Лучший обход блокировок\n\n"
+    "📲 Нажмите /start чтобы увидеть новые возможности!"
+)
 
-👤 <b>Профиль:</b>
-• ID: <code>{user.id}</code>
-• Имя: {user_name}
-"""
-    
-    # Формируем блок подписки
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        
-        if subscription["tariff"] == "trial":
-            tariff_name = f"🎁 Пробный период"
-        else:
-            tariff_info = get_cached_tariff_info(subscription["tariff"])
-            tariff_name = tariff_info["name"] if tariff_info else subscription["tariff"]
-        
-        if days_left > 0:
-            subscription_text = f"""
-📦 <b>Подписка:</b>
-• Тариф: {tariff_name}
-• Срок действия до: {expires_at.strftime("%d.%m.%Y")}
-• Осталось дней: <b>{days_left}</b>
-"""
-        else:
-            subscription_text = f"""
-⚠️ <b>Подписка:</b>
-• Срок действия истек: {expires_at.strftime("%d.%m.%Y")}
 
-<i>Выберите тариф для продолжения.</i>
-"""
-    else:
-        # Проверить доступность пробного периода
-        has_trial = await db.has_used_trial(user.id)
-        
-        if not has_trial and settings.trial_enabled:
-            subscription_text = f"""
-🎁 <b>Пробная подписка:</b>
-• Доступно <b>{settings.trial_period_days} дней бесплатно!</b>
-"""
-        else:
-            subscription_text = """
-📭 <b>Подписка:</b>
-• Срок действия истек.
-"""
-    
-    text = profile_text + subscription_text
-    
-    # Проверить доступность пробного периода для кнопки
-    show_trial = False
-    if settings.trial_enabled:
-        has_trial = await db.has_used_trial(message.from_user.id)
-        has_subs = await db.has_any_subscription(message.from_user.id)
-        show_trial = not has_trial and not has_subs
-    
-    # Проверить наличие активной подписки для кнопки обновления
-    has_active_sub = False
-    if subscription:
-        expires_at = datetime.fromisoformat(subscription["expires_at"])
-        days_left = (expires_at - datetime.now()).days
-        has_active_sub = days_left > 0
+@router.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast(callback: CallbackQuery):
+    """Рассылка: выбор аудитории"""
+    if not settings.is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен", show_alert=True)
+        return
     
-    await message.answer(
-        text,
-        reply_markup=get_tariffs_keyboard(show_trial=show_trial, has_active_subscription=has_active_sub)
+    await callback.answer()
+    await callback.message.edit_text(
+        "📢 <b>Рассылка уведомлений</b>\n\n"
+        "🎯 Выберите аудиторию рассылки.\n"
+        "<i>Пользователи, заблокировавшие бота, исключаются автоматически.</i>",
+        reply_markup=get_broadcast_segments_keyboard(settings.broadcast_expired_days)
     )
 
 
-@router.callback_query(F.data == "admin_broadcast")
-async def admin_broadcast(callback: CallbackQuery):
-    """Рассылка всем подписчикам"""
+@router.callback_query(F.data.startswith("admin_broadcast_segment:"))
+async def admin_broadcast_segment(callback: CallbackQuery, db: Database):
+    """Рассылка: предпросмотр аудитории и сообщения"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
         return
     
+    segment = callback.data.split(":")[1]
+    if segment not in SEGMENT_TITLES:
+        await callback.answer("❌ Неизвестный сегмент")
+        return
+    
     await callback.answer()
     
-    # Получить количество пользователей
-    async with aiosqlite.connect(db.db_path) as conn:
-        cursor = await conn.execute("SELECT COUNT(*) FROM users")
-        user_count = (await cursor.fetchone())[0]
+    # Количество получателей считается в БД, без выгрузки списка
+    user_count = await db.count_broadcast_recipients(segment, settings.broadcast_expired_days)
     
     text = (
         "📢 <b>Рассылка уведомлений</b>\n\n"
-        f"👥 Всего пользователей: <b>{user_count}</b>\n\n"
+        f"🎯 Аудитория: <b>{SEGMENT_TITLES[segment]}</b>\n"
+        f"👥 Получателей: <b>{user_count}</b>\n\n"
         "🚀 <b>Готовое сообщение о новом XHTTP протоколе:</b>\n\n"
         "━━━━━━━━━━━━━━━━\n"
-        "🎉 <b>Обновление VPN!</b>\n\n"
-        "Мы добавили <b>новый протокол XHTTP</b> для еще более быстрого подключения!\n\n"
-        "⚡️ <b>Преимущества:</b>\n"
-        "• Пинг ниже на 20-30%\n"
-        "• Быстрее подключение\n"
-        "• Стабильнее работа\n"
-        "• Лучший обход блокировок\n\n"
-        "Нажмите /start чтобы обновить свой ключ!\n"
+        f"{BROADCAST_XHTTP_TEXT}\n"
         "━━━━━━━━━━━━━━━━\n\n"
-        "❓ Отправить это сообщение всем?"
-    )
-    
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(
-            text="✅ Да, отправить",
-            callback_data="admin_broadcast_confirm"
-        )
-    )
-    builder.row(
-        InlineKeyboardButton(
-            text="❌ Отмена",
-            callback_data="admin"
-        )
+        "❓ Отправить это сообщение?"
     )
     
     await callback.message.edit_text(
         text,
-        reply_markup=builder.as_markup()
+        reply_markup=get_broadcast_confirm_keyboard(segment)
     )
 
 
-@router.callback_query(F.data == "admin_broadcast_confirm")
-async def admin_broadcast_confirm(callback: CallbackQuery):
-    """Подтверждение и отправка рассылки"""
+@router.callback_query(F.data.startswith("admin_broadcast_confirm:"))
+async def admin_broadcast_confirm(callback: CallbackQuery, broadcast_service: BroadcastService):
+    """Подтверждение и запуск рассылки в фоне"""
     if not settings.is_admin(callback.from_user.id):
         await callback.answer("⛔️ Доступ запрещен", show_alert=True)
         return
     
-    await callback.answer("📤 Начинаю рассылку...", show_alert=True)
-    
-    # Получить всех пользователей
-    async with aiosqlite.connect(db.db_path) as conn:
-        cursor = await conn.execute("SELECT telegram_id FROM users")
-        users = await cursor.fetchall()
+    segment = callback.data.split(":")[1]
+    if segment not in SEGMENT_TITLES:
+        await callback.answer("❌ Неизвестный сегмент")
+        return
     
-    # Текст рассылки
-    broadcast_text = (
-        "🎉 <b>Обновление VPN!</b>\n\n"
-        "Мы добавили <b>новый протокол XHTTP</b> для еще более быстрого подключения!\n\n"
-        "⚡️ <b>Преимущества:</b>\n"
-        "• Пинг ниже на 20-30%\n"
-        "• Быстрее подключение\n"
-        "• Стабильнее работа\n"
-        "• Лучший обход блокировок\n\n"
-        "📲 Нажмите /start чтобы увидеть новые возможности!"
+    broadcast_id = await broadcast_service.create(
+        text=BROADCAST_XHTTP_TEXT,
+        reply_markup=get_upgrade_keyboard(),
+        created_by=callback.from_user.id,
+        segment=segment,
+        segment_days=settings.broadcast_expired_days
     )
+    await broadcast_service.start(broadcast_id, callback.bot)
     
-    # Отправка
-    success_count = 0
-    failed_count = 0
-    
-    for (user_id,) in users:
-        try:
-            await callback.bot.send_message(
-                chat_id=user_id,
-                text=broadcast_text,
-                parse_mode="HTML",
-                reply_markup=get_upgrade_keyboard()
-            )
-            success_count += 1
-            await asyncio.sleep(0.05)  # Задержка чтобы не попасть в rate limit
-        except Exception as e:
-            failed_count += 1
-            logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
-    
-    # Отчет админу
-    result_text = (
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📤 Отправлено: {success_count}\n"
-        f"❌ Ошибок: {failed_count}\n"
-        f"👥 Всего: {len(users)}"
-    )
+    await callback.answer("📤 Рассылка запущена в фоне", show_alert=True)
+    await show_broadcast_status(callback, broadcast_service, broadcast_id)
+
+
+async def show_broadcast_status(callback: CallbackQuery, broadcast_service: BroadcastService, broadcast_id: int):
+    """Показать прогресс рассылки"""
+    broadcast = await broadcast_service.get(broadcast_id)
+    if not broadcast:
+        await callback.message.edit_text("❌ Рассылка не найдена", reply_markup=get_admin_keyboard())
+        return
+    
+    try:
+        await callback.message.edit_text(
+            format_broadcast_status(broadcast),
+            reply_markup=get_broadcast_control_keyboard(broadcast_id, broadcast["status"])
+        )
+    except TelegramBadRequest:
+        # Текст не изменился с прошлого обновления
+        pass
+
+
+@router.callback_query(F.data.startswith("broadcast_"))
+async def admin_broadcast_control(callback: CallbackQuery, broadcast_service: BroadcastService):
+    """Управление рассылкой: статус, пауза, продолжение, отмена"""
+    if not settings.is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен", show_alert=True)
+        return
+    
+    action, broadcast_id = callback.data.split(":")
+    broadcast_id = int(broadcast_id)
+    
+    if action == "broadcast_pause":
+        await broadcast_service.pause(broadcast_id)
+        await callback.answer("⏸ Рассылка будет приостановлена")
+    elif action == "broadcast_resume":
+        started = await broadcast_service.start(broadcast_id, callback.bot)
+        await callback.answer("▶️ Рассылка продолжена" if started else "Рассылку нельзя продолжить")
+    elif action == "broadcast_cancel":
+        await broadcast_service.cancel(broadcast_id)
+        await callback.answer("🚫 Рассылка будет отменена")
+    else:
+        await callback.answer()
+    
+    await show_broadcast_status(callback, broadcast_service, broadcast_id)
+
+
+@router.callback_query(F.data.startswith("keymig_confirm:"))
+async def admin_key_migration_confirm(callback: CallbackQuery, key_migration_service: KeyMigrationService):
+    """Подтверждение и запуск перевода ключей в фоне"""
+    if not settings.is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен", show_alert=True)
+        return
+    
+    inbound_id = int(callback.data.split(":")[1])
+    migration_id = await key_migration_service.create(inbound_id, created_by=callback.from_user.id)
+    if migration_id is None:
+        await callback.answer("❌ Inbound не найден в панели", show_alert=True)
+        return
+    await key_migration_service.start(migration_id, callback.bot)
+    
+    await callback.answer("🔄 Перевод ключей запущен в фоне", show_alert=True)
+    await show_key_migration_status(callback, key_migration_service, migration_id)
+
+
+async def show_key_migration_status(callback: CallbackQuery, key_migration_service: KeyMigrationService, migration_id: int):
+    """Показать прогресс перевода ключей"""
+    migration = await key_migration_service.get(migration_id)
+    if not migration:
+        await callback.message.edit_text("❌ Перевод не найден", reply_markup=get_admin_keyboard())
+        return
+    
+    try:
+        await callback.message.edit_text(
+            format_key_migration_status(migration),
+            reply_markup=get_key_migration_control_keyboard(migration_id, migration["status"])
+        )
+    except TelegramBadRequest:
+        # Текст не изменился с прошлого обновления
+        pass
+
+
+@router.callback_query(F.data.startswith("keymig_"))
+async def admin_key_migration_control(callback: CallbackQuery, key_migration_service: KeyMigrationService):
+    """Управление переводом ключей: статус, пауза, продолжение, отмена"""
+    if not settings.is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен", show_alert=True)
+        return
+    
+    action, migration_id = callback.data.split(":")
+    migration_id = int(migration_id)
+    
+    if action == "keymig_pause":
+        await key_migration_service.pause(migration_id)
+        await callback.answer("⏸ Перевод будет приостановлен")
+    elif action == "keymig_resume":
+        started = await key_migration_service.start(migration_id, callback.bot)
+        await callback.answer("▶️ Перевод продолжен" if started else "Перевод нельзя продолжить")
+    elif action == "keymig_cancel":
+        await key_migration_service.cancel(migration_id)
+        await callback.answer("🚫 Перевод будет отменён")
+    else:
+        await callback.answer()
+    
+    await show_key_migration_status(callback, key_migration_service, migration_id)
+
+
+@router.callback_query(F.data == "admin")
+async def admin_menu(callback: CallbackQuery):
+    """Вернуться в админ-панель"""
+    if not settings.is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен", show_alert=True)
+        return
     
     await callback.message.edit_text(
-        result_text,
+        "🔧 <b>Админ-панель</b>\n\n"
+        "Выберите действие:",
         reply_markup=get_admin_keyboard()
     )
+    await callback.answer()
 
 
 @router.callback_query(F.data == "upgrade_to_xhttp")
-async def upgrade_to_xhttp(callback: CallbackQuery):
+async def upgrade_to_xhttp(
+    callback: CallbackQuery,
+    db: Database,
+    hiddify_service: HiddifyService,
+    provisioning_guard: ProvisioningGuard
+):
     """Обновление ключа пользователя на XHTTP"""
     await callback.answer("⏳ Создаю новый ключ...", show_alert=False)
     
@@ -977,29 +1008,38 @@ async def upgrade_to_xhttp(callback: CallbackQuery):
         )
         return
     
-    # Создать новый ключ (старый автоматически станет неактивным при превышении лимитов)
-    expires_at = datetime.fromisoformat(subscription["expires_at"])
-    days_remaining = max(1, (expires_at - datetime.now()).days)
+    async def issue_new_key():
+        # Создать новый ключ (старый автоматически станет неактивным при превышении лимитов)
+        days_remaining = max(1, SubscriptionView(subscription).days_left)
+        
+        vpn_data = await hiddify_service.create_user(
+            expire_days=days_remaining,
+            use_antiblock=False  # Обычный VPN на XHTTP
+        )
+        
+        if vpn_data:
+            # Обновить подписку в БД
+            await db.update_subscription_key(
+                subscription["id"], vpn_data["uuid"], vpn_data["subscription_url"], vpn_data["inbound_id"]
+            )
+        return vpn_data
     
-    vpn_data = await hiddify_service.create_user(
-        expire_days=days_remaining,
-        use_antiblock=False  # Обычный VPN на XHTTP
-    )
+    # Двойное нажатие не создаёт второго клиента в панели
+    try:
+        vpn_data, shared = await provisioning_guard.run("upgrade_to_xhttp", user.id, issue_new_key)
+    except ProvisioningInProgress:
+        return
+    if shared:
+        return
     
     if vpn_data:
-        # Обновить подписку в БД
-        async with aiosqlite.connect(db.db_path) as conn:
-            await conn.execute(
-                "UPDATE subscriptions SET hiddify_uuid = ?, subscription_url = ? WHERE id = ?",
-                (vpn_data["uuid"], vpn_data["subscription_url"], subscription["id"])
-            )
-            await conn.commit()
-        
+        # По ссылке подписки приложение само получит новый ключ при следующем обновлении
+        key = await user_key(db, user.id, vpn_data["subscription_url"])
         text = (
             "🎉 <b>Ваш VPN обновлен!</b>\n\n"
             "🚀 Новый ключ с протоколом <b>XHTTP</b> готов!\n\n"
             "🔗 <b>Ваш новый VPN-ключ:</b>\n"
-            f"<code>{vpn_data['subscription_url']}</code>\n\n"
+            f"<code>{key}</code>\n\n"
             "📱 <b>Как подключиться:</b>\n"
             "1. Скопируйте ссылку выше\n"
             "2. Откройте V2rayNG/V2Box/Happ Plus\n"
@@ -1,9 +1,20 @@
 """Клавиатуры для Telegram-бота"""
+from typing import Dict, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from pydantic import ConfigDict
 
+from src.config.settings import Settings, on_settings_reload, settings
 
-def get_tariffs_keyboard(show_trial: bool = False, has_active_subscription: bool = False) -> InlineKeyboardMarkup:
+
+def format_price(kopeks: int) -> str:
+    """Цена для кнопки: 29900 -> 299₽"""
+    rubles, rest = divmod(kopeks, 100)
+    return f"{rubles}₽" if not rest else f"{rubles}.{rest:02d}₽"
+
+
+def _build_tariffs_keyboard(show_trial: bool, has_active_subscription: bool, config: Settings) -> InlineKeyboardMarkup:
     """Клавиатура выбора режима VPN"""
     builder = InlineKeyboardBuilder()
     
@@ -20,7 +31,7 @@ def get_tariffs_keyboard(show_trial: bool = False, has_active_subscription: bool
     if show_trial:
         builder.row(
             InlineKeyboardButton(
-                text="🎁 Получить 7 дней бесплатно",
+                text=f"🎁 Получить {config.trial_period_days} дней бесплатно",
                 callback_data="get_trial"
             )
         )
@@ -62,25 +73,25 @@ def get_tariffs_keyboard(show_trial: bool = False, has_active_subscription: bool
     return builder.as_markup()
 
 
-def get_normal_tariffs_keyboard() -> InlineKeyboardMarkup:
+def _build_normal_tariffs_keyboard(config: Settings) -> InlineKeyboardMarkup:
     """Клавиатура с обычными тарифами"""
     builder = InlineKeyboardBuilder()
     
     builder.row(
         InlineKeyboardButton(
-            text="⚡️ 1 месяц - 299₽",
+            text=f"⚡️ 1 месяц - {format_price(config.tariffs['1m'].price)}",
             callback_data="tariff:1m"
         )
     )
     builder.row(
         InlineKeyboardButton(
-            text="⚡️ 3 месяца - 799₽",
+            text=f"⚡️ 3 месяца - {format_price(config.tariffs['3m'].price)}",
             callback_data="tariff:3m"
         )
     )
     builder.row(
         InlineKeyboardButton(
-            text="⚡️ 1 год - 2499₽",
+            text=f"⚡️ 1 год - {format_price(config.tariffs['12m'].price)}",
             callback_data="tariff:12m"
         )
     )
@@ -95,25 +106,25 @@ def get_normal_tariffs_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_antiblock_tariffs_keyboard() -> InlineKeyboardMarkup:
+def _build_antiblock_tariffs_keyboard(config: Settings) -> InlineKeyboardMarkup:
     """Клавиатура с антиглушилка тарифами"""
     builder = InlineKeyboardBuilder()
     
     builder.row(
         InlineKeyboardButton(
-            text="🛡️ 1 месяц - 499₽",
+            text=f"🛡️ 1 месяц - {format_price(config.tariffs['antiblock_1m'].price)}",
             callback_data="tariff:antiblock_1m"
         )
     )
     builder.row(
         InlineKeyboardButton(
-            text="🛡️ 3 месяца - 1299₽",
+            text=f"🛡️ 3 месяца - {format_price(config.tariffs['antiblock_3m'].price)}",
             callback_data="tariff:antiblock_3m"
         )
     )
     builder.row(
         InlineKeyboardButton(
-            text="🛡️ 1 год - 3999₽",
+            text=f"🛡️ 1 год - {format_price(config.tariffs['antiblock_12m'].price)}",
             callback_data="tariff:antiblock_12m"
         )
     )
@@ -155,7 +166,7 @@ def get_payment_keyboard(payment_url: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_back_keyboard() -> InlineKeyboardMarkup:
+def _build_back_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой назад"""
     builder = InlineKeyboardBuilder()
     
@@ -169,7 +180,7 @@ def get_back_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_upgrade_keyboard() -> InlineKeyboardMarkup:
+def _build_upgrade_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для обновления ключа"""
     builder = InlineKeyboardBuilder()
     
@@ -189,7 +200,7 @@ def get_upgrade_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_admin_keyboard() -> InlineKeyboardMarkup:
+def _build_admin_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура администратора"""
     builder = InlineKeyboardBuilder()
     
@@ -215,7 +226,7 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
     # Рассылка
     builder.row(
         InlineKeyboardButton(
-            text="📢 Рассылка всем",
+            text="📢 Рассылка",
             callback_data="admin_broadcast"
         )
     )
@@ -242,3 +253,272 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
     )
     
     return builder.as_markup()
+
+
+class _FrozenList(list):
+    """Список рядов или кнопок, который нельзя изменить"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Клавиатура из кэша общая для всех пользователей, соберите новую")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+
+
+class _FrozenButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class _FrozenMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
+# Типы aiogram собираются отложенно, наследники - тоже
+_FrozenButton.model_rebuild()
+_FrozenMarkup.model_rebuild()
+
+
+def _freeze(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """
+    Неизменяемая копия клавиатуры
+    
+    Модели pydantic заморожены, ряды - списки без изменяющих методов
+    (кортежи aiogram не умеет сериализовать), поэтому попытка изменить
+    общую клавиатуру падает с ошибкой, а не портит её всем пользователям.
+    """
+    rows = _FrozenList(
+        _FrozenList(_FrozenButton(**button.model_dump(exclude_none=True)) for button in row)
+        for row in markup.inline_keyboard
+    )
+    return _FrozenMarkup.model_construct(inline_keyboard=rows)
+
+
+# Статические клавиатуры собираются один раз и переиспользуются всеми
+# обработчиками, поэтому хранятся неизменяемыми (см. _freeze).
+_prebuilt: Dict[Tuple, InlineKeyboardMarkup] = {}
+
+
+@on_settings_reload
+def build_keyboards(config: Settings = settings):
+    """Собрать статические клавиатуры (при запуске и после перезагрузки настроек)"""
+    global _prebuilt
+    prebuilt = {
+        ("tariffs", show_trial, has_active): _build_tariffs_keyboard(show_trial, has_active, config)
+        for show_trial in (False, True)
+        for has_active in (False, True)
+    }
+    prebuilt[("normal_tariffs",)] = _build_normal_tariffs_keyboard(config)
+    prebuilt[("antiblock_tariffs",)] = _build_antiblock_tariffs_keyboard(config)
+    prebuilt[("back",)] = _build_back_keyboard()
+    prebuilt[("upgrade",)] = _build_upgrade_keyboard()
+    prebuilt[("admin",)] = _build_admin_keyboard()
+    prebuilt = {key: _freeze(markup) for key, markup in prebuilt.items()}
+    # Замена словаря целиком: обработчики не увидят наполовину собранный кэш
+    _prebuilt = prebuilt
+
+
+def get_tariffs_keyboard(show_trial: bool = False, has_active_subscription: bool = False) -> InlineKeyboardMarkup:
+    """Клавиатура выбора режима VPN"""
+    return _prebuilt[("tariffs", bool(show_trial), bool(has_active_subscription))]
+
+
+def get_normal_tariffs_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с обычными тарифами"""
+    return _prebuilt[("normal_tariffs",)]
+
+
+def get_antiblock_tariffs_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с антиглушилка тарифами"""
+    return _prebuilt[("antiblock_tariffs",)]
+
+
+def get_back_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой назад"""
+    return _prebuilt[("back",)]
+
+
+def get_upgrade_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура для обновления ключа"""
+    return _prebuilt[("upgrade",)]
+
+
+def get_admin_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура администратора"""
+    return _prebuilt[("admin",)]
+
+
+def get_broadcast_control_keyboard(broadcast_id: int, status: str) -> InlineKeyboardMarkup:
+    """Клавиатура управления рассылкой"""
+    builder = InlineKeyboardBuilder()
+    
+    if status == "running":
+        builder.row(
+            InlineKeyboardButton(
+                text="⏸ Пауза",
+                callback_data=f"broadcast_pause:{broadcast_id}"
+            )
+        )
+    elif status == "paused":
+        builder.row(
+            InlineKeyboardButton(
+                text="▶️ Продолжить",
+                callback_data=f"broadcast_resume:{broadcast_id}"
+            )
+        )
+    
+    if status in ("running", "paused"):
+        builder.row(
+            InlineKeyboardButton(
+                text="🚫 Отменить",
+                callback_data=f"broadcast_cancel:{broadcast_id}"
+            )
+        )
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="🔄 Обновить",
+            callback_data=f"broadcast_status:{broadcast_id}"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="◀️ Админ-панель",
+            callback_data="admin"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_broadcast_segments_keyboard(expired_days: int = 30) -> InlineKeyboardMarkup:
+    """Клавиатура выбора аудитории рассылки"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="✅ Активные подписчики",
+            callback_data="admin_broadcast_segment:active"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text=f"⌛️ Истекла за {expired_days} дн.",
+            callback_data="admin_broadcast_segment:expired"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="💤 Ни разу не платили",
+            callback_data="admin_broadcast_segment:never_paid"
+        ),
+        InlineKeyboardButton(
+            text="🎁 Только пробный",
+            callback_data="admin_broadcast_segment:trial_only"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="🛡️ Антиглушилка",
+            callback_data="admin_broadcast_segment:antiblock"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="👥 Все пользователи",
+            callback_data="admin_broadcast_segment:all"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="◀️ Админ-панель",
+            callback_data="admin"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_broadcast_confirm_keyboard(segment: str) -> InlineKeyboardMarkup:
+    """Клавиатура подтверждения рассылки"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="✅ Да, отправить",
+            callback_data=f"admin_broadcast_confirm:{segment}"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="❌ Отмена",
+            callback_data="admin_broadcast"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_key_migration_confirm_keyboard(inbound_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура подтверждения перевода ключей"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="✅ Да, перевести",
+            callback_data=f"keymig_confirm:{inbound_id}"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="❌ Отмена",
+            callback_data="admin"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_key_migration_control_keyboard(migration_id: int, status: str) -> InlineKeyboardMarkup:
+    """Клавиатура управления переводом ключей"""
+    builder = InlineKeyboardBuilder()
+    
+    if status == "running":
+        builder.row(
+            InlineKeyboardButton(
+                text="⏸ Пауза",
+                callback_data=f"keymig_pause:{migration_id}"
+            )
+        )
+    elif status == "paused":
+        builder.row(
+            InlineKeyboardButton(
+                text="▶️ Продолжить",
+                callback_data=f"keymig_resume:{migration_id}"
+            )
+        )
+    
+    if status in ("running", "paused"):
+        builder.row(
+            InlineKeyboardButton(
+                text="🚫 Отменить",
+                callback_data=f"keymig_cancel:{migration_id}"
+            )
+        )
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="🔄 Обновить",
+            callback_data=f"keymig_status:{migration_id}"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="◀️ Админ-панель",
+            callback_data="admin"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+build_keyboards()
@@ -0,0 +1,207 @@
+"""Middleware aiogram"""
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, TelegramObject, User
+
+from src.monitoring.metrics import (
+    BOT_HANDLER_SECONDS,
+    BOT_THROTTLED_TOTAL,
+    TELEGRAM_REQUEST_SECONDS,
+    TELEGRAM_RETRY_AFTER_TOTAL
+)
+from src.monitoring.startup import TIMELINE
+from src.services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Уровни лимитов
+TIER_DEFAULT = "default"
+TIER_EXPENSIVE = "expensive"
+
+# Кнопки, которые создают клиентов в панели или платежи в ЮKassa
+EXPENSIVE_CALLBACKS = frozenset({
+    "get_trial",
+    "upgrade_to_xhttp",
+    "admin_test_vpn",
+    "admin_test_antiblock",
+})
+EXPENSIVE_CALLBACK_PREFIXES = ("tariff:", "keymig_confirm:")
+
+
+def callback_tier(data: Optional[str]) -> str:
+    """Уровень лимита для callback-кнопки"""
+    if data and (data in EXPENSIVE_CALLBACKS or data.startswith(EXPENSIVE_CALLBACK_PREFIXES)):
+        return TIER_EXPENSIVE
+    return TIER_DEFAULT
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты апдейтов от одного пользователя
+
+    Регистрируется как outer middleware диспетчера для сообщений и
+    callback'ов. Каждый апдейт расходует токен из общего ведра
+    пользователя, кнопки из EXPENSIVE_CALLBACKS - ещё и из отдельного
+    ведра с более строгим лимитом. Лишние апдейты не доходят до
+    обработчиков: на callback отвечаем коротким уведомлением (иначе у
+    пользователя висят "часики"), сообщения просто отбрасываем.
+
+    Вёдра хранятся в LRU ограниченного размера, давно не писавшие
+    пользователи вытесняются. Вёдра свои у каждого процесса: в режиме
+    webhook при API_WORKERS > 1 апдейты пользователя расходятся по
+    воркерам, и суммарный лимит может доходить до API_WORKERS * rate
+    (и burst соответственно).
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: float = 5.0,
+        expensive_rate: float = 0.1,
+        expensive_burst: float = 2.0,
+        max_users: int = 10000
+    ):
+        self.limits: Dict[str, Tuple[float, float]] = {
+            TIER_DEFAULT: (rate, burst),
+            TIER_EXPENSIVE: (expensive_rate, expensive_burst),
+        }
+        self.max_users = max_users
+        self._buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+
+    def configure(self, rate: float, burst: float, expensive_rate: float, expensive_burst: float):
+        """Применить новые лимиты, в том числе к вёдрам уже известных пользователей"""
+        self.limits = {
+            TIER_DEFAULT: (rate, burst),
+            TIER_EXPENSIVE: (expensive_rate, expensive_burst),
+        }
+        for (_, tier), bucket in list(self._buckets.items()):
+            bucket.configure(*self.limits[tier])
+
+    def _bucket(self, user_id: int, tier: str) -> TokenBucket:
+        key = (user_id, tier)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self.limits[tier]
+            bucket = TokenBucket(rate=rate, capacity=burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, user_id: int, tier: str = TIER_DEFAULT) -> Optional[str]:
+        """
+        Проверить лимиты пользователя
+
+        Returns:
+            None если апдейт можно обработать, иначе уровень сработавшего лимита
+        """
+        if not self._bucket(user_id, TIER_DEFAULT).try_acquire():
+            return TIER_DEFAULT
+        if tier != TIER_DEFAULT and not self._bucket(user_id, tier).try_acquire():
+            return tier
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        is_callback = isinstance(event, CallbackQuery)
+        tier = callback_tier(event.data) if is_callback else TIER_DEFAULT
+
+        exceeded = self.allow(user.id, tier)
+        if exceeded is None:
+            return await handler(event, data)
+
+        BOT_THROTTLED_TOTAL.inc("callback_query" if is_callback else "message", exceeded)
+        logger.debug(f"Пользователь {user.id} превысил лимит {exceeded}")
+
+        if is_callback:
+            try:
+                await event.answer("⏳ Слишком часто, подождите немного")
+            except TelegramBadRequest:
+                # Callback мог устареть, пока апдейт ждал в очереди
+                pass
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        """Количество отклонённых апдейтов по уровням лимита"""
+        totals: Dict[str, int] = Counter()
+        for (_, tier), count in BOT_THROTTLED_TOTAL.values().items():
+            totals[tier] += int(count)
+        return dict(totals)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Время обработки апдейтов для /metrics
+
+    Регистрируется как inner middleware диспетчера, то есть после
+    фильтров, для найденного обработчика. Callback'и группируются по
+    префиксу callback_data до двоеточия (tariff:1m -> tariff), сообщения -
+    по имени обработчика.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, CallbackQuery):
+            update = "callback_query"
+            name = (event.data or "").split(":", 1)[0]
+        else:
+            update = "message"
+            handler_object: Optional[HandlerObject] = data.get("handler")
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            BOT_HANDLER_SECONDS.observe(time.perf_counter() - started, update, name, status)
+            TIMELINE.mark("first_update")
+
+
+class TelegramRequestMetrics(BaseRequestMiddleware):
+    """Время запросов к Bot API и ответы 429 (middleware сессии бота)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        except TelegramRetryAfter:
+            status = "retry_after"
+            TELEGRAM_RETRY_AFTER_TOTAL.inc(name)
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, name, status)
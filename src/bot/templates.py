@@ -0,0 +1,227 @@
+"""Шаблоны экранов бота"""
+from datetime import datetime
+from functools import lru_cache
+from string import Formatter
+from typing import Optional
+
+from src.config.settings import on_settings_reload, settings
+
+
+class Template:
+    """
+    Предварительно разобранный шаблон сообщения
+
+    Текст один раз разбивается на статические фрагменты и именованные
+    слоты ({name}), render() только склеивает их с подставленными значениями.
+    """
+
+    __slots__ = ("parts",)
+
+    def __init__(self, source: str):
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                parts.append((True, literal))
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise ValueError(f"Поддерживаются только простые слоты, получено {{{field}}}")
+                parts.append((False, field))
+        self.parts = tuple(parts)
+
+    def render(self, **values) -> str:
+        """Подставить значения в слоты"""
+        return "".join(
+            text if is_literal else str(values[text])
+            for is_literal, text in self.parts
+        )
+
+
+class SubscriptionView:
+    """Подписка, подготовленная для показа: дата окончания разбирается один раз на апдейт"""
+
+    __slots__ = ("tariff", "expires_at", "days_left", "subscription_url")
+
+    def __init__(self, subscription: dict, now: Optional[datetime] = None):
+        self.tariff = subscription["tariff"]
+        self.expires_at = datetime.fromisoformat(subscription["expires_at"])
+        self.days_left = (self.expires_at - (now or datetime.now())).days
+        # Ссылка подписки, если она включена, иначе vless-ссылка, выданная с подпиской
+        self.subscription_url = (
+            settings.subscription_link(subscription.get("sub_token")) or subscription["subscription_url"]
+        )
+
+    @property
+    def is_active(self) -> bool:
+        return self.days_left > 0
+
+
+def tariff_title(tariff: str) -> str:
+    """Название тарифа для показа пользователю"""
+    if tariff == "trial":
+        return "🎁 Пробный период"
+    catalog_tariff = settings.get_tariff(tariff)
+    return catalog_tariff.name if catalog_tariff else tariff
+
+
+# Главный экран: /start, "Назад к тарифам" и ответ на произвольное сообщение
+# (компактный вариант без приветствия и пояснений)
+
+HEADER_WELCOME = "🛡️ <b>Добро пожаловать в AI VPN!</b>"
+HEADER_COMPACT = "🛡️ <b>AI VPN</b>"
+
+PROFILE = Template("""
+{header}
+
+👤 <b>Профиль:</b>
+• ID: <code>{user_id}</code>
+• Имя: {user_name}
+""")
+
+SUBSCRIPTION_ACTIVE = Template("""
+📦 <b>Подписка:</b>
+• Тариф: {tariff_name}
+• Срок действия до: {expires}
+• Осталось дней: <b>{days_left}</b>
+""")
+
+SUBSCRIPTION_EXPIRED = Template("""
+⚠️ <b>Подписка:</b>
+• Срок действия истек: {expires}
+
+<i>{hint}</i>
+""")
+EXPIRED_HINT_WELCOME = "Ваш бесплатный пробный период закончился. Оформите подписку, чтобы продолжить пользоваться сервисом!"
+EXPIRED_HINT_COMPACT = "Выберите тариф для продолжения."
+
+TRIAL_AVAILABLE = Template("""
+🎁 <b>Пробная подписка:</b>
+• Доступно <b>{trial_days} дней бесплатно!</b>
+{hint}""")
+TRIAL_HINT_WELCOME = "\n<i>Попробуйте наш VPN бесплатно без привязки карты.</i>\n"
+
+NO_SUBSCRIPTION_WELCOME = """
+📭 <b>Подписка:</b>
+• Срок действия истек.
+
+<i>Выберите тариф для продолжения использования.</i>
+"""
+NO_SUBSCRIPTION_COMPACT = """
+📭 <b>Подписка:</b>
+• Срок действия истек.
+"""
+
+# Экран "Моя подписка"
+
+NO_ACTIVE_SUBSCRIPTION = """
+📭 <b>У вас нет активной подписки</b>
+
+Выберите тариф, чтобы продолжить пользоваться VPN.
+"""
+
+SUBSCRIPTION_DETAILS = Template("""
+{status_emoji} <b>Ваша подписка</b>
+
+📦 <b>Тариф:</b> {tariff_name}
+📅 <b>Статус:</b> {status_text}
+📅 <b>Действует до:</b> {expires}
+
+🔑 <b>Ваш VPN-ключ:</b>
+<code>{subscription_url}</code>
+
+📱 <b>Как подключиться:</b>
+1. Скопируйте ключ выше (нажмите на него)
+2. Откройте V2Box, Happ Plus или v2rayNG
+3. Нажмите "+" → "Вставить из буфера"
+
+❓ Вопросы? Пишите @tipss94
+""")
+
+
+def render_main_screen(
+    user_id: int,
+    user_name: str,
+    subscription: Optional[SubscriptionView],
+    trial_available: bool,
+    welcome: bool = True
+) -> str:
+    """Текст главного экрана: профиль и состояние подписки"""
+    if subscription is None:
+        return _render_main_screen(welcome, user_id, user_name, None, None, 0, trial_available)
+    return _render_main_screen(
+        welcome, user_id, user_name,
+        subscription.tariff, subscription.expires_at, subscription.days_left, False
+    )
+
+
+# Ключ кэша - всё, от чего зависит текст: состояние пользователя и число
+# оставшихся дней (текст меняется не чаще раза в сутки)
+@lru_cache(maxsize=4096)
+def _render_main_screen(
+    welcome: bool,
+    user_id: int,
+    user_name: str,
+    tariff: Optional[str],
+    expires_at: Optional[datetime],
+    days_left: int,
+    trial_available: bool
+) -> str:
+    text = PROFILE.render(
+        header=HEADER_WELCOME if welcome else HEADER_COMPACT,
+        user_id=user_id,
+        user_name=user_name
+    )
+
+    if expires_at is not None and days_left > 0:
+        text += SUBSCRIPTION_ACTIVE.render(
+            tariff_name=tariff_title(tariff),
+            expires=expires_at.strftime("%d.%m.%Y"),
+            days_left=days_left
+        )
+    elif expires_at is not None:
+        text += SUBSCRIPTION_EXPIRED.render(
+            expires=expires_at.strftime("%d.%m.%Y"),
+            hint=EXPIRED_HINT_WELCOME if welcome else EXPIRED_HINT_COMPACT
+        )
+    elif trial_available:
+        text += TRIAL_AVAILABLE.render(
+            trial_days=settings.trial_period_days,
+            hint=TRIAL_HINT_WELCOME if welcome else ""
+        )
+    else:
+        text += NO_SUBSCRIPTION_WELCOME if welcome else NO_SUBSCRIPTION_COMPACT
+    return text
+
+
+def render_subscription_screen(subscription: Optional[SubscriptionView]) -> str:
+    """Текст экрана "Моя подписка" """
+    if subscription is None:
+        return NO_ACTIVE_SUBSCRIPTION
+    return _render_subscription_screen(
+        subscription.tariff, subscription.expires_at, subscription.days_left, subscription.subscription_url
+    )
+
+
+@lru_cache(maxsize=4096)
+def _render_subscription_screen(tariff: str, expires_at: datetime, days_left: int, subscription_url: str) -> str:
+    expires = expires_at.strftime("%d.%m.%Y")
+    if days_left > 0:
+        status_emoji = "✅"
+        status_text = f"Активна | Осталось <b>{days_left} дн.</b>"
+    else:
+        status_emoji = "⚠️"
+        status_text = f"Истекла {expires}"
+
+    return SUBSCRIPTION_DETAILS.render(
+        status_emoji=status_emoji,
+        tariff_name=tariff_title(tariff),
+        status_text=status_text,
+        expires=expires,
+        subscription_url=subscription_url
+    )
+
+
+@on_settings_reload
+def clear_cache(*_):
+    """Сбросить отрисованные экраны (после изменения настроек)"""
+    _render_main_screen.cache_clear()
+    _render_subscription_screen.cache_clear()
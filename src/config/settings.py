@@ -1,8 +1,26 @@
 """Конфигурация приложения"""
+import logging
 import os
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, FrozenSet, List, Mapping, NamedTuple, Optional
 from pydantic_settings import BaseSettings
-from pydantic import Field, validator
+from pydantic import Field, PrivateAttr, validator
+
+logger = logging.getLogger(__name__)
+
+
+class Tariff(NamedTuple):
+    """Тариф из каталога (неизменяемая запись)"""
+    id: str
+    name: str
+    days: int
+    price: int  # копейки
+    antiblock: bool
+
+    @property
+    def price_rub(self) -> float:
+        return self.price / 100
 
 
 class Settings(BaseSettings):
@@ -10,10 +28,12 @@ class Settings(BaseSettings):
     
     # Telegram Bot
     telegram_bot_token: str = Field(..., env="TELEGRAM_BOT_TOKEN")
+    telegram_api_url: str = Field(default="https://api.telegram.org", env="TELEGRAM_API_URL")  # Свой Bot API сервер или заглушка нагрузочного теста
     
     # YooKassa
     yookassa_shop_id: str = Field(..., env="YOOKASSA_SHOP_ID")
     yookassa_secret_key: str = Field(..., env="YOOKASSA_SECRET_KEY")
+    yookassa_api_url: str = Field(default="https://api.yookassa.ru/v3", env="YOOKASSA_API_URL")
     
     # 3x-ui API
     hiddify_api_url: str = Field(default="http://127.0.0.1:2053", env="HIDDIFY_API_URL")
@@ -25,9 +45,59 @@ class Settings(BaseSettings):
     webhook_secret: str = Field(..., env="WEBHOOK_SECRET")
     api_host: str = Field(default="0.0.0.0", env="API_HOST")
     api_port: int = Field(default=8080, env="API_PORT")
+    api_workers: int = Field(default=1, env="API_WORKERS")  # Количество процессов uvicorn
+    
+    # Ссылка подписки /sub/{token}: приложения сами забирают по ней актуальные ключи
+    subscription_base_url: str = Field(default="", env="SUBSCRIPTION_BASE_URL")  # Публичный URL API, например https://domain; пусто - выдаются vless-ссылки
+    subscription_update_hours: int = Field(default=12, env="SUBSCRIPTION_UPDATE_HOURS")  # profile-update-interval для приложений
+    subscription_cache_ttl: float = Field(default=300.0, env="SUBSCRIPTION_CACHE_TTL")  # секунд, сколько ответ живёт в памяти
+    subscription_cache_size: int = Field(default=100000, env="SUBSCRIPTION_CACHE_SIZE")  # пользователей в кэше процесса
+    
+    # Метрики Prometheus: /metrics в API и отдельный порт для процесса бота (0 - выключено)
+    metrics_token: str = Field(default="", env="METRICS_TOKEN")  # Bearer-токен для /metrics, пусто - без авторизации
+    bot_metrics_host: str = Field(default="127.0.0.1", env="BOT_METRICS_HOST")
+    bot_metrics_port: int = Field(default=0, env="BOT_METRICS_PORT")
+    metrics_dir: str = Field(default="", env="METRICS_DIR")  # снимки метрик воркеров API; пусто - временный каталог при API_WORKERS > 1
+    metrics_flush_seconds: float = Field(default=5.0, env="METRICS_FLUSH_SECONDS")  # как часто воркер пишет снимок
+    
+    # Трассировка платежей: сколько дней хранить шаги обработки (0 - не удалять)
+    trace_retention_days: int = Field(default=14, env="TRACE_RETENTION_DAYS")
+    
+    # Диагностика: порог блокировки event loop (мс, 0 - не следить) и предел профилирования
+    loop_lag_threshold_ms: float = Field(default=250.0, env="LOOP_LAG_THRESHOLD_MS")
+    profile_max_seconds: int = Field(default=60, env="PROFILE_MAX_SECONDS")
+    admin_api_token: str = Field(default="", env="ADMIN_API_TOKEN")  # Bearer-токен для /admin/*, пусто - маршруты выключены
+    
+    # /ready: период фоновых проверок зависимостей, таймаут одной проверки и допустимая очередь
+    ready_probe_interval: float = Field(default=15.0, env="READY_PROBE_INTERVAL")  # секунд
+    ready_probe_timeout: float = Field(default=5.0, env="READY_PROBE_TIMEOUT")  # секунд
+    ready_max_queue_depth: int = Field(default=100, env="READY_MAX_QUEUE_DEPTH")  # апдейтов и выдач ключей в работе
+    
+    # Режим запуска: multiprocess (API в отдельном процессе) или single (бот и API в одном event loop)
+    run_mode: str = Field(default="multiprocess", env="RUN_MODE")
+    
+    # Режим получения апдейтов Telegram: polling или webhook (через FastAPI)
+    bot_mode: str = Field(default="polling", env="BOT_MODE")
+    telegram_webhook_url: str = Field(default="", env="TELEGRAM_WEBHOOK_URL")  # Публичный URL, например https://domain/webhook/telegram
+    telegram_webhook_path: str = Field(default="/webhook/telegram", env="TELEGRAM_WEBHOOK_PATH")
+    telegram_webhook_secret: str = Field(default="", env="TELEGRAM_WEBHOOK_SECRET")
     
     # Database
     database_path: str = Field(default="./data/vpn_bot.db", env="DATABASE_PATH")
+    db_slow_query_ms: float = Field(default=100.0, env="DB_SLOW_QUERY_MS")  # порог журнала медленных запросов
+    
+    # Резервные копии базы (online backup API SQLite, без остановки бота)
+    backup_dir: str = Field(default="./data/backups", env="BACKUP_DIR")
+    backup_interval_hours: float = Field(default=24.0, env="BACKUP_INTERVAL_HOURS")  # 0 - выключено
+    backup_keep: int = Field(default=7, env="BACKUP_KEEP")  # сколько последних копий хранить
+    backup_step_pages: int = Field(default=256, env="BACKUP_STEP_PAGES")  # страниц за шаг копирования
+    backup_step_sleep_ms: float = Field(default=20.0, env="BACKUP_STEP_SLEEP_MS")  # пауза между шагами для писателей
+    
+    # Перенос старых строк в архив: незавершённые платежи и отработавшие подписки (дни, 0 - не переносить)
+    payments_retention_days: int = Field(default=30, env="PAYMENTS_RETENTION_DAYS")
+    subscriptions_retention_days: int = Field(default=90, env="SUBSCRIPTIONS_RETENTION_DAYS")
+    archive_database_path: str = Field(default="./data/vpn_bot_archive.db", env="ARCHIVE_DATABASE_PATH")  # пусто - архив в основной базе
+    retention_batch_size: int = Field(default=500, env="RETENTION_BATCH_SIZE")  # строк за транзакцию
     
     # Tariffs (prices in RUB kopeks)
     tariff_1m_price: int = Field(default=29900, env="TARIFF_1M_PRICE")  # 299 RUB
@@ -49,74 +119,208 @@ class Settings(BaseSettings):
     # Admin users (telegram IDs separated by comma)
     admin_users: str = Field(default="", env="ADMIN_USERS")
     
-    @validator("database_path")
+    # Broadcasts (Telegram допускает ~30 сообщений/сек для массовых рассылок)
+    broadcast_rate_limit: float = Field(default=28.0, env="BROADCAST_RATE_LIMIT")  # сообщений в секунду
+    broadcast_concurrency: int = Field(default=20, env="BROADCAST_CONCURRENCY")
+    broadcast_batch_size: int = Field(default=200, env="BROADCAST_BATCH_SIZE")
+    broadcast_expired_days: int = Field(default=30, env="BROADCAST_EXPIRED_DAYS")  # сегмент "истекла недавно"
+    
+    # Массовый перевод ключей на другой inbound (/migrate_keys)
+    key_migration_batch_size: int = Field(default=100, env="KEY_MIGRATION_BATCH_SIZE")  # клиентов в одном addClient
+    key_migration_concurrency: int = Field(default=5, env="KEY_MIGRATION_CONCURRENCY")  # параллельных запросов к панели
+    
+    # Ограничение частоты запросов от одного пользователя (token bucket).
+    # Лимиты на процесс: в режиме webhook с API_WORKERS > 1 пользователь может получить до API_WORKERS * лимит
+    throttle_rate: float = Field(default=1.0, env="THROTTLE_RATE")  # апдейтов в секунду
+    throttle_burst: float = Field(default=5.0, env="THROTTLE_BURST")
+    throttle_expensive_rate: float = Field(default=0.1, env="THROTTLE_EXPENSIVE_RATE")  # пробный период, оплата, выдача ключей
+    throttle_expensive_burst: float = Field(default=2.0, env="THROTTLE_EXPENSIVE_BURST")
+    
+    @validator("database_path", "archive_database_path")
     def create_db_directory(cls, v):
         """Создать директорию для базы данных"""
-        db_path = Path(v)
-        db_path.parent.mkdir(parents=True, exist_ok=True)
+        if v:
+            db_path = Path(v)
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        return v
+    
+    @validator("db_slow_query_ms")
+    def validate_slow_query_ms(cls, v):
+        """Проверка порога медленных запросов"""
+        if v < 0:
+            raise ValueError("DB_SLOW_QUERY_MS не может быть отрицательным")
+        return v
+    
+    @validator("payments_retention_days", "subscriptions_retention_days")
+    def validate_retention_days(cls, v):
+        """Проверка сроков хранения"""
+        if v < 0:
+            raise ValueError("Сроки хранения не могут быть отрицательными")
+        return v
+    
+    @validator("retention_batch_size")
+    def validate_retention_batch_size(cls, v):
+        """Пачка ограничена числом параметров запроса SQLite"""
+        if not 1 <= v <= 900:
+            raise ValueError("RETENTION_BATCH_SIZE должен быть от 1 до 900")
+        return v
+    
+    @validator("backup_interval_hours", "backup_step_sleep_ms")
+    def validate_backup_schedule(cls, v):
+        """Проверка расписания резервного копирования"""
+        if v < 0:
+            raise ValueError("Параметры BACKUP_* не могут быть отрицательными")
+        return v
+    
+    @validator("backup_keep", "backup_step_pages")
+    def validate_backup_limits(cls, v):
+        """Проверка лимитов резервного копирования"""
+        if v < 1:
+            raise ValueError("BACKUP_KEEP и BACKUP_STEP_PAGES должны быть не меньше 1")
         return v
     
-    @validator("tariff_1m_price", "tariff_3m_price", "tariff_12m_price")
+    @validator("loop_lag_threshold_ms", "profile_max_seconds")
+    def validate_diagnostics(cls, v):
+        """Проверка параметров диагностики"""
+        if v < 0:
+            raise ValueError("Параметры диагностики не могут быть отрицательными")
+        return v
+    
+    @validator("ready_probe_interval", "ready_probe_timeout", "ready_max_queue_depth")
+    def validate_readiness(cls, v):
+        """Проверка параметров /ready"""
+        if v <= 0:
+            raise ValueError("Параметры READY_* должны быть больше нуля")
+        return v
+    
+    @validator("subscription_update_hours", "subscription_cache_size")
+    def validate_subscription_feed(cls, v):
+        """Проверка параметров ссылки подписки"""
+        if v < 1:
+            raise ValueError("SUBSCRIPTION_UPDATE_HOURS и SUBSCRIPTION_CACHE_SIZE должны быть не меньше 1")
+        return v
+    
+    @validator("subscription_cache_ttl")
+    def validate_subscription_cache_ttl(cls, v):
+        """Проверка времени жизни кэша подписок"""
+        if v < 0:
+            raise ValueError("SUBSCRIPTION_CACHE_TTL не может быть отрицательным")
+        return v
+    
+    @validator("key_migration_batch_size")
+    def validate_key_migration_batch_size(cls, v):
+        """Пачка ограничена размером одного запроса addClient"""
+        if not 1 <= v <= 1000:
+            raise ValueError("KEY_MIGRATION_BATCH_SIZE должен быть от 1 до 1000")
+        return v
+    
+    @validator("key_migration_concurrency")
+    def validate_key_migration_concurrency(cls, v):
+        """Проверка параллельности перевода ключей"""
+        if v < 1:
+            raise ValueError("KEY_MIGRATION_CONCURRENCY должен быть не меньше 1")
+        return v
+    
+    @validator("bot_mode")
+    def validate_bot_mode(cls, v):
+        """Проверка режима работы бота"""
+        if v not in ("polling", "webhook"):
+            raise ValueError("BOT_MODE должен быть polling или webhook")
+        return v
+    
+    @validator("run_mode")
+    def validate_run_mode(cls, v):
+        """Проверка режима запуска"""
+        if v not in ("multiprocess", "single"):
+            raise ValueError("RUN_MODE должен быть multiprocess или single")
+        return v
+    
+    @validator("api_workers")
+    def validate_api_workers(cls, v):
+        """Проверка количества воркеров API"""
+        if v < 1:
+            raise ValueError("API_WORKERS должен быть не меньше 1")
+        return v
+    
+    @validator("metrics_flush_seconds")
+    def validate_metrics_flush_seconds(cls, v):
+        """Проверка интервала записи снимков метрик"""
+        if v <= 0:
+            raise ValueError("METRICS_FLUSH_SECONDS должен быть больше 0")
+        return v
+    
+    @validator("throttle_rate", "throttle_burst", "throttle_expensive_rate", "throttle_expensive_burst")
+    def validate_throttle(cls, v):
+        """Проверка лимитов частоты запросов"""
+        if v <= 0:
+            raise ValueError("Лимит частоты запросов должен быть положительным")
+        return v
+    
+    @validator("telegram_webhook_secret", always=True)
+    def validate_telegram_webhook(cls, v, values):
+        """В режиме webhook обязательны URL и секрет"""
+        if values.get("bot_mode") == "webhook":
+            if not values.get("telegram_webhook_url"):
+                raise ValueError("Для BOT_MODE=webhook укажите TELEGRAM_WEBHOOK_URL")
+            if not v:
+                raise ValueError("Для BOT_MODE=webhook укажите TELEGRAM_WEBHOOK_SECRET")
+        return v
+    
+    @validator(
+        "tariff_1m_price", "tariff_3m_price", "tariff_12m_price",
+        "tariff_antiblock_1m_price", "tariff_antiblock_3m_price", "tariff_antiblock_12m_price"
+    )
     def validate_prices(cls, v):
         """Проверка корректности цен"""
         if v <= 0:
             raise ValueError("Цена должна быть положительной")
         return v
     
-    def get_tariff_info(self, tariff_id: str) -> dict:
-        """Получить информацию о тарифе"""
-        tariffs = {
-            "1m": {
-                "name": "1 месяц",
-                "days": 30,
-                "price": self.tariff_1m_price,
-                "price_rub": self.tariff_1m_price / 100,
-                "antiblock": False
-            },
-            "3m": {
-                "name": "3 месяца",
-                "days": 90,
-                "price": self.tariff_3m_price,
-                "price_rub": self.tariff_3m_price / 100,
-                "antiblock": False
-            },
-            "12m": {
-                "name": "1 год",
-                "days": 365,
-                "price": self.tariff_12m_price,
-                "price_rub": self.tariff_12m_price / 100,
-                "antiblock": False
-            },
-            "antiblock_1m": {
-                "name": "🛡️ Антиглушилка 1 месяц",
-                "days": 30,
-                "price": self.tariff_antiblock_1m_price,
-                "price_rub": self.tariff_antiblock_1m_price / 100,
-                "antiblock": True
-            },
-            "antiblock_3m": {
-                "name": "🛡️ Антиглушилка 3 месяца",
-                "days": 90,
-                "price": self.tariff_antiblock_3m_price,
-                "price_rub": self.tariff_antiblock_3m_price / 100,
-                "antiblock": True
-            },
-            "antiblock_12m": {
-                "name": "🛡️ Антиглушилка 1 год",
-                "days": 365,
-                "price": self.tariff_antiblock_12m_price,
-                "price_rub": self.tariff_antiblock_12m_price / 100,
-                "antiblock": True
-            }
-        }
-        return tariffs.get(tariff_id)
+    # Каталог тарифов и ID администраторов собираются один раз при загрузке настроек
+    _tariffs: Mapping[str, Tariff] = PrivateAttr(default_factory=dict)
+    _admin_ids: FrozenSet[int] = PrivateAttr(default_factory=frozenset)
+    
+    def model_post_init(self, __context):
+        self._build_catalogs()
+    
+    def _build_catalogs(self):
+        """Собрать каталог тарифов и множество администраторов"""
+        tariffs = (
+            Tariff("1m", "1 месяц", 30, self.tariff_1m_price, False),
+            Tariff("3m", "3 месяца", 90, self.tariff_3m_price, False),
+            Tariff("12m", "1 год", 365, self.tariff_12m_price, False),
+            Tariff("antiblock_1m", "🛡️ Антиглушилка 1 месяц", 30, self.tariff_antiblock_1m_price, True),
+            Tariff("antiblock_3m", "🛡️ Антиглушилка 3 месяца", 90, self.tariff_antiblock_3m_price, True),
+            Tariff("antiblock_12m", "🛡️ Антиглушилка 1 год", 365, self.tariff_antiblock_12m_price, True),
+        )
+        self._tariffs = MappingProxyType({tariff.id: tariff for tariff in tariffs})
+        self._admin_ids = frozenset(
+            int(admin_id.strip()) for admin_id in self.admin_users.split(",") if admin_id.strip()
+        )
+    
+    @property
+    def tariffs(self) -> Mapping[str, Tariff]:
+        """Каталог тарифов (только для чтения)"""
+        return self._tariffs
+    
+    @property
+    def admin_ids(self) -> FrozenSet[int]:
+        """Telegram ID администраторов"""
+        return self._admin_ids
+    
+    def get_tariff(self, tariff_id: str) -> Optional[Tariff]:
+        """Получить тариф по ID"""
+        return self._tariffs.get(tariff_id)
     
     def is_admin(self, telegram_id: int) -> bool:
         """Проверить, является ли пользователь администратором"""
-        if not self.admin_users:
-            return False
-        admin_ids = [int(id.strip()) for id in self.admin_users.split(',') if id.strip()]
-        return telegram_id in admin_ids
+        return telegram_id in self._admin_ids
+    
+    def subscription_link(self, sub_token: Optional[str]) -> Optional[str]:
+        """Ссылка подписки пользователя или None, если SUBSCRIPTION_BASE_URL не задан"""
+        if not self.subscription_base_url or not sub_token:
+            return None
+        return f"{self.subscription_base_url.rstrip('/')}/sub/{sub_token}"
     
     class Config:
         env_file = ".env"
@@ -125,3 +329,38 @@ class Settings(BaseSettings):
 
 # Глобальный экземпляр настроек
 settings = Settings()
+
+_reload_listeners: List[Callable[[Settings], None]] = []
+
+
+def on_settings_reload(listener: Callable[[Settings], None]) -> Callable[[Settings], None]:
+    """Зарегистрировать обработчик, пересобирающий кэши после перезагрузки настроек"""
+    _reload_listeners.append(listener)
+    return listener
+
+
+def reload_settings() -> Settings:
+    """
+    Перечитать .env и переменные окружения
+    
+    Новые значения сначала проходят полную валидацию: при ошибке
+    выбрасывается ValidationError, а текущие настройки не меняются.
+    Затем значения переносятся в глобальный объект settings (модули
+    держат ссылку на него) и вызываются обработчики on_settings_reload.
+    
+    Сразу применяются тарифы, администраторы, пробный период, лимиты
+    антифлуда (THROTTLE_*), рассылок (BROADCAST_RATE_LIMIT, _CONCURRENCY,
+    _BATCH_SIZE) и перевода ключей (KEY_MIGRATION_*) - их сервисы
+    подписаны через on_settings_reload. Остальные параметры (токены,
+    адреса, пути, интервалы фоновых задач) используются при создании
+    сервисов и требуют перезапуска.
+    """
+    fresh = Settings()
+    for name in Settings.model_fields:
+        setattr(settings, name, getattr(fresh, name))
+    settings._build_catalogs()
+    
+    for listener in _reload_listeners:
+        listener(settings)
+    logger.info("Настройки перезагружены")
+    return settings
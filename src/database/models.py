@@ -1,19 +1,120 @@
 """Модели базы данных SQLite"""
+import asyncio
+import secrets
+import time
 import aiosqlite
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator, Tuple
 from pathlib import Path
 
+from src.database.profiling import PROFILER, ProfiledConnection
+from src.monitoring.metrics import instrument_queries
 
+
+# Сегменты аудитории рассылок: условие по таблице users (алиас u).
+# Все условия опираются на индексы subscriptions(user_id, is_active, expires_at)
+# и payments(telegram_id, status), поэтому проверка идёт точечно по каждому пользователю.
+_ACTIVE_SUBSCRIPTION = """
+    EXISTS (
+        SELECT 1 FROM subscriptions s
+        WHERE s.user_id = u.id AND s.is_active = 1 AND s.expires_at > CURRENT_TIMESTAMP
+    )
+"""
+_PAID = """
+    EXISTS (
+        SELECT 1 FROM payments p
+        WHERE p.telegram_id = u.telegram_id AND p.status = 'succeeded'
+    )
+"""
+BROADCAST_SEGMENTS = {
+    "all": "1",
+    "active": _ACTIVE_SUBSCRIPTION,
+    "expired": f"""
+        NOT {_ACTIVE_SUBSCRIPTION}
+        AND EXISTS (
+            SELECT 1 FROM subscriptions s
+            WHERE s.user_id = u.id
+            AND s.is_active = 1
+            AND s.expires_at <= CURRENT_TIMESTAMP
+            AND s.expires_at > datetime('now', :expired_since)
+        )
+    """,
+    "never_paid": f"NOT {_PAID}",
+    "trial_only": f"u.trial_used = 1 AND NOT {_PAID}",
+    "antiblock": """
+        EXISTS (
+            SELECT 1 FROM subscriptions s
+            WHERE s.user_id = u.id AND s.is_active = 1 AND s.expires_at > CURRENT_TIMESTAMP
+            AND s.tariff LIKE 'antiblock%'
+        )
+    """,
+}
+
+
+# Подписки для массового перевода ключей: активные, того же режима (обычный или
+# антиглушилка), выданные не на целевой inbound (:target) или до появления inbound_id
+_KEY_MIGRATION_CANDIDATE = """
+    s.is_active = 1 AND s.expires_at > CURRENT_TIMESTAMP
+    AND (s.inbound_id IS NULL OR s.inbound_id != :target)
+    AND (s.tariff LIKE '%antiblock%') = :antiblock
+"""
+
+
+# Колонки выгрузки для аналитики: ключи VPN (hiddify_uuid, subscription_url, sub_token) не выгружаются
+EXPORT_COLUMNS = {
+    "payments": ("id", "telegram_id", "yookassa_payment_id", "amount", "tariff", "status", "created_at", "updated_at"),
+    "subscriptions": ("id", "user_id", "tariff", "inbound_id", "expires_at", "is_active", "created_at"),
+    "users": ("id", "telegram_id", "username", "trial_used", "bot_blocked", "had_subscription", "created_at"),
+}
+
+# Строки, которые переносятся в архив после срока хранения (:age - '-N days').
+# Успешные платежи остаются: на них считаются выручка и сегменты рассылок.
+# Истёкшие подписки уходят позже сегмента "истекла недавно" (срок не меньше BROADCAST_EXPIRED_DAYS)
+ARCHIVE_RULES = {
+    "payments": "status != 'succeeded' AND created_at < datetime('now', :age)",
+    "subscriptions": """
+        (is_active = 0 AND created_at < datetime('now', :age))
+        OR expires_at < datetime('now', :age)
+    """,
+}
+
+
+@instrument_queries
 class Database:
     """Менеджер базы данных"""
     
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, slow_query_ms: Optional[float] = None):
         self.db_path = db_path
+        if slow_query_ms is not None:
+            PROFILER.slow_ms = slow_query_ms
+    
+    def connect(self, timeout: float = 5.0) -> aiosqlite.Connection:
+        """
+        Соединение с базой с замером запросов
+        
+        Все запросы должны идти через это соединение, чтобы попасть
+        в журнал медленных запросов.
+        
+        Args:
+            timeout: Сколько секунд ждать блокировку, прежде чем вернуть "database is locked"
+        """
+        return aiosqlite.connect(self.db_path, timeout=timeout, factory=ProfiledConnection)
         
     async def init_db(self):
-        """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """
+        Инициализация базы данных
+        
+        Воркеры API и бот вызывают её одновременно при старте, поэтому вся
+        миграция идёт в одной транзакции BEGIN IMMEDIATE: проверки колонок
+        и ALTER TABLE выполняет один процесс, остальные ждут блокировку
+        и видят уже обновлённую схему.
+        """
+        async with self.connect(timeout=60.0) as db:
+            # WAL: читатели не блокируют писателей, несколько процессов (воркеры API и бот)
+            # пишут в одну БД без ошибок "database is locked"
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("BEGIN IMMEDIATE")
+            
             # Таблица пользователей
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -21,9 +122,23 @@ class Database:
                     telegram_id INTEGER UNIQUE NOT NULL,
                     username TEXT,
                     trial_used BOOLEAN DEFAULT 0,
+                    bot_blocked BOOLEAN DEFAULT 0,
+                    had_subscription BOOLEAN DEFAULT 0,
+                    sub_token TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            await self._ensure_column(db, "users", "bot_blocked", "BOOLEAN DEFAULT 0")
+            # Флаг "была подписка": старые подписки уходят в архив, а пробный период
+            # показывается только тем, у кого подписок не было никогда
+            had_subscription_added = await self._ensure_column(db, "users", "had_subscription", "BOOLEAN DEFAULT 0")
+            # Токен ссылки подписки /sub/{token}: выдаётся при создании пользователя
+            if await self._ensure_column(db, "users", "sub_token", "TEXT"):
+                await db.execute("UPDATE users SET sub_token = lower(hex(randomblob(16))) WHERE sub_token IS NULL")
+            await db.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_users_sub_token
+                ON users(sub_token)
+            """)
             
             # Таблица подписок
             await db.execute("""
@@ -33,12 +148,20 @@ class Database:
                     tariff TEXT NOT NULL,
                     hiddify_uuid TEXT NOT NULL,
                     subscription_url TEXT NOT NULL,
+                    inbound_id INTEGER,
                     expires_at TIMESTAMP NOT NULL,
                     is_active BOOLEAN DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )
             """)
+            # Inbound клиента: по нему /sub/{token} собирает ссылку из текущего каталога
+            await self._ensure_column(db, "subscriptions", "inbound_id", "INTEGER")
+            if had_subscription_added:
+                await db.execute("""
+                    UPDATE users SET had_subscription = 1
+                    WHERE id IN (SELECT user_id FROM subscriptions)
+                """)
             
             # Таблица платежей
             await db.execute("""
@@ -54,6 +177,81 @@ class Database:
                 )
             """)
             
+            # Таблица рассылок (прогресс сохраняется для возобновления)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    reply_markup TEXT,
+                    status TEXT DEFAULT 'pending',
+                    last_user_id INTEGER DEFAULT 0,
+                    total INTEGER DEFAULT 0,
+                    sent_count INTEGER DEFAULT 0,
+                    failed_count INTEGER DEFAULT 0,
+                    blocked_count INTEGER DEFAULT 0,
+                    created_by INTEGER,
+                    segment TEXT DEFAULT 'all',
+                    segment_days INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await self._ensure_column(db, "broadcasts", "segment", "TEXT DEFAULT 'all'")
+            await self._ensure_column(db, "broadcasts", "segment_days", "INTEGER")
+            
+            # Массовый перевод ключей на другой inbound (прогресс сохраняется для возобновления)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS key_migrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    target_inbound_id INTEGER NOT NULL,
+                    antiblock BOOLEAN DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    last_subscription_id INTEGER DEFAULT 0,
+                    total INTEGER DEFAULT 0,
+                    migrated_count INTEGER DEFAULT 0,
+                    skipped_count INTEGER DEFAULT 0,
+                    disabled_count INTEGER DEFAULT 0,
+                    notified_count INTEGER DEFAULT 0,
+                    failed_count INTEGER DEFAULT 0,
+                    created_by INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Переведённые подписки, у которых ещё не отключён старый клиент и не
+            # отправлено уведомление: после падения процесса доделываются при возобновлении
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS key_migration_pending (
+                    migration_id INTEGER NOT NULL,
+                    subscription_id INTEGER NOT NULL,
+                    old_uuid TEXT NOT NULL,
+                    PRIMARY KEY (migration_id, subscription_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # Аренды (leases) фоновых задач между процессами
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            
+            # Шаги обработки платежей (трассировка "оплата -> ключ")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS trace_spans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trace_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    duration_ms REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    detail TEXT
+                )
+            """)
+            
             # Индексы для оптимизации
             await db.execute("""
                 CREATE INDEX IF NOT EXISTS idx_users_telegram_id 
@@ -70,24 +268,74 @@ class Database:
                 ON payments(telegram_id)
             """)
             
+            # Индексы для сегментов рассылок
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_subscriptions_user_active
+                ON subscriptions(user_id, is_active, expires_at)
+            """)
+            
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_payments_telegram_status
+                ON payments(telegram_id, status)
+            """)
+            
+            # Выгрузка за период: keyset по (created_at, id)
+            for table in EXPORT_COLUMNS:
+                await db.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{table}_created_at
+                    ON {table}(created_at)
+                """)
+            
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_trace_spans_trace_id
+                ON trace_spans(trace_id)
+            """)
+            
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_trace_spans_started_at
+                ON trace_spans(started_at)
+            """)
+            
             await db.commit()
     
+    @staticmethod
+    async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, definition: str) -> bool:
+        """
+        Добавить колонку в существующую таблицу (миграция старых БД)
+        
+        Returns:
+            True, если колонка добавлена сейчас
+        """
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if column not in columns:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            return True
+        return False
+    
     async def create_user(self, telegram_id: int, username: Optional[str] = None) -> int:
         """Создать пользователя или вернуть существующего"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             # Проверить, существует ли пользователь
             async with db.execute(
                 "SELECT id FROM users WHERE telegram_id = ?", 
                 (telegram_id,)
             ) as cursor:
                 row = await cursor.fetchone()
-                if row:
-                    return row[0]
+            if row:
+                # Пользователь снова пишет боту - значит, разблокировал его
+                cursor = await db.execute(
+                    "UPDATE users SET bot_blocked = 0 WHERE id = ? AND bot_blocked = 1",
+                    (row[0],)
+                )
+                if cursor.rowcount:
+                    await db.commit()
+                return row[0]
             
             # Создать нового пользователя
             cursor = await db.execute(
-                "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
-                (telegram_id, username)
+                "INSERT INTO users (telegram_id, username, sub_token) VALUES (?, ?, ?)",
+                (telegram_id, username, secrets.token_hex(16))
             )
             await db.commit()
             return cursor.lastrowid
@@ -100,7 +348,7 @@ class Database:
         tariff: str
     ) -> int:
         """Создать запись о платеже"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute("""
                 INSERT INTO payments (telegram_id, yookassa_payment_id, amount, tariff, status)
                 VALUES (?, ?, ?, ?, 'pending')
@@ -110,7 +358,7 @@ class Database:
     
     async def update_payment_status(self, yookassa_payment_id: str, status: str):
         """Обновить статус платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute("""
                 UPDATE payments 
                 SET status = ?, updated_at = CURRENT_TIMESTAMP
@@ -120,7 +368,7 @@ class Database:
     
     async def get_payment(self, yookassa_payment_id: str) -> Optional[dict]:
         """Получить информацию о платеже"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             db.row_factory = aiosqlite.Row
             async with db.execute(
                 "SELECT * FROM payments WHERE yookassa_payment_id = ?",
@@ -135,12 +383,13 @@ class Database:
         tariff: str,
         hiddify_uuid: str,
         subscription_url: str,
-        days: int
+        days: int,
+        inbound_id: Optional[int] = None
     ) -> int:
         """Создать подписку"""
         expires_at = datetime.now() + timedelta(days=days)
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             # Деактивировать старые подписки
             await db.execute("""
                 UPDATE subscriptions 
@@ -151,19 +400,23 @@ class Database:
             # Создать новую подписку
             cursor = await db.execute("""
                 INSERT INTO subscriptions 
-                (user_id, tariff, hiddify_uuid, subscription_url, expires_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, tariff, hiddify_uuid, subscription_url, expires_at))
+                (user_id, tariff, hiddify_uuid, subscription_url, inbound_id, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, tariff, hiddify_uuid, subscription_url, inbound_id, expires_at))
+            await db.execute(
+                "UPDATE users SET had_subscription = 1 WHERE id = ? AND had_subscription = 0",
+                (user_id,)
+            )
             
             await db.commit()
             return cursor.lastrowid
     
     async def get_active_subscription(self, telegram_id: int) -> Optional[dict]:
         """Получить активную подписку пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
-                SELECT s.* 
+                SELECT s.*, u.sub_token
                 FROM subscriptions s
                 JOIN users u ON s.user_id = u.id
                 WHERE u.telegram_id = ? 
@@ -177,7 +430,7 @@ class Database:
     
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
         """Получить пользователя по telegram_id"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             db.row_factory = aiosqlite.Row
             async with db.execute(
                 "SELECT * FROM users WHERE telegram_id = ?",
@@ -188,7 +441,7 @@ class Database:
     
     async def has_used_trial(self, telegram_id: int) -> bool:
         """Проверить, использовал ли пользователь пробный период"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             async with db.execute(
                 "SELECT trial_used FROM users WHERE telegram_id = ?",
                 (telegram_id,)
@@ -198,21 +451,697 @@ class Database:
     
     async def mark_trial_used(self, telegram_id: int):
         """Отметить, что пользователь использовал пробный период"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute(
                 "UPDATE users SET trial_used = 1 WHERE telegram_id = ?",
                 (telegram_id,)
             )
             await db.commit()
-    
+
+    async def claim_trial(self, telegram_id: int) -> bool:
+        """
+        Атомарно занять пробный период
+
+        Returns:
+            True если пробный период ещё не был использован
+        """
+        async with self.connect() as db:
+            cursor = await db.execute(
+                "UPDATE users SET trial_used = 1 WHERE telegram_id = ? AND trial_used = 0",
+                (telegram_id,)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def release_trial(self, telegram_id: int):
+        """Вернуть пробный период, если выдать доступ не удалось"""
+        async with self.connect() as db:
+            await db.execute(
+                "UPDATE users SET trial_used = 0 WHERE telegram_id = ?",
+                (telegram_id,)
+            )
+            await db.commit()
+
     async def has_any_subscription(self, telegram_id: int) -> bool:
-        """Проверить, были ли у пользователя подписки (включая истекшие)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Проверить, были ли у пользователя подписки (включая истекшие и архивные)"""
+        async with self.connect() as db:
+            async with db.execute(
+                "SELECT had_subscription FROM users WHERE telegram_id = ?",
+                (telegram_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return bool(row[0]) if row else False
+
+    async def check_writable(self, timeout: float = 2.0):
+        """
+        Проверить, что в базу можно писать
+        
+        Берёт блокировку записи так же, как любая запись (BEGIN IMMEDIATE),
+        и сразу откатывает транзакцию, не меняя данных. Если базу держит
+        другой писатель дольше timeout, выбрасывает OperationalError
+        "database is locked".
+        """
+        async with self.connect(timeout=timeout) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.rollback()
+    
+    async def update_subscription_key(
+        self,
+        subscription_id: int,
+        hiddify_uuid: str,
+        subscription_url: str,
+        inbound_id: Optional[int] = None
+    ):
+        """Заменить ключ подписки (перевыпуск без изменения срока)"""
+        async with self.connect() as db:
+            await db.execute(
+                "UPDATE subscriptions SET hiddify_uuid = ?, subscription_url = ?, inbound_id = ? WHERE id = ?",
+                (hiddify_uuid, subscription_url, inbound_id, subscription_id)
+            )
+            await db.commit()
+    
+    async def get_sub_token(self, telegram_id: int) -> Optional[str]:
+        """Токен ссылки подписки пользователя"""
+        async with self.connect() as db:
+            async with db.execute(
+                "SELECT sub_token FROM users WHERE telegram_id = ?", (telegram_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    
+    async def get_feed_subscription(self, sub_token: str) -> Optional[dict]:
+        """
+        Подписка для /sub/{token}
+        
+        Returns:
+            None для неизвестного токена, иначе словарь с telegram_id и полями
+            активной подписки (None в полях подписки, если активной нет)
+        """
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT u.telegram_id, s.id, s.tariff, s.hiddify_uuid, s.subscription_url,
+                       s.inbound_id, s.expires_at
+                FROM users u
+                LEFT JOIN subscriptions s ON s.id = (
+                    SELECT id FROM subscriptions
+                    WHERE user_id = u.id AND is_active = 1 AND expires_at > CURRENT_TIMESTAMP
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )
+                WHERE u.sub_token = ?
+            """, (sub_token,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_stats(self) -> dict:
+        """Сводная статистика для админ-панели"""
+        async with self.connect() as db:
+            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+                total_users = (await cursor.fetchone())[0]
+            async with db.execute(
+                "SELECT COUNT(*) FROM subscriptions WHERE is_active = 1 AND expires_at > CURRENT_TIMESTAMP"
+            ) as cursor:
+                active_subscriptions = (await cursor.fetchone())[0]
+            async with db.execute("SELECT COUNT(*) FROM payments WHERE status = 'succeeded'") as cursor:
+                succeeded_payments = (await cursor.fetchone())[0]
+            async with db.execute("SELECT SUM(amount) FROM payments WHERE status = 'succeeded'") as cursor:
+                revenue = (await cursor.fetchone())[0] or 0
+        return {
+            "total_users": total_users,
+            "active_subscriptions": active_subscriptions,
+            "succeeded_payments": succeeded_payments,
+            "revenue": revenue,
+        }
+
+    async def get_recent_users(self, limit: int = 20) -> List[Tuple[int, str]]:
+        """Последние зарегистрированные пользователи: [(telegram_id, created_at), ...]"""
+        async with self.connect() as db:
+            async with db.execute(
+                "SELECT telegram_id, created_at FROM users ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def get_recent_active_subscriptions(self, limit: int = 15) -> List[dict]:
+        """Последние активные подписки с telegram_id владельца"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
             async with db.execute("""
-                SELECT COUNT(*) 
+                SELECT s.id, u.telegram_id, s.tariff, s.expires_at, s.hiddify_uuid
                 FROM subscriptions s
                 JOIN users u ON s.user_id = u.id
-                WHERE u.telegram_id = ?
-            """, (telegram_id,)) as cursor:
+                WHERE s.is_active = 1
+                ORDER BY s.created_at DESC
+                LIMIT ?
+            """, (limit,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def mark_users_blocked(self, telegram_ids: List[int]):
+        """Отметить пользователей, заблокировавших бота"""
+        if not telegram_ids:
+            return
+        async with self.connect() as db:
+            await db.executemany(
+                "UPDATE users SET bot_blocked = 1 WHERE telegram_id = ?",
+                [(telegram_id,) for telegram_id in telegram_ids]
+            )
+            await db.commit()
+    
+    @staticmethod
+    def _segment_query(segment: str, days: Optional[int]) -> Tuple[str, dict]:
+        """Условие WHERE и параметры для сегмента рассылки"""
+        if segment not in BROADCAST_SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент рассылки: {segment}")
+        condition = f"u.bot_blocked = 0 AND {BROADCAST_SEGMENTS[segment]}"
+        params = {}
+        if ":expired_since" in condition:
+            params["expired_since"] = f"-{days or 30} days"
+        return condition, params
+    
+    async def count_broadcast_recipients(self, segment: str = "all", days: Optional[int] = None) -> int:
+        """Количество получателей рассылки в сегменте (без заблокировавших бота)"""
+        condition, params = self._segment_query(segment, days)
+        async with self.connect() as db:
+            async with db.execute(
+                f"SELECT COUNT(*) FROM users u WHERE {condition}",
+                params
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
+    async def iter_broadcast_recipients(
+        self,
+        after_user_id: int = 0,
+        batch_size: int = 500,
+        segment: str = "all",
+        days: Optional[int] = None
+    ) -> AsyncIterator[List[Tuple[int, int]]]:
+        """
+        Постранично выдать получателей рассылки
+        
+        Используется keyset-пагинация по первичному ключу: каждая пачка -
+        отдельный короткий запрос, список целиком в память не загружается.
+        
+        Args:
+            after_user_id: Продолжить после этого users.id
+            batch_size: Размер пачки
+            segment: Сегмент аудитории (см. BROADCAST_SEGMENTS)
+            days: Глубина в днях для сегмента expired
+        
+        Yields:
+            Пачки [(users.id, telegram_id), ...] в порядке возрастания id
+        """
+        condition, params = self._segment_query(segment, days)
+        query = f"""
+            SELECT u.id, u.telegram_id
+            FROM users u
+            WHERE u.id > :after_id AND {condition}
+            ORDER BY u.id
+            LIMIT :batch_size
+        """
+        last_id = after_user_id
+        while True:
+            async with self.connect() as db:
+                async with db.execute(
+                    query,
+                    {**params, "after_id": last_id, "batch_size": batch_size}
+                ) as cursor:
+                    batch = [tuple(row) for row in await cursor.fetchall()]
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1][0]
+    
+    async def iter_export(
+        self,
+        table: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> AsyncIterator[List[Tuple]]:
+        """
+        Постранично выдать строки таблицы для выгрузки (колонки EXPORT_COLUMNS)
+        
+        Keyset-пагинация по индексу idx_{table}_created_at: каждая пачка -
+        отдельный короткий запрос на своём соединении, поэтому между пачками
+        нет открытой читающей транзакции, а память не зависит от размера
+        таблицы.
+        
+        Args:
+            table: payments, subscriptions или users
+            since: Начало периода по created_at включительно ('YYYY-MM-DD HH:MM:SS', UTC)
+            until: Конец периода по created_at, не включая
+            batch_size: Размер пачки
+        
+        Yields:
+            Пачки строк в порядке (created_at, id)
+        """
+        columns = ", ".join(EXPORT_COLUMNS[table])
+        conditions = ["(created_at, id) > (:last_created_at, :last_id)"]
+        if until:
+            conditions.append("created_at < :until")
+        query = f"""
+            SELECT {columns}
+            FROM {table}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at, id
+            LIMIT :batch_size
+        """
+        # Пустая строка меньше любой даты: первая пачка начинается с since или с начала таблицы
+        params = {"last_created_at": since or "", "last_id": -1, "until": until, "batch_size": batch_size}
+        created_at_index = EXPORT_COLUMNS[table].index("created_at")
+        while True:
+            async with self.connect() as db:
+                async with db.execute(query, params) as cursor:
+                    batch = [tuple(row) for row in await cursor.fetchall()]
+            if not batch:
+                return
+            yield batch
+            params["last_created_at"] = batch[-1][created_at_index]
+            params["last_id"] = batch[-1][0]
+    
+    async def create_broadcast(
+        self,
+        text: str,
+        reply_markup: Optional[str],
+        created_by: int,
+        total: int,
+        segment: str = "all",
+        segment_days: Optional[int] = None
+    ) -> int:
+        """Создать задание рассылки"""
+        async with self.connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO broadcasts
+                (text, reply_markup, created_by, total, segment, segment_days, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending')
+            """, (text, reply_markup, created_by, total, segment, segment_days))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        """Получить задание рассылки"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM broadcasts WHERE id = ?",
+                (broadcast_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def get_broadcasts_by_status(self, status: str) -> List[dict]:
+        """Получить задания рассылки с указанным статусом"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM broadcasts WHERE status = ? ORDER BY id",
+                (status,)
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def set_broadcast_status(self, broadcast_id: int, status: str, expected: Optional[str] = None) -> bool:
+        """
+        Обновить статус рассылки
+        
+        Args:
+            expected: Менять, только если текущий статус такой (пауза или
+                отмена, пришедшие после последней пачки, не перезаписываются)
+        
+        Returns:
+            True если статус обновлён
+        """
+        async with self.connect() as db:
+            cursor = await db.execute("""
+                UPDATE broadcasts
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND (? IS NULL OR status = ?)
+            """, (status, broadcast_id, expected, expected))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def save_broadcast_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked: int
+    ):
+        """Сохранить контрольную точку рассылки (счётчики прибавляются)"""
+        async with self.connect() as db:
+            await db.execute("""
+                UPDATE broadcasts
+                SET last_user_id = ?,
+                    sent_count = sent_count + ?,
+                    failed_count = failed_count + ?,
+                    blocked_count = blocked_count + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (last_user_id, sent, failed, blocked, broadcast_id))
+            await db.commit()
+    
+    async def count_key_migration_candidates(self, target_inbound_id: int, antiblock: bool) -> int:
+        """Сколько активных подписок режима antiblock выдано не на target_inbound_id"""
+        async with self.connect() as db:
+            async with db.execute(
+                f"SELECT COUNT(*) FROM subscriptions s WHERE {_KEY_MIGRATION_CANDIDATE}",
+                {"target": target_inbound_id, "antiblock": int(antiblock)}
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    async def get_key_migration_batch(
+        self,
+        target_inbound_id: int,
+        antiblock: bool,
+        after_id: int,
+        limit: int
+    ) -> List[dict]:
+        """
+        Следующая пачка подписок для перевода, по возрастанию subscriptions.id
+        
+        Подписки, выданные после запуска перевода, уже на новом inbound'е
+        и в выборку не попадают.
+        """
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(f"""
+                SELECT s.id, s.hiddify_uuid, s.inbound_id, s.expires_at,
+                       u.telegram_id, u.bot_blocked, u.sub_token
+                FROM subscriptions s
+                JOIN users u ON u.id = s.user_id
+                WHERE s.id > :after_id AND {_KEY_MIGRATION_CANDIDATE}
+                ORDER BY s.id
+                LIMIT :limit
+            """, {"target": target_inbound_id, "antiblock": int(antiblock), "after_id": after_id, "limit": limit}) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def apply_key_migration(
+        self,
+        migration_id: int,
+        changes: List[Tuple[int, str, str, str, int]],
+        last_subscription_id: int
+    ) -> List[int]:
+        """
+        Заменить ключи пачки подписок и сохранить контрольную точку одной транзакцией
+        
+        Ключ заменяется, только если подписка всё ещё активна и у неё прежний
+        UUID: пользователь мог сам перевыпустить ключ, пока шла пачка.
+        Заменённые подписки попадают в key_migration_pending до отключения
+        старого клиента и уведомления (см. finish_key_migration_pending).
+        
+        Args:
+            migration_id: ID задания перевода
+            changes: (subscription_id, старый UUID, новый UUID, новая ссылка, новый inbound_id)
+            last_subscription_id: Контрольная точка - последняя подписка пачки
+            
+        Returns:
+            ID подписок, ключи которых заменены
+        """
+        applied = []
+        async with self.connect() as db:
+            for subscription_id, old_uuid, new_uuid, url, inbound_id in changes:
+                cursor = await db.execute("""
+                    UPDATE subscriptions
+                    SET hiddify_uuid = ?, subscription_url = ?, inbound_id = ?
+                    WHERE id = ? AND hiddify_uuid = ? AND is_active = 1
+                """, (new_uuid, url, inbound_id, subscription_id, old_uuid))
+                if cursor.rowcount:
+                    applied.append(subscription_id)
+                    await db.execute(
+                        "INSERT OR REPLACE INTO key_migration_pending (migration_id, subscription_id, old_uuid) VALUES (?, ?, ?)",
+                        (migration_id, subscription_id, old_uuid)
+                    )
+            await db.execute("""
+                UPDATE key_migrations
+                SET last_subscription_id = ?,
+                    migrated_count = migrated_count + ?,
+                    skipped_count = skipped_count + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (last_subscription_id, len(applied), len(changes) - len(applied), migration_id))
+            await db.commit()
+        return applied
+    
+    async def get_key_migration_pending(self, migration_id: int) -> List[dict]:
+        """Переведённые подписки, которым ещё нужно отключить старого клиента и отправить ключ"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT p.subscription_id, p.old_uuid, s.subscription_url,
+                       u.telegram_id, u.bot_blocked, u.sub_token
+                FROM key_migration_pending p
+                JOIN subscriptions s ON s.id = p.subscription_id
+                JOIN users u ON u.id = s.user_id
+                WHERE p.migration_id = ?
+                ORDER BY p.subscription_id
+            """, (migration_id,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def finish_key_migration_pending(
+        self,
+        migration_id: int,
+        subscription_ids: List[int],
+        disabled: int,
+        notified: int,
+        failed: int
+    ):
+        """Снять подписки из key_migration_pending и прибавить счётчики одной транзакцией"""
+        async with self.connect() as db:
+            await db.executemany(
+                "DELETE FROM key_migration_pending WHERE migration_id = ? AND subscription_id = ?",
+                [(migration_id, subscription_id) for subscription_id in subscription_ids]
+            )
+            await db.execute("""
+                UPDATE key_migrations
+                SET disabled_count = disabled_count + ?,
+                    notified_count = notified_count + ?,
+                    failed_count = failed_count + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (disabled, notified, failed, migration_id))
+            await db.commit()
+    
+    async def create_key_migration(
+        self,
+        target_inbound_id: int,
+        antiblock: bool,
+        created_by: int,
+        total: int
+    ) -> int:
+        """Создать задание перевода ключей"""
+        async with self.connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO key_migrations (target_inbound_id, antiblock, created_by, total, status)
+                VALUES (?, ?, ?, ?, 'pending')
+            """, (target_inbound_id, antiblock, created_by, total))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_key_migration(self, migration_id: int) -> Optional[dict]:
+        """Получить задание перевода ключей"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("SELECT * FROM key_migrations WHERE id = ?", (migration_id,)) as cursor:
                 row = await cursor.fetchone()
-                return row[0] > 0 if row else False
+                return dict(row) if row else None
+    
+    async def get_key_migrations_by_status(self, status: str) -> List[dict]:
+        """Получить задания перевода ключей с указанным статусом"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM key_migrations WHERE status = ? ORDER BY id", (status,)
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def set_key_migration_status(self, migration_id: int, status: str, expected: Optional[str] = None) -> bool:
+        """
+        Обновить статус перевода ключей
+        
+        Args:
+            expected: Менять, только если текущий статус такой (см. set_broadcast_status)
+        
+        Returns:
+            True если статус обновлён
+        """
+        async with self.connect() as db:
+            cursor = await db.execute("""
+                UPDATE key_migrations
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND (? IS NULL OR status = ?)
+            """, (status, migration_id, expected, expected))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Захватить или продлить аренду
+        
+        Аренда достаётся владельцу, если она свободна, истекла или уже
+        принадлежит ему. Операция атомарна за счёт UPSERT с условием.
+        
+        Args:
+            name: Имя аренды (например, имя фоновой задачи)
+            owner: Идентификатор процесса-владельца
+            ttl: Срок аренды в секундах
+            
+        Returns:
+            True если аренда принадлежит owner
+        """
+        now = time.time()
+        async with self.connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO leases (name, owner, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE
+                SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """, (name, owner, now + ttl, now))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def release_lease(self, name: str, owner: str):
+        """Освободить аренду"""
+        async with self.connect() as db:
+            await db.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                (name, owner)
+            )
+            await db.commit()
+    
+    async def save_trace_spans(
+        self,
+        trace_id: str,
+        spans: List[Tuple[str, float, float, str, Optional[str]]]
+    ):
+        """Сохранить шаги трассы: (шаг, начало в unix, длительность в мс, статус, детали)"""
+        if not spans:
+            return
+        async with self.connect() as db:
+            await db.executemany("""
+                INSERT INTO trace_spans (trace_id, name, started_at, duration_ms, status, detail)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(trace_id, *span) for span in spans])
+            await db.commit()
+    
+    async def get_trace_spans(self, trace_id: str) -> List[dict]:
+        """Шаги трассы в порядке начала"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT name, started_at, duration_ms, status, detail
+                FROM trace_spans
+                WHERE trace_id = ?
+                ORDER BY started_at, id
+            """, (trace_id,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def get_span_durations(self, since: float) -> List[Tuple[str, float]]:
+        """Длительности успешных шагов (шаг, мс), начавшихся после since (unix)"""
+        async with self.connect() as db:
+            async with db.execute("""
+                SELECT name, duration_ms
+                FROM trace_spans
+                WHERE started_at >= ? AND status = 'ok'
+            """, (since,)) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+    
+    async def prune_trace_spans(self, before: float) -> int:
+        """Удалить шаги трасс, начавшиеся раньше before (unix)"""
+        async with self.connect() as db:
+            cursor = await db.execute(
+                "DELETE FROM trace_spans WHERE started_at < ?",
+                (before,)
+            )
+            await db.commit()
+            return cursor.rowcount
+    
+    async def archive_rows(
+        self,
+        table: str,
+        older_than_days: int,
+        archive_path: Optional[str] = None,
+        batch_size: int = 500,
+        pause: float = 0.05
+    ) -> int:
+        """
+        Перенести старые строки в архивную таблицу {table}_archive
+        
+        Какие строки переносить, задаёт ARCHIVE_RULES. Перенос идёт пачками
+        по batch_size строк в порядке id, между пачками пауза, чтобы бот и API
+        успевали писать. Строки пачки сначала копируются (INSERT OR IGNORE)
+        и фиксируются, потом удаляются отдельной транзакцией: в режиме WAL
+        коммит в две базы не атомарен, а так после падения строка остаётся
+        в рабочей таблице и повторный перенос безопасен.
+        
+        Args:
+            table: payments или subscriptions
+            older_than_days: Срок хранения в рабочей таблице
+            archive_path: Отдельная база архива (None - архив в этой же базе)
+            batch_size: Строк за транзакцию
+            pause: Пауза между пачками в секундах
+            
+        Returns:
+            Сколько строк перенесено
+        """
+        where = ARCHIVE_RULES[table]
+        params = {"age": f"-{older_than_days} days", "limit": batch_size, "last_id": 0}
+        moved = 0
+        async with self.connect() as db:
+            schema = "main"
+            if archive_path:
+                await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+                schema = "archive"
+            columns = ", ".join(await self._sync_archive_table(db, table, schema))
+            
+            while True:
+                async with db.execute(f"""
+                    SELECT id FROM main.{table}
+                    WHERE id > :last_id AND ({where})
+                    ORDER BY id
+                    LIMIT :limit
+                """, params) as cursor:
+                    ids = [row[0] for row in await cursor.fetchall()]
+                if not ids:
+                    break
+                
+                placeholders = ", ".join("?" * len(ids))
+                await db.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.{table}_archive ({columns})
+                    SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})
+                """, ids)
+                await db.commit()
+                await db.execute(f"DELETE FROM main.{table} WHERE id IN ({placeholders})", ids)
+                await db.commit()
+                
+                moved += len(ids)
+                params["last_id"] = ids[-1]
+                if len(ids) < batch_size:
+                    break
+                await asyncio.sleep(pause)
+        return moved
+    
+    @staticmethod
+    async def _sync_archive_table(db: aiosqlite.Connection, table: str, schema: str) -> List[str]:
+        """
+        Создать архивную таблицу и добавить в неё новые колонки рабочей
+        
+        Returns:
+            Колонки рабочей таблицы
+        """
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{table}_archive (
+                id INTEGER PRIMARY KEY,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        async with db.execute(f"PRAGMA main.table_info({table})") as cursor:
+            columns = [(row[1], row[2]) for row in await cursor.fetchall()]
+        async with db.execute(f"PRAGMA {schema}.table_info({table}_archive)") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for name, column_type in columns:
+            if name not in existing:
+                await db.execute(f"ALTER TABLE {schema}.{table}_archive ADD COLUMN {name} {column_type}")
+        return [name for name, _ in columns]
@@ -0,0 +1,257 @@
+"""Профилирование SQL: журнал медленных запросов и планы выполнения"""
+import functools
+import hashlib
+import html
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Литералы и списки плейсхолдеров заменяются, чтобы одинаковые по форме
+# запросы попадали в одну строку отчёта
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Запросы, для которых есть смысл в EXPLAIN QUERY PLAN
+_PLANNABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Запрос без литералов и лишних пробелов (тексты запросов в коде постоянные, поэтому кэшируется)"""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?, ...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def fingerprint_params(params) -> str:
+    """Короткий отпечаток параметров: одинаковые вызовы узнаются без значений в логе"""
+    if not params:
+        return "-"
+    digest = hashlib.blake2s(repr(params).encode(), digest_size=4).hexdigest()
+    return f"{len(params)}:{digest}"
+
+
+class QueryStats:
+    """Накопленная статистика одного нормализованного запроса"""
+
+    __slots__ = ("sql", "count", "total", "max", "rows", "slow", "plan")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.plan: Optional[str] = None
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def full_scan(self) -> bool:
+        """План содержит полный просмотр таблицы (SCAN без индекса)"""
+        return bool(self.plan) and any(
+            line.startswith("SCAN ") and "USING" not in line
+            for line in self.plan.splitlines()
+        )
+
+
+class QueryProfiler:
+    """
+    Статистика запросов процесса
+
+    Запросы замеряются в потоке соединения aiosqlite, поэтому время не
+    включает ожидание в event loop. План выполнения снимается один раз
+    для каждого нормализованного запроса при первом выполнении.
+    """
+
+    def __init__(self, slow_ms: float = 100.0):
+        self.slow_ms = slow_ms
+        self._stats: Dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, normalized: str) -> QueryStats:
+        stats = self._stats.get(normalized)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(normalized, QueryStats(normalized))
+        return stats
+
+    def capture_plan(self, connection: sqlite3.Connection, sql: str, params):
+        """Снять EXPLAIN QUERY PLAN, если для этого запроса его ещё нет"""
+        stats = self._get(normalize_sql(sql))
+        if stats.plan is not None:
+            return
+        if not sql.lstrip().upper().startswith(_PLANNABLE):
+            stats.plan = ""
+            return
+        try:
+            # Обычный курсор, чтобы EXPLAIN не попал в статистику
+            rows = sqlite3.Cursor(connection).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            stats.plan = "\n".join(str(row[-1]) for row in rows)
+        except sqlite3.Error as e:
+            stats.plan = f"(план недоступен: {e})"
+
+    def record(self, sql: str, params, elapsed: float, rows: int):
+        """Учесть выполненный запрос и записать его в лог, если он медленный"""
+        stats = self._get(normalize_sql(sql))
+        elapsed_ms = elapsed * 1000
+        rows = max(rows, 0)
+        with self._lock:
+            stats.count += 1
+            stats.total += elapsed_ms
+            stats.max = max(stats.max, elapsed_ms)
+            stats.rows += rows
+            slow = elapsed_ms >= self.slow_ms
+            if slow:
+                stats.slow += 1
+
+        if slow:
+            logger.warning(
+                f"Медленный запрос: {elapsed_ms:.1f} мс, строк {rows}, "
+                f"параметры {fingerprint_params(params)}: {stats.sql}\n"
+                f"План: {stats.plan or '-'}"
+            )
+
+    def top(self, limit: int = 10, order: str = "total") -> List[QueryStats]:
+        """Самые тяжёлые запросы: по суммарному (total), максимальному (max) или среднему (avg) времени"""
+        with self._lock:
+            stats = list(self._stats.values())
+        return sorted(stats, key=lambda s: getattr(s, order), reverse=True)[:limit]
+
+    def reset(self):
+        """Сбросить накопленную статистику (планы снимутся заново)"""
+        with self._lock:
+            self._stats.clear()
+
+
+# Профилировщик процесса; порог задаётся в Database
+PROFILER = QueryProfiler()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    Курсор, замеряющий запросы
+
+    Время запроса - выполнение плюс чтение строк. Запрос учитывается,
+    когда строки прочитаны до конца, курсор закрыт или переиспользован
+    для следующего запроса.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sql: Optional[str] = None
+        self._params = None
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        rows = self._rows if self.description is not None else self.rowcount
+        PROFILER.record(self._sql, self._params, self._elapsed, rows)
+        self._sql = None
+
+    def _start(self, sql: str, params: Sequence):
+        self._finish()
+        self._sql = sql
+        self._params = params
+        self._rows = 0
+
+    def execute(self, sql: str, params: Sequence = ()):
+        self._start(sql, params)
+        PROFILER.capture_plan(self.connection, sql, params)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._elapsed = time.perf_counter() - started
+
+    def executemany(self, sql: str, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self._start(sql, seq_of_params)
+        if seq_of_params:
+            PROFILER.capture_plan(self.connection, sql, seq_of_params[0])
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._elapsed = time.perf_counter() - started
+            self._finish()
+
+    def _fetched(self, rows: list, started: float, exhausted: bool) -> list:
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        if exhausted:
+            self._finish()
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched([row] if row is not None else [], started, row is None)
+        return row
+
+    def fetchmany(self, size: int = None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        return self._fetched(rows, started, len(rows) < size)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        return self._fetched(super().fetchall(), started, True)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Курсор без close() (cursor = await db.execute(...)); только учёт,
+        # обращаться к SQLite из чужого потока нельзя
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Соединение SQLite, создающее ProfiledCursor (factory для sqlite3.connect)"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C создаёт курсор в обход cursor()
+    def execute(self, sql: str, params: Sequence = ()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+def format_top(stats: List[QueryStats], slow_ms: float) -> str:
+    """Текст отчёта о запросах для админа"""
+    if not stats:
+        return "🐢 Запросов к базе ещё не было"
+
+    lines = [f"🐢 <b>Тяжёлые запросы</b> (порог медленных {slow_ms:g} мс)\n"]
+    for i, s in enumerate(stats, 1):
+        sql = s.sql if len(s.sql) <= 200 else s.sql[:200] + "…"
+        scan = " ⚠️ SCAN" if s.full_scan else ""
+        lines.append(
+            f"<b>{i}.</b> всего {s.total:.0f} мс, {s.count} раз, "
+            f"ср. {s.avg:.1f} / макс. {s.max:.1f} мс, строк {s.rows}, медленных {s.slow}{scan}\n"
+            f"<code>{html.escape(sql)}</code>"
+        )
+    return "\n\n".join(lines)
+
@@ -0,0 +1,417 @@
+"""Метрики в текстовом формате Prometheus"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Snapshot(NamedTuple):
+    """Значения метрик другого процесса: имя метрики -> серии по меткам"""
+    metrics: Dict[str, Dict[Tuple, list]]
+    alive: bool
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric"):
+        self._metrics.append(metric)
+
+    def snapshot(self) -> Dict[str, Dict[Tuple, list]]:
+        """Текущие серии всех метрик (для сложения с другими процессами)"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, others: Sequence[Snapshot] = ()) -> str:
+        """
+        Все метрики в формате text/plain; version=0.0.4
+
+        Args:
+            others: Снимки других процессов, складываются с метриками этого
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            series = metric.snapshot()
+            if others:
+                series = metric.merge([series] + [
+                    other.metrics.get(metric.name, {})
+                    for other in others
+                    if other.alive or metric.keep_dead
+                ])
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(series))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Базовая метрика с шардированием по потокам
+
+    Каждый поток пишет только в свой словарь серий, поэтому запись не
+    требует блокировок: на горячем пути это поиск в dict и сложение.
+    Блокировка берётся один раз, когда поток впервые пишет в метрику.
+    При сборе шарды суммируются; list(dict.items()) копируется под GIL
+    целиком, поэтому чтение не мешает пишущим потокам.
+    """
+
+    kind = "untyped"
+    # Учитывать значения остановившихся процессов: счётчик не должен уменьшаться
+    keep_dead = True
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict[Tuple, list]] = []
+        self._shards_lock = threading.Lock()
+        registry.register(self)
+
+    def _series(self) -> Dict[Tuple, list]:
+        try:
+            return self._local.series
+        except AttributeError:
+            series: Dict[Tuple, list] = {}
+            with self._shards_lock:
+                self._shards.append(series)
+            self._local.series = series
+            return series
+
+    def _merged(self) -> Dict[Tuple, list]:
+        """Сумма серий по всем потокам"""
+        return self.merge(list(self._shards))
+
+    def snapshot(self) -> Dict[Tuple, list]:
+        """Серии метрики: метки -> значения"""
+        return self._merged()
+
+    def merge(self, snapshots: Sequence[Dict[Tuple, list]]) -> Dict[Tuple, list]:
+        """Сложить серии нескольких потоков или процессов"""
+        merged: Dict[Tuple, list] = {}
+        for snapshot in snapshots:
+            for labels, values in list(snapshot.items()):
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return merged
+
+    def samples(self, series: Dict[Tuple, list]) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        series = self._series()
+        values = series.get(labels)
+        if values is None:
+            series[labels] = [amount]
+        else:
+            values[0] += amount
+
+    def values(self) -> Dict[Tuple, float]:
+        """Текущие значения по наборам меток"""
+        return {labels: values[0] for labels, values in self._merged().items()}
+
+    def samples(self, series: Dict[Tuple, list]) -> Iterable[str]:
+        for labels, values in sorted(series.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {values[0]:g}"
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Registry = REGISTRY
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self._bounds = tuple(f'le="{bound:g}"' for bound in self.buckets) + ('le="+Inf"',)
+
+    def observe(self, value: float, *labels):
+        series = self._series()
+        values = series.get(labels)
+        if values is None:
+            # Счётчики корзин (последняя - +Inf) и сумма наблюдений
+            values = series[labels] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def time(self, *labels) -> "Timer":
+        """Контекстный менеджер, измеряющий длительность блока"""
+        return Timer(self, labels)
+
+    def samples(self, series: Dict[Tuple, list]) -> Iterable[str]:
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self._bounds, values):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, bound)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {values[-1]:g}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge(Metric):
+    """
+    Мгновенное значение
+
+    Значение задаётся через set() или функцией track(), которая
+    вызывается при каждом сборе метрик (размеры очередей). Значения
+    нескольких процессов сводятся функцией aggregate: sum, max или min.
+    """
+
+    kind = "gauge"
+    keep_dead = False
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        aggregate: str = "max",
+        registry: Registry = REGISTRY
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self.aggregate = {"sum": sum, "max": max, "min": min}[aggregate]
+        self._values: Dict[Tuple, float] = {}
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def track(self, fn: Callable[[], float], *labels):
+        """Вычислять значение функцией при сборе метрик"""
+        self._functions[labels] = fn
+
+    def values(self) -> Dict[Tuple, float]:
+        """Текущие значения по меткам (с вычислением track-функций)"""
+        values = dict(self._values)
+        for labels, fn in list(self._functions.items()):
+            try:
+                values[labels] = fn()
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self) -> Dict[Tuple, list]:
+        return {labels: [value] for labels, value in self.values().items()}
+
+    def merge(self, snapshots: Sequence[Dict[Tuple, list]]) -> Dict[Tuple, list]:
+        collected: Dict[Tuple, List[float]] = {}
+        for snapshot in snapshots:
+            for labels, values in snapshot.items():
+                collected.setdefault(labels, []).append(values[0])
+        return {labels: [self.aggregate(values)] for labels, values in collected.items()}
+
+    def samples(self, series: Dict[Tuple, list]) -> Iterable[str]:
+        for labels, values in sorted(series.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {values[0]:g}"
+
+
+class Timer:
+    """Замер длительности блока для гистограммы"""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+# Метрики приложения
+
+BOT_HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds",
+    "Длительность обработки апдейта (handler - префикс callback_data или имя обработчика)",
+    ["update", "handler", "status"]
+)
+BOT_THROTTLED_TOTAL = Counter(
+    "bot_throttled_total",
+    "Апдейты, отклонённые антифлудом",
+    ["update", "tier"]
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Длительность методов Database",
+    ["method"]
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "external_call_seconds",
+    "Длительность обращений к внешним сервисам (панель, ЮKassa, Telegram API)",
+    ["service", "operation", "status"]
+)
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "telegram_request_seconds",
+    "Длительность запросов бота к Telegram Bot API",
+    ["method", "status"]
+)
+TELEGRAM_RETRY_AFTER_TOTAL = Counter(
+    "telegram_retry_after_total",
+    "Ответы 429 (flood control) от Telegram Bot API",
+    ["method"]
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "Опоздание таймеров event loop (время, на которое цикл был занят)"
+)
+QUEUE_DEPTH = Gauge(
+    "queue_depth",
+    "Размер очередей и число фоновых задач",
+    ["queue"],
+    aggregate="sum"
+)
+READINESS_CHECK = Gauge(
+    "readiness_check",
+    "Результат последней проверки зависимости для /ready (1 - в порядке, 0 - нет)",
+    ["check"],
+    aggregate="min"
+)
+RETENTION_ARCHIVED_TOTAL = Counter(
+    "retention_archived_total",
+    "Строки, перенесённые из рабочих таблиц в архив",
+    ["table"]
+)
+BACKUP_DURATION_SECONDS = Gauge(
+    "backup_duration_seconds",
+    "Длительность этапов последней резервной копии базы (copy, verify, compress, total)",
+    ["database", "stage"]
+)
+BACKUP_SIZE_BYTES = Gauge(
+    "backup_size_bytes",
+    "Размер последней резервной копии (database - копия базы, compressed - архив)",
+    ["database", "kind"]
+)
+BACKUP_LAST_SUCCESS = Gauge(
+    "backup_last_success_timestamp_seconds",
+    "Время последней успешной резервной копии (unix time)",
+    ["database"]
+)
+SUBSCRIPTION_FEED_TOTAL = Counter(
+    "subscription_feed_total",
+    "Запросы /sub/{token}: cache - из памяти или собран заново, status - 200, 304 или 404",
+    ["cache", "status"]
+)
+KEY_MIGRATION_TOTAL = Counter(
+    "key_migration_total",
+    "Массовый перевод ключей: migrated, skipped (ключ сменился во время перевода), disabled, notified, failed",
+    ["result"]
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    "startup_phase_seconds",
+    "Время от запуска процесса до этапа старта (imports, settings, db_init, ready, first_update)",
+    ["phase"]
+)
+
+
+def _call_status(result) -> str:
+    # Сервисы сообщают об ошибке через None/False вместо исключения
+    return "error" if result is None or result is False else "ok"
+
+
+def instrument_call(service: str, operation: str = None):
+    """
+    Декоратор: время и результат обращения к внешнему сервису
+
+    Работает с обычными и async функциями. status: ok, error (функция
+    вернула None/False) или exception.
+    """
+    def decorator(fn):
+        name = operation or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                status = "exception"
+                try:
+                    result = await fn(*args, **kwargs)
+                    status = _call_status(result)
+                    return result
+                finally:
+                    EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - started, service, name, status)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = "exception"
+            try:
+                result = fn(*args, **kwargs)
+                status = _call_status(result)
+                return result
+            finally:
+                EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - started, service, name, status)
+        return wrapper
+
+    return decorator
+
+
+def instrument_queries(cls):
+    """
+    Декоратор класса: время каждого публичного async-метода в db_query_seconds
+
+    Асинхронные генераторы не оборачиваются - их время складывается из
+    пауз потребителя.
+    """
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(fn):
+            continue
+        setattr(cls, name, _timed_query(fn, name))
+    return cls
+
+
+def _timed_query(fn, name: str):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
@@ -0,0 +1,111 @@
+"""Метрики всех воркеров API в одном ответе /metrics (API_WORKERS > 1)"""
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from src.monitoring.metrics import REGISTRY, Registry, Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_metrics_dir(directory: str):
+    """Создать каталог снимков и удалить снимки прошлого запуска (вызывает главный процесс)"""
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    for stale in path.glob("*.json"):
+        stale.unlink(missing_ok=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsExchange:
+    """
+    Обмен метриками между воркерами API через общий каталог
+
+    uvicorn отдаёт каждый запрос /metrics одному из воркеров, а метрики
+    у каждого процесса свои, поэтому без обмена Prometheus видел бы
+    значения случайного воркера и принимал их смену за сброс счётчиков.
+    Каждый воркер раз в interval секунд (и при остановке) пишет снимок
+    своих метрик в <directory>/<pid>.json, а /metrics складывает свои
+    текущие значения со снимками остальных: счётчики и гистограммы
+    суммируются, gauge сводятся по правилу метрики. Снимки остановленных
+    воркеров продолжают входить в сумму счётчиков, gauge берутся только
+    у живых процессов. Значения других воркеров отстают не больше чем
+    на interval.
+    """
+
+    def __init__(self, directory: str, interval: float = 5.0, registry: Registry = REGISTRY):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.registry = registry
+        self.pid = os.getpid()
+        self.path = self.directory / f"{self.pid}.json"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запустить периодическую запись снимков"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.flush()
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Остановить запись и сохранить последний снимок"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось записать снимок метрик: {e}")
+
+    def flush(self):
+        """Записать снимок метрик процесса (атомарно, через временный файл)"""
+        metrics = {
+            name: [[list(labels), values] for labels, values in series.items()]
+            for name, series in self.registry.snapshot().items()
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"pid": self.pid, "metrics": metrics}))
+        os.replace(tmp, self.path)
+
+    def render(self) -> str:
+        """Метрики этого воркера вместе со снимками остальных"""
+        return self.registry.render(self._others())
+
+    def _others(self) -> List[Snapshot]:
+        snapshots = []
+        for path in self.directory.glob("*.json"):
+            if path == self.path:
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # Файл удалён или не дописан - возьмём при следующем сборе
+                continue
+            metrics = {
+                name: {tuple(labels): values for labels, values in series}
+                for name, series in data["metrics"].items()
+            }
+            snapshots.append(Snapshot(metrics, _pid_alive(data["pid"])))
+        return snapshots
@@ -0,0 +1,193 @@
+"""Сэмплирующий профилировщик и контроль задержек event loop"""
+import asyncio
+import html
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from src.monitoring.metrics import EVENT_LOOP_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """Профилирование уже запущено"""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+
+
+def collapse_stack(frame) -> str:
+    """Стек в формате collapsed stacks: от корня к листу через ';'"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profile:
+    """Результат профилирования"""
+
+    def __init__(self, stacks: Counter, samples: int, seconds: float, interval: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.seconds = seconds
+        self.interval = interval
+
+    def collapsed(self) -> str:
+        """Текст для flamegraph.pl / speedscope: строка "стек количество" на каждый стек"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Функции, в которых поток находился чаще всего (последний кадр стека)"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+
+class SamplingProfiler:
+    """
+    Статистический профилировщик потока event loop
+
+    Отдельный поток раз в interval снимает стек потока, в котором
+    работает event loop (sys._current_frames), и считает одинаковые
+    стеки. Сам цикл при этом не останавливается и не замедляется
+    заметно; одновременно может идти только одно профилирование.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> Profile:
+        """
+        Профилировать текущий event loop заданное время
+
+        Raises:
+            ProfilerBusy: профилирование уже запущено
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            thread_id = threading.get_ident()
+            return await asyncio.to_thread(self._sample, thread_id, seconds, interval)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(thread_id: int, seconds: float, interval: float) -> Profile:
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[collapse_stack(frame)] += 1
+                samples += 1
+            del frame
+            time.sleep(interval)
+        return Profile(stacks, samples, time.monotonic() - started, interval)
+
+
+# Профилировщик процесса (бот и API вызывают его по команде администратора)
+SAMPLER = SamplingProfiler()
+
+
+class LoopLagMonitor:
+    """
+    Контроль блокировок event loop
+
+    Задача в цикле каждые interval отмечает время и записывает опоздание
+    таймера в event_loop_lag_seconds. Сторожевой поток проверяет отметку:
+    если цикл не отвечает дольше threshold, в лог пишется стек потока
+    цикла - то место, которое его блокирует (синхронный HTTP-клиент,
+    тяжёлый запрос в базу). Об одной блокировке пишется один раз.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._beat = 0.0
+        self._thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Запустить контроль (вызывать из работающего event loop)"""
+        if self._task is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        """Остановить контроль"""
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._watchdog.join, 1.0)
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self._beat = now
+
+    def _watch(self):
+        reported_at: Optional[float] = None
+        while not self._stop.wait(min(self.interval, self.threshold / 2)):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled < self.threshold:
+                if reported_at is not None:
+                    logger.warning(f"Event loop снова отвечает после блокировки на {self._beat - reported_at:.2f} с")
+                    reported_at = None
+                continue
+            if reported_at is not None:
+                continue
+
+            reported_at = self._beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(стек недоступен)"
+            del frame
+            logger.warning(f"Event loop заблокирован дольше {stalled:.2f} с, стек:\n{stack}")
+
+
+def format_profile(profile: Profile, limit: int = 10) -> str:
+    """Краткий итог профилирования для админа"""
+    lines = [
+        f"🔥 <b>Профиль event loop</b>: {profile.seconds:.1f} с, "
+        f"{profile.samples} сэмплов (шаг {profile.interval * 1000:g} мс)\n",
+        "<b>Где проходит время:</b>",
+    ]
+    for name, count in profile.top_functions(limit):
+        share = count / profile.samples * 100 if profile.samples else 0
+        lines.append(f"{share:5.1f}%  <code>{html.escape(name)}</code>")
+    lines.append("\nПолные стеки - в файле (collapsed stacks для flamegraph.pl или speedscope)")
+    return "\n".join(lines)
@@ -0,0 +1,35 @@
+"""HTTP-сервер метрик для процесса бота"""
+import hmac
+import logging
+
+from aiohttp import web
+
+from src.config.settings import settings
+from src.monitoring.metrics import REGISTRY, CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    if settings.metrics_token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""),
+        f"Bearer {settings.metrics_token}"
+    ):
+        raise web.HTTPUnauthorized()
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Запустить /metrics на отдельном порту
+
+    Нужен, когда бот работает в отдельном процессе от API (polling при
+    RUN_MODE=multiprocess). aiohttp уже есть в зависимостях aiogram.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики бота доступны на http://{host}:{port}/metrics")
+    return runner
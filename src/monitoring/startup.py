@@ -0,0 +1,136 @@
+"""Хронология запуска процесса и стоимость импортов модулей"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from src.monitoring.metrics import STARTUP_PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Этапы запуска по порядку; после последнего в лог пишется итог
+PHASES = ("settings", "imports", "db_init", "ready", "first_update")
+
+
+class StartupTimeline:
+    """
+    Время от запуска процесса до этапов старта
+
+    Отсчёт идёт от импорта этого модуля (первым импортом в main.py и
+    src/api/app.py). Каждый этап отмечается один раз: повторные mark()
+    ничего не делают, поэтому отметку можно ставить на горячем пути
+    (первый обработанный апдейт). Значения попадают в лог и в метрику
+    startup_phase_seconds.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        """Отметить этап (только первый раз)"""
+        if phase in self.marks:
+            return
+        elapsed = time.perf_counter() - self.started
+        self.marks[phase] = elapsed
+        STARTUP_PHASE_SECONDS.set(elapsed, phase)
+        logger.info(f"Запуск: {phase} через {elapsed:.2f} с")
+        if phase == PHASES[-1]:
+            logger.info(f"Хронология запуска: {self.summary()}")
+
+    def summary(self) -> str:
+        """'settings 0.05 с -> imports 1.90 с -> ...' в порядке этапов"""
+        return " -> ".join(f"{phase} {self.marks[phase]:.2f} с" for phase in PHASES if phase in self.marks)
+
+
+# Хронология запуска процесса
+TIMELINE = StartupTimeline()
+
+
+class ImportCost:
+    """Строка отчёта python -X importtime"""
+
+    __slots__ = ("module", "self_us", "cumulative_us", "depth")
+
+    def __init__(self, module: str, self_us: int, cumulative_us: int, depth: int):
+        self.module = module
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+    @property
+    def package(self) -> str:
+        return self.module.split(".", 1)[0]
+
+
+def parse_importtime(output: str) -> List[ImportCost]:
+    """Разобрать stderr python -X importtime"""
+    costs = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        costs.append(ImportCost(name.strip(), int(self_us), int(cumulative_us), depth))
+    return costs
+
+
+def measure_imports(module: str) -> Tuple[float, List[ImportCost]]:
+    """
+    Импортировать модуль в отдельном интерпретаторе с -X importtime
+
+    Returns:
+        (время импорта модуля в секундах, стоимость каждого модуля)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    costs = parse_importtime(result.stderr)
+    total = next((c.cumulative_us for c in reversed(costs) if c.module == module and c.depth <= 1), 0)
+    return total / 1e6, costs
+
+
+def format_import_report(name: str, module: str, total: float, costs: List[ImportCost], limit: int = 15) -> str:
+    """Итог по пакетам верхнего уровня и самые дорогие модули"""
+    packages: Dict[str, int] = defaultdict(int)
+    for cost in costs:
+        packages[cost.package] += cost.self_us
+
+    lines = [f"{name}: import {module} - {total:.2f} с", "  пакеты (собственное время модулей):"]
+    for package, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        lines.append(f"    {package:<40}{us / 1000:>10.1f} мс")
+    lines.append("  модули (собственное время / с зависимостями):")
+    for cost in sorted(costs, key=lambda c: c.self_us, reverse=True)[:limit]:
+        lines.append(f"    {cost.module:<40}{cost.self_us / 1000:>10.1f} мс{cost.cumulative_us / 1000:>10.1f} мс")
+    return "\n".join(lines)
+
+
+def report_startup(targets: Dict[str, str], limit: int = 15, json_path: Optional[str] = None) -> str:
+    """Отчёт о стоимости импорта для точек входа {название: модуль}"""
+    sections = []
+    data = {}
+    for name, module in targets.items():
+        total, costs = measure_imports(module)
+        sections.append(format_import_report(name, module, total, costs, limit))
+        data[name] = {
+            "module": module,
+            "seconds": total,
+            "modules": [
+                {"module": c.module, "self_us": c.self_us, "cumulative_us": c.cumulative_us}
+                for c in costs
+            ],
+        }
+    if json_path:
+        import json
+
+        with open(json_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return "\n\n".join(sections)
@@ -0,0 +1,193 @@
+"""Трассировка цепочки "оплата -> VPN-ключ" """
+import html
+import logging
+import math
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Корневой span обработки webhook и итоговое время от оплаты до отправки ключа
+SPAN_WEBHOOK = "webhook"
+SPAN_PAYMENT_TO_KEY = "payment_to_key"
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+
+class Span:
+    """Шаг обработки: время начала (unix), длительность (сек.) и результат"""
+
+    __slots__ = ("name", "started_at", "duration", "status", "detail")
+
+    def __init__(self, name: str, started_at: float, duration: float = 0.0):
+        self.name = name
+        self.started_at = started_at
+        self.duration = duration
+        self.status = STATUS_OK
+        self.detail: Optional[str] = None
+
+    def fail(self, detail: str):
+        """Отметить шаг как неуспешный"""
+        self.status = STATUS_ERROR
+        self.detail = detail[:200]
+
+    def as_row(self) -> Tuple[str, float, float, str, Optional[str]]:
+        return self.name, self.started_at, self.duration * 1000, self.status, self.detail
+
+
+class Trace:
+    """Шаги обработки одного платежа (trace_id - ID платежа в ЮKassa)"""
+
+    def __init__(self, trace_id: Optional[str]):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Трасса текущей задачи (None вне trace())"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Замерить шаг текущей трассы
+
+    Вне trace() ничего не записывает. Исключение отмечает шаг как
+    неуспешный и пробрасывается дальше.
+    """
+    trace = _current_trace.get()
+    current = Span(name, time.time())
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        if trace is not None:
+            trace.spans.append(current)
+
+
+@asynccontextmanager
+async def trace(db, trace_id: Optional[str], root: str = SPAN_WEBHOOK):
+    """
+    Трасса обработки платежа
+
+    Шаги копятся в памяти и записываются в таблицу trace_spans одной
+    пачкой после выхода из блока. Если ID платежа ещё неизвестен
+    (платёж создаётся внутри блока), передайте None и задайте
+    trace_id у возвращённой трассы; трасса без ID не сохраняется.
+    Ошибка записи трассы не влияет на обработку платежа.
+    """
+    current = Trace(trace_id)
+    token = _current_trace.set(current)
+    try:
+        with span(root):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        # Корневой span записан последним, показываем его первым
+        current.spans.insert(0, current.spans.pop())
+        if current.trace_id:
+            try:
+                await db.save_trace_spans(current.trace_id, [s.as_row() for s in current.spans])
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить трассу {current.trace_id}: {e}")
+
+
+def record_since(name: str, started_at: float, detail: Optional[str] = None):
+    """Добавить в текущую трассу шаг, начавшийся вне процесса (время в unix)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    recorded = Span(name, started_at, max(0.0, time.time() - started_at))
+    recorded.detail = detail
+    trace.spans.append(recorded)
+
+
+def parse_yookassa_time(value: Optional[str]) -> Optional[float]:
+    """Время из объекта платежа ЮKassa (2024-01-01T10:00:00.123Z) в unix"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга: наименьшее значение, не меньше которого q доли выборки"""
+    # round убирает погрешность float (0.07 * 100 = 7.000000000000001)
+    rank = math.ceil(round(q * len(sorted_values), 9))
+    index = max(0, min(len(sorted_values) - 1, rank - 1))
+    return sorted_values[index]
+
+
+def summarize(durations: Iterable[Tuple[str, float]]) -> Dict[str, Tuple[int, float, float, float]]:
+    """
+    Перцентили длительности по шагам
+
+    Args:
+        durations: пары (шаг, длительность в мс)
+
+    Returns:
+        {шаг: (количество, p50, p95, p99)}
+    """
+    by_stage: Dict[str, List[float]] = {}
+    for name, duration_ms in durations:
+        by_stage.setdefault(name, []).append(duration_ms)
+
+    summary = {}
+    for name, values in by_stage.items():
+        values.sort()
+        summary[name] = (len(values), percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99))
+    return summary
+
+
+def _format_ms(value: float) -> str:
+    return f"{value / 1000:.1f} с" if value >= 1000 else f"{value:.0f} мс"
+
+
+def format_trace(trace_id: str, spans: List[dict]) -> str:
+    """Текст трассы платежа для админа"""
+    if not spans:
+        return f"🔍 Трасса <code>{html.escape(trace_id)}</code> не найдена"
+
+    started = min(s["started_at"] for s in spans)
+    lines = [f"🔍 <b>Платёж</b> <code>{html.escape(trace_id)}</code>\n"]
+    for s in spans:
+        mark = "✅" if s["status"] == STATUS_OK else "❌"
+        offset = s["started_at"] - started
+        line = f"{mark} +{offset:.1f} с  <b>{s['name']}</b>: {_format_ms(s['duration_ms'])}"
+        if s["detail"]:
+            line += f"\n      <i>{html.escape(s['detail'])}</i>"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def format_summary(summary: Dict[str, Tuple[int, float, float, float]], days: int) -> str:
+    """Текст сводки по шагам для админа"""
+    if not summary:
+        return f"📈 За {days} дн. трасс платежей нет"
+
+    lines = [f"📈 <b>Оплата → ключ за {days} дн.</b>\n<code>шаг: n | p50 / p95 / p99</code>\n"]
+    # Итоговые показатели сверху, затем шаги по убыванию p95
+    order = sorted(
+        summary,
+        key=lambda name: (name not in (SPAN_PAYMENT_TO_KEY, SPAN_WEBHOOK), -summary[name][2])
+    )
+    for name in order:
+        count, p50, p95, p99 = summary[name]
+        lines.append(
+            f"<b>{name}</b>: {count} | {_format_ms(p50)} / {_format_ms(p95)} / {_format_ms(p99)}"
+        )
+    return "\n".join(lines)
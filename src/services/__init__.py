@@ -1,10 +1,24 @@
 """Services package"""
-from src.services.hiddify_service import HiddifyService
-from src.services.payment_service import PaymentService
-from src.services.notification_service import NotificationService
+import importlib
+
+# Сервисы импортируются при первом обращении: иначе любой импорт из
+# src.services (контейнер, lease) тянул бы aiogram и SDK ЮKassa в процесс API
+_EXPORTS = {
+    "HiddifyService": "src.services.hiddify_service",
+    "PaymentService": "src.services.payment_service",
+    "NotificationService": "src.services.notification_service",
+    "BroadcastService": "src.services.broadcast_service",
+}
 
 __all__ = [
     "HiddifyService",
     "PaymentService",
-    "NotificationService"
+    "NotificationService",
+    "BroadcastService"
 ]
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
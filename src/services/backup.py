@@ -0,0 +1,215 @@
+"""Резервное копирование базы SQLite без остановки бота и API"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.monitoring.metrics import BACKUP_DURATION_SECONDS, BACKUP_LAST_SUCCESS, BACKUP_SIZE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз копирование по шагам может начаться заново из-за записи
+# другим соединением, прежде чем база будет скопирована за один шаг
+MAX_RESTARTS = 3
+
+# Уровень gzip: на страницах SQLite 1 сжимает почти как 6, но в 3 раза быстрее
+COMPRESS_LEVEL = 1
+
+
+class BackupError(Exception):
+    """Резервная копия не прошла проверку целостности"""
+
+
+class _Restarted(Exception):
+    """Копирование по шагам слишком часто начиналось заново"""
+
+
+class BackupService:
+    """
+    Сжатые резервные копии базы с ротацией
+
+    Копия снимается online backup API SQLite: по step_pages страниц за
+    шаг с паузой step_sleep между шагами, блокировка чтения держится
+    только на время шага, и бот с API продолжают писать. Запись другим
+    соединением (другой процесс) заставляет SQLite начать копирование
+    заново; после MAX_RESTARTS перезапусков база копируется за один шаг -
+    в режиме WAL это одна читающая транзакция, писателей она не блокирует.
+
+    Копия проверяется PRAGMA integrity_check (на копии, а не на рабочей
+    базе), сжимается gzip и атомарно переименовывается, хранятся keep
+    последних архивов. Работа идёт в отдельном потоке.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        backup_dir: str,
+        keep: int = 7,
+        step_pages: int = 256,
+        step_sleep: float = 0.02
+    ):
+        self.db_path = db_path
+        self.backup_dir = Path(backup_dir)
+        self.keep = keep
+        self.step_pages = step_pages
+        self.step_sleep = step_sleep
+        self.prefix = Path(db_path).stem
+
+    def list_backups(self) -> List[Path]:
+        """Архивы копий, от старых к новым"""
+        if not self.backup_dir.exists():
+            return []
+        # Время в имени файла сортируется как строка
+        return sorted(self.backup_dir.glob(f"{self.prefix}-*.db.gz"))
+
+    def last_backup_at(self) -> Optional[float]:
+        """Время создания последнего архива (unix time) или None"""
+        backups = self.list_backups()
+        return backups[-1].stat().st_mtime if backups else None
+
+    async def run(self, interval: Optional[float] = None) -> Optional[Dict]:
+        """
+        Снять копию в отдельном потоке
+
+        Args:
+            interval: Пропустить, если последний архив моложе interval секунд
+                (перезапуски не создают лишних копий)
+
+        Returns:
+            Отчёт backup() или None, если копия не нужна
+        """
+        if interval is not None:
+            last = self.last_backup_at()
+            if last is not None and time.time() - last < interval:
+                return None
+        return await asyncio.to_thread(self.backup)
+
+    def backup(self) -> Dict:
+        """
+        Снять, проверить, сжать копию и удалить лишние старые
+
+        Returns:
+            Путь к архиву, длительности этапов, размеры и число перезапусков
+        """
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{self.prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+        archive = self.backup_dir / f"{name}.gz"
+        copy_path = self.backup_dir / f".{name}.part"
+        archive_part = self.backup_dir / f".{name}.gz.part"
+
+        started = time.perf_counter()
+        try:
+            copied = self._copy(copy_path)
+            copy_done = time.perf_counter()
+            self._verify(copy_path)
+            verify_done = time.perf_counter()
+            self._compress(copy_path, archive_part, name)
+            os.replace(archive_part, archive)
+            compress_done = time.perf_counter()
+            database_bytes = copy_path.stat().st_size
+        finally:
+            for leftover in (copy_path, archive_part):
+                leftover.unlink(missing_ok=True)
+        removed = self.rotate()
+
+        report = {
+            "path": str(archive),
+            "pages": copied["pages"],
+            "restarts": copied["restarts"],
+            "database_bytes": database_bytes,
+            "compressed_bytes": archive.stat().st_size,
+            "seconds": {
+                "copy": copy_done - started,
+                "verify": verify_done - copy_done,
+                "compress": compress_done - verify_done,
+                "total": compress_done - started,
+            },
+            "removed": [path.name for path in removed],
+        }
+        for stage, seconds in report["seconds"].items():
+            BACKUP_DURATION_SECONDS.set(seconds, self.prefix, stage)
+        BACKUP_SIZE_BYTES.set(report["database_bytes"], self.prefix, "database")
+        BACKUP_SIZE_BYTES.set(report["compressed_bytes"], self.prefix, "compressed")
+        BACKUP_LAST_SUCCESS.set(time.time(), self.prefix)
+        logger.info(
+            f"Резервная копия {archive.name}: {report['database_bytes'] / 2**20:.1f} МБ -> "
+            f"{report['compressed_bytes'] / 2**20:.1f} МБ за {report['seconds']['total']:.2f} с "
+            f"(копирование {report['seconds']['copy']:.2f} с, перезапусков {report['restarts']}), "
+            f"удалено старых: {len(removed)}"
+        )
+        return report
+
+    def _copy(self, target_path: Path) -> Dict[str, int]:
+        """Скопировать базу online backup API"""
+        state = {"remaining": None, "pages": 0, "restarts": 0}
+
+        def progress(status: int, remaining: int, total: int):
+            # Остаток вырос - другое соединение изменило базу, SQLite начал заново
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > MAX_RESTARTS:
+                    raise _Restarted()
+            state["remaining"] = remaining
+            state["pages"] = total
+            # sleep в backup() срабатывает только на SQLITE_BUSY, паузу между шагами делаем сами
+            if remaining and self.step_sleep:
+                time.sleep(self.step_sleep)
+
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=self.step_pages, progress=progress, sleep=self.step_sleep)
+            except _Restarted:
+                logger.warning(
+                    f"База меняется быстрее, чем копируется по {self.step_pages} страниц, "
+                    f"копируем за один шаг"
+                )
+                source.backup(target)
+                state["pages"] = target.execute("PRAGMA page_count").fetchone()[0]
+            # Архив восстанавливается одним файлом, без -wal
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+        return state
+
+    @staticmethod
+    def _verify(path: Path):
+        """PRAGMA integrity_check копии"""
+        conn = sqlite3.connect(path)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+        if problems != ["ok"]:
+            raise BackupError(f"Копия {path.name} повреждена: {'; '.join(problems[:5])}")
+
+    @staticmethod
+    def _compress(source: Path, target: Path, name: str):
+        with open(source, "rb") as src, open(target, "wb") as raw:
+            with gzip.GzipFile(filename=name, mode="wb", fileobj=raw, compresslevel=COMPRESS_LEVEL) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+
+    def rotate(self) -> List[Path]:
+        """Удалить архивы сверх keep последних"""
+        backups = self.list_backups()
+        removed = backups[:-self.keep] if len(backups) > self.keep else []
+        for path in removed:
+            path.unlink(missing_ok=True)
+        return removed
+
+    def verify_archive(self, archive: Path):
+        """Распаковать архив во временный файл и проверить целостность"""
+        with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp:
+            path = Path(tmp) / "restore-check.db"
+            with gzip.open(archive, "rb") as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            self._verify(path)
@@ -0,0 +1,313 @@
+"""Сервис массовых рассылок"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from src.database.models import Database
+from src.monitoring.metrics import QUEUE_DEPTH
+from src.services.lease import Lease
+from src.services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Статусы задания рассылки
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_PAUSED = "paused"
+STATUS_CANCELLED = "cancelled"
+STATUS_COMPLETED = "completed"
+
+# Сегменты аудитории (см. BROADCAST_SEGMENTS в src/database/models.py)
+SEGMENT_TITLES = {
+    "all": "👥 Все пользователи",
+    "active": "✅ Активные подписчики",
+    "expired": "⌛️ Подписка истекла недавно",
+    "never_paid": "💤 Ни разу не платили",
+    "trial_only": "🎁 Только пробный период",
+    "antiblock": "🛡️ Антиглушилка",
+}
+
+# Результаты отправки одному получателю
+RESULT_SENT = "sent"
+RESULT_FAILED = "failed"
+RESULT_BLOCKED = "blocked"
+
+
+class BroadcastService:
+    """
+    Фоновые рассылки с контрольными точками в SQLite
+
+    Получатели читаются пачками по возрастанию users.id, внутри пачки
+    сообщения отправляются параллельно под общим token bucket. После
+    каждой пачки прогресс сохраняется, поэтому рассылку можно
+    приостановить, отменить или продолжить после перезапуска.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        rate_limit: float = 28.0,
+        concurrency: int = 20,
+        batch_size: int = 200,
+        max_retries: int = 3
+    ):
+        self.db = db
+        self.bucket = TokenBucket(rate=rate_limit, capacity=rate_limit)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._tasks: Dict[int, asyncio.Task] = {}
+        QUEUE_DEPTH.track(lambda: len(self._tasks), "broadcast_jobs")
+
+    def configure(self, rate_limit: float, concurrency: int, batch_size: int):
+        """Применить новые лимиты (после перезагрузки настроек), идущие рассылки подхватят их со следующей пачки"""
+        self.bucket.configure(rate=rate_limit, capacity=rate_limit)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    async def create(
+        self,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup],
+        created_by: int,
+        segment: str = "all",
+        segment_days: Optional[int] = None
+    ) -> int:
+        """
+        Создать задание рассылки
+
+        Args:
+            text: Текст сообщения (HTML)
+            reply_markup: Клавиатура под сообщением
+            created_by: Telegram ID администратора
+            segment: Сегмент аудитории
+            segment_days: Глубина в днях для сегмента expired
+
+        Returns:
+            ID задания
+        """
+        total = await self.db.count_broadcast_recipients(segment, segment_days)
+        markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        broadcast_id = await self.db.create_broadcast(
+            text, markup_json, created_by, total, segment, segment_days
+        )
+        logger.info(f"Создана рассылка #{broadcast_id} ({segment}) на {total} получателей")
+        return broadcast_id
+
+    async def get(self, broadcast_id: int) -> Optional[dict]:
+        """Получить задание рассылки"""
+        return await self.db.get_broadcast(broadcast_id)
+
+    def is_running(self, broadcast_id: int) -> bool:
+        """Выполняется ли рассылка в этом процессе"""
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+    async def start(self, broadcast_id: int, bot: Bot) -> bool:
+        """
+        Запустить (или продолжить) рассылку в фоне
+
+        Рассылку выполняет только процесс, захвативший её аренду. Если она
+        уже идёт в другом процессе (воркере API), достаточно вернуть ей
+        статус running - владелец увидит его на ближайшей контрольной точке.
+
+        Returns:
+            True если рассылка выполняется
+        """
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast["status"] in (STATUS_CANCELLED, STATUS_COMPLETED):
+            return False
+
+        await self.db.set_broadcast_status(broadcast_id, STATUS_RUNNING)
+        if self.is_running(broadcast_id):
+            return True
+
+        lease = self._lease(broadcast_id)
+        if not await lease.acquire():
+            logger.info(f"Рассылка #{broadcast_id} выполняется другим процессом")
+            return True
+
+        task = asyncio.create_task(self._run(broadcast_id, bot, lease))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+        return True
+
+    def _lease(self, broadcast_id: int) -> Lease:
+        # Аренда продлевается на каждой контрольной точке, ttl с запасом на долгую пачку
+        return Lease(self.db, f"broadcast:{broadcast_id}", ttl=max(60.0, self.batch_size * 2 / self.bucket.rate))
+
+    async def pause(self, broadcast_id: int):
+        """Приостановить рассылку (после текущей пачки)"""
+        await self._stop(broadcast_id, STATUS_PAUSED)
+
+    async def cancel(self, broadcast_id: int):
+        """Отменить рассылку (после текущей пачки)"""
+        await self._stop(broadcast_id, STATUS_CANCELLED)
+
+    async def _stop(self, broadcast_id: int, status: str):
+        # Статус в БД видит процесс-исполнитель на ближайшей контрольной точке
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast["status"] in (STATUS_CANCELLED, STATUS_COMPLETED):
+            return
+        await self.db.set_broadcast_status(broadcast_id, status)
+
+    async def shutdown(self):
+        """
+        Остановить выполняющиеся рассылки при остановке процесса
+
+        Статус остаётся running, после перезапуска рассылки продолжатся.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def resume_interrupted(self, bot: Bot):
+        """Продолжить рассылки, прерванные перезапуском или падением процесса"""
+        for broadcast in await self.db.get_broadcasts_by_status(STATUS_RUNNING):
+            logger.info(f"Возобновление рассылки #{broadcast['id']} с users.id > {broadcast['last_user_id']}")
+            await self.start(broadcast["id"], bot)
+
+    async def _run(self, broadcast_id: int, bot: Bot, lease: Lease):
+        """Основной цикл рассылки"""
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        text = broadcast["text"]
+        reply_markup = None
+        if broadcast["reply_markup"]:
+            reply_markup = InlineKeyboardMarkup.model_validate_json(broadcast["reply_markup"])
+
+        final_status = STATUS_COMPLETED
+        try:
+            recipients = self.db.iter_broadcast_recipients(
+                broadcast["last_user_id"],
+                self.batch_size,
+                segment=broadcast["segment"] or "all",
+                days=broadcast["segment_days"]
+            )
+            async for batch in recipients:
+                # Пауза или отмена могли прийти из другого процесса
+                current = await self.db.get_broadcast(broadcast_id)
+                if current["status"] != STATUS_RUNNING:
+                    final_status = current["status"]
+                    break
+
+                if not await lease.acquire():
+                    logger.warning(f"Аренда рассылки #{broadcast_id} перехвачена другим процессом")
+                    return
+
+                results = await self.send_batch(bot, [(telegram_id, text) for _, telegram_id in batch], reply_markup)
+
+                blocked = [telegram_id for telegram_id, result in results if result == RESULT_BLOCKED]
+                sent = sum(1 for _, result in results if result == RESULT_SENT)
+                failed = len(results) - sent - len(blocked)
+
+                await self.db.mark_users_blocked(blocked)
+                await self.db.save_broadcast_progress(broadcast_id, batch[-1][0], sent, failed, len(blocked))
+        except asyncio.CancelledError:
+            # Процесс останавливается: статус остаётся running, рассылка продолжится после рестарта
+            logger.info(f"Рассылка #{broadcast_id} прервана остановкой процесса")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки #{broadcast_id}: {e}", exc_info=True)
+            final_status = STATUS_PAUSED
+        finally:
+            await lease.release()
+
+        if not await self.db.set_broadcast_status(broadcast_id, final_status, expected=STATUS_RUNNING):
+            # Пауза или отмена пришли после последней пачки
+            final_status = (await self.db.get_broadcast(broadcast_id))["status"]
+        logger.info(f"Рассылка #{broadcast_id} завершена со статусом {final_status}")
+
+        if final_status == STATUS_COMPLETED:
+            await self._report(broadcast_id, bot)
+
+    async def send_batch(
+        self,
+        bot: Bot,
+        messages: List[Tuple[int, str]],
+        reply_markup: Optional[InlineKeyboardMarkup] = None
+    ) -> List[Tuple[int, str]]:
+        """
+        Отправить пачку сообщений с ограничением параллельности
+
+        Общий token bucket процесса: массовые уведомления других сервисов
+        (перевод ключей) делят лимит Telegram с рассылками.
+
+        Args:
+            messages: (telegram_id, текст) для каждого получателя
+
+        Returns:
+            (telegram_id, RESULT_SENT / RESULT_FAILED / RESULT_BLOCKED)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(telegram_id: int, text: str) -> Tuple[int, str]:
+            async with semaphore:
+                return telegram_id, await self._send_one(bot, telegram_id, text, reply_markup)
+
+        return await asyncio.gather(*(send(telegram_id, text) for telegram_id, text in messages))
+
+    async def _send_one(
+        self,
+        bot: Bot,
+        telegram_id: int,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup]
+    ) -> str:
+        """Отправить сообщение одному получателю с повтором после 429"""
+        for _ in range(self.max_retries):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(
+                    chat_id=telegram_id,
+                    text=text,
+                    parse_mode="HTML",
+                    reply_markup=reply_markup
+                )
+                return RESULT_SENT
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать - тормозим всю рассылку, а не только этот запрос
+                logger.warning(f"Rate limit Telegram, пауза {e.retry_after} сек.")
+                self.bucket.penalize(e.retry_after)
+            except TelegramForbiddenError:
+                return RESULT_BLOCKED
+            except Exception as e:
+                logger.error(f"Ошибка отправки пользователю {telegram_id}: {e}")
+                return RESULT_FAILED
+        return RESULT_FAILED
+
+    async def _report(self, broadcast_id: int, bot: Bot):
+        """Отправить итог рассылки создавшему её администратору"""
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if not broadcast or not broadcast["created_by"]:
+            return
+        try:
+            await bot.send_message(broadcast["created_by"], format_broadcast_status(broadcast))
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчёт о рассылке #{broadcast_id}: {e}")
+
+
+def format_broadcast_status(broadcast: dict) -> str:
+    """Текст с прогрессом рассылки для админ-панели"""
+    status_names = {
+        STATUS_PENDING: "⏳ Ожидает запуска",
+        STATUS_RUNNING: "📤 Выполняется",
+        STATUS_PAUSED: "⏸ Приостановлена",
+        STATUS_CANCELLED: "🚫 Отменена",
+        STATUS_COMPLETED: "✅ Завершена",
+    }
+    processed = broadcast["sent_count"] + broadcast["failed_count"] + broadcast["blocked_count"]
+    return (
+        f"📢 <b>Рассылка #{broadcast['id']}</b>\n\n"
+        f"Статус: {status_names.get(broadcast['status'], broadcast['status'])}\n"
+        f"🎯 Аудитория: {SEGMENT_TITLES.get(broadcast['segment'], broadcast['segment'])}\n"
+        f"👥 Обработано: {processed} из {broadcast['total']}\n"
+        f"📤 Отправлено: {broadcast['sent_count']}\n"
+        f"🚫 Заблокировали бота: {broadcast['blocked_count']}\n"
+        f"❌ Ошибок: {broadcast['failed_count']}"
+    )
@@ -0,0 +1,312 @@
+"""Контейнер сервисов приложения с управлением жизненным циклом"""
+import asyncio
+import logging
+import time
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from src.config.settings import Settings, on_settings_reload, settings
+from src.database.models import Database
+from src.monitoring.metrics import QUEUE_DEPTH, RETENTION_ARCHIVED_TOTAL
+from src.monitoring.profiler import LoopLagMonitor
+from src.monitoring.startup import TIMELINE
+from src.services.backup import BackupService
+from src.services.lease import LeasedJob
+from src.services.readiness import (
+    YOOKASSA_PROBE_INTERVAL,
+    ReadinessMonitor,
+    database_probe,
+    panel_probe,
+    queues_probe,
+    yookassa_probe
+)
+from src.services.singleflight import ProvisioningGuard
+from src.services.subscription_feed import SubscriptionFeed
+
+if TYPE_CHECKING:
+    from src.services.hiddify_service import HiddifyService
+    from src.services.payment_service import PaymentService
+    from src.services.notification_service import NotificationService
+    from src.services.broadcast_service import BroadcastService
+    from src.services.key_migration import KeyMigrationService
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    Контейнер сервисов уровня приложения
+
+    Сервисы создаются лениво при первом обращении, их модули
+    импортируются там же: процесс API не загружает aiogram (рассылки) и
+    SDK ЮKassa, пока они ему не понадобятся. Пулы соединений
+    открываются и кэши прогреваются в startup() (FastAPI lifespan и
+    startup-хук aiogram), закрываются в shutdown(). При запуске бота и
+    API в одном процессе (RUN_MODE=single) оба вызывают startup/shutdown,
+    реальная работа выполняется первым startup и последним shutdown.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self._users = 0
+        self._lock = asyncio.Lock()
+        self._jobs: List[LeasedJob] = []
+        self._loop_monitor: Optional[LoopLagMonitor] = None
+
+    @cached_property
+    def db(self) -> Database:
+        return Database(self.config.database_path, slow_query_ms=self.config.db_slow_query_ms)
+
+    @cached_property
+    def hiddify_service(self) -> "HiddifyService":
+        from src.services.hiddify_service import HiddifyService
+
+        return HiddifyService(
+            self.config.hiddify_api_url,
+            self.config.hiddify_api_token,
+            self.config.server_host,
+            self.config.vpn_data_limit_gb
+        )
+
+    @cached_property
+    def payment_service(self) -> "PaymentService":
+        from src.services.payment_service import PaymentService
+
+        return PaymentService(
+            self.config.yookassa_shop_id,
+            self.config.yookassa_secret_key,
+            self.config.yookassa_api_url
+        )
+
+    @cached_property
+    def notification_service(self) -> "NotificationService":
+        from src.services.notification_service import NotificationService
+
+        return NotificationService(self.config.telegram_bot_token, self.config.telegram_api_url)
+
+    @cached_property
+    def broadcast_service(self) -> "BroadcastService":
+        from src.services.broadcast_service import BroadcastService
+
+        service = BroadcastService(
+            self.db,
+            rate_limit=self.config.broadcast_rate_limit,
+            concurrency=self.config.broadcast_concurrency,
+            batch_size=self.config.broadcast_batch_size
+        )
+        on_settings_reload(lambda config: service.configure(
+            config.broadcast_rate_limit,
+            config.broadcast_concurrency,
+            config.broadcast_batch_size
+        ))
+        return service
+
+    @cached_property
+    def key_migration_service(self) -> "KeyMigrationService":
+        from src.services.key_migration import KeyMigrationService
+
+        # Уведомления идут через token bucket рассылок: лимит Telegram у них общий
+        service = KeyMigrationService(
+            self.db,
+            self.hiddify_service,
+            self.broadcast_service,
+            batch_size=self.config.key_migration_batch_size,
+            concurrency=self.config.key_migration_concurrency
+        )
+
+        def apply_limits(config: Settings):
+            service.batch_size = config.key_migration_batch_size
+            service.concurrency = config.key_migration_concurrency
+
+        on_settings_reload(apply_limits)
+        return service
+
+    @cached_property
+    def backup_service(self) -> BackupService:
+        return BackupService(
+            self.config.database_path,
+            self.config.backup_dir,
+            keep=self.config.backup_keep,
+            step_pages=self.config.backup_step_pages,
+            step_sleep=self.config.backup_step_sleep_ms / 1000
+        )
+
+    @cached_property
+    def archive_backup_service(self) -> Optional[BackupService]:
+        """Копии отдельной базы архива (None, если архив в основной базе)"""
+        if not self.config.archive_database_path:
+            return None
+        return BackupService(
+            self.config.archive_database_path,
+            self.config.backup_dir,
+            keep=self.config.backup_keep,
+            step_pages=self.config.backup_step_pages,
+            step_sleep=self.config.backup_step_sleep_ms / 1000
+        )
+
+    @cached_property
+    def subscription_feed(self) -> SubscriptionFeed:
+        return SubscriptionFeed(
+            self.db,
+            self.hiddify_service,
+            self.config.server_host,
+            data_limit_gb=self.config.vpn_data_limit_gb,
+            update_hours=self.config.subscription_update_hours,
+            cache_ttl=self.config.subscription_cache_ttl,
+            cache_size=self.config.subscription_cache_size
+        )
+
+    @cached_property
+    def provisioning_guard(self) -> ProvisioningGuard:
+        return ProvisioningGuard(self.db)
+
+    @cached_property
+    def readiness(self) -> ReadinessMonitor:
+        monitor = ReadinessMonitor(self.config.ready_probe_interval, self.config.ready_probe_timeout)
+        # Блокировку базы ждём меньше общего таймаута, чтобы получить "database is locked", а не таймаут
+        monitor.add_check("database", database_probe(self.db, self.config.ready_probe_timeout / 2))
+        monitor.add_check("panel", panel_probe(self.hiddify_service))
+        monitor.add_check("queues", queues_probe(self.config.ready_max_queue_depth))
+        monitor.add_check(
+            "yookassa",
+            yookassa_probe(self.payment_service),
+            critical=False,
+            interval=max(self.config.ready_probe_interval, YOOKASSA_PROBE_INTERVAL)
+        )
+        return monitor
+
+    def handler_dependencies(self) -> Dict[str, Any]:
+        """Сервисы, которые aiogram передаёт в обработчики по имени аргумента"""
+        return {
+            "db": self.db,
+            "hiddify_service": self.hiddify_service,
+            "payment_service": self.payment_service,
+            "notification_service": self.notification_service,
+            "broadcast_service": self.broadcast_service,
+            "key_migration_service": self.key_migration_service,
+            "provisioning_guard": self.provisioning_guard,
+        }
+
+    def add_job(self, job: LeasedJob):
+        """
+        Зарегистрировать фоновую задачу
+
+        Задача запускается сразу и останавливается в shutdown(). При
+        нескольких процессах её выполняет только владелец аренды.
+        """
+        self._jobs.append(job)
+        job.start()
+
+    async def startup(self):
+        """Открыть пулы соединений и прогреть кэши"""
+        async with self._lock:
+            self._users += 1
+            if self._users > 1:
+                return
+
+            QUEUE_DEPTH.track(lambda: len(asyncio.all_tasks()), "event_loop_tasks")
+            if self.config.loop_lag_threshold_ms > 0:
+                self._loop_monitor = LoopLagMonitor(self.config.loop_lag_threshold_ms / 1000)
+                self._loop_monitor.start()
+            
+            logger.info("Инициализация базы данных...")
+            await self.db.init_db()
+            logger.info("База данных инициализирована")
+            TIMELINE.mark("db_init")
+
+            # ЮKassa настраивается в startup-хуке бота: API она не нужна
+            await self.hiddify_service.open()
+            await self.notification_service.open()
+
+            # Авторизация в панели и загрузка inbound'ов, чтобы первый платёж не ждал их
+            await self.hiddify_service.warm_up()
+
+            if self.config.trace_retention_days > 0:
+                self.add_job(LeasedJob(
+                    self.db,
+                    "trace_retention",
+                    interval=3600.0,
+                    job=self._prune_traces
+                ))
+
+            if self.config.payments_retention_days > 0 or self.config.subscriptions_retention_days > 0:
+                self.add_job(LeasedJob(
+                    self.db,
+                    "retention",
+                    interval=3600.0,
+                    job=self._archive_old_rows
+                ))
+
+            if self.config.backup_interval_hours > 0:
+                # Задача просыпается раз в час и снимает копию, если последняя старше интервала
+                backup_interval = self.config.backup_interval_hours * 3600
+                self.add_job(LeasedJob(
+                    self.db,
+                    "backup",
+                    interval=min(backup_interval, 3600.0),
+                    job=lambda: self._backup(backup_interval)
+                ))
+
+    async def _backup(self, interval: float):
+        """Снять копии основной базы и базы архива, если последние старше интервала"""
+        await self.backup_service.run(interval=interval)
+        archive = self.archive_backup_service
+        # Файл архива появляется при первом переносе строк
+        if archive is not None and Path(archive.db_path).exists():
+            await archive.run(interval=interval)
+
+    async def _prune_traces(self):
+        """Удалить трассы платежей старше TRACE_RETENTION_DAYS"""
+        before = time.time() - self.config.trace_retention_days * 86400
+        deleted = await self.db.prune_trace_spans(before)
+        if deleted:
+            logger.info(f"Удалено шагов трассировки: {deleted}")
+
+    async def _archive_old_rows(self):
+        """Перенести старые платежи и подписки в архив"""
+        subscriptions_days = self.config.subscriptions_retention_days
+        if subscriptions_days > 0:
+            # Сегмент рассылок "истекла недавно" читает истёкшие подписки из рабочей таблицы
+            subscriptions_days = max(subscriptions_days, self.config.broadcast_expired_days)
+        for table, days in (
+            ("payments", self.config.payments_retention_days),
+            ("subscriptions", subscriptions_days),
+        ):
+            if days <= 0:
+                continue
+            moved = await self.db.archive_rows(
+                table,
+                days,
+                archive_path=self.config.archive_database_path or None,
+                batch_size=self.config.retention_batch_size
+            )
+            if moved:
+                RETENTION_ARCHIVED_TOTAL.inc(table, amount=moved)
+                logger.info(f"Перенесено в архив {table}: {moved} (старше {days} дн.)")
+
+    async def shutdown(self):
+        """Остановить фоновые задачи и закрыть соединения"""
+        async with self._lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+
+            logger.info("Остановка сервисов...")
+            for job in self._jobs:
+                await job.stop()
+            self._jobs.clear()
+            if self._loop_monitor is not None:
+                await self._loop_monitor.stop()
+                self._loop_monitor = None
+            # Закрываем только созданные сервисы (cached_property хранит их в __dict__)
+            if "key_migration_service" in self.__dict__:
+                await self.key_migration_service.shutdown()
+            if "broadcast_service" in self.__dict__:
+                await self.broadcast_service.shutdown()
+            await self.notification_service.close()
+            await self.hiddify_service.close()
+
+
+# Глобальный контейнер сервисов
+container = ServiceContainer(settings)
@@ -0,0 +1,72 @@
+"""Потоковая выгрузка платежей, подписок и пользователей в CSV и NDJSON"""
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from src.database.models import EXPORT_COLUMNS, Database
+
+# Формат -> Content-Type ответа
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_period_bound(value: Optional[str]) -> Optional[str]:
+    """
+    Граница периода в формате created_at ('YYYY-MM-DD HH:MM:SS', UTC)
+
+    Принимает дату (2025-01-01) или ISO-время; время с часовым поясом
+    переводится в UTC. ValueError, если строка не разбирается.
+    """
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def export_rows(
+    db: Database,
+    table: str,
+    fmt: str = "csv",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[str]:
+    """
+    Выгрузка таблицы кусками текста - по одному на пачку строк
+
+    CSV начинается со строки заголовков, NDJSON - один JSON-объект на
+    строку. В памяти одновременно только одна пачка.
+
+    Args:
+        db: База данных
+        table: payments, subscriptions или users (см. EXPORT_COLUMNS)
+        fmt: csv или ndjson
+        since: Начало периода по created_at включительно (см. parse_period_bound)
+        until: Конец периода, не включая
+        batch_size: Строк в пачке
+    """
+    columns = EXPORT_COLUMNS[table]
+    batches = db.iter_export(table, since=since, until=until, batch_size=batch_size)
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for batch in batches:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Заголовок без строк (пустой период)
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+
+    async for batch in batches:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch)
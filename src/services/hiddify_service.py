@@ -5,8 +5,10 @@ import time
 import json
 import uuid
 import base64
-from typing import Optional, Dict
-from urllib.parse import quote
+from typing import Optional, Dict, List, Tuple
+
+from src.monitoring.metrics import instrument_call
+from src.services.inbounds import build_vless_link, choose_inbound, client_flow, display_name, parse_inbounds
 
 logger = logging.getLogger(__name__)
 
@@ -14,52 +16,198 @@ logger = logging.getLogger(__name__)
 class HiddifyService:
     """Сервис для работы с 3x-ui VPN панелью"""
     
-    def __init__(self, api_url: str, api_token: str, server_host: str, data_limit_gb: int = 100):
+    def __init__(
+        self,
+        api_url: str,
+        api_token: str,
+        server_host: str,
+        data_limit_gb: int = 100,
+        inbound_cache_ttl: float = 60.0
+    ):
         self.api_url = api_url.rstrip('/')
         self.server_host = server_host  # Внешний IP или домен для subscription URL
         self.username = "admin"  # По умолчанию для 3x-ui
         self.password = api_token  # Используем api_token как пароль
         self.data_limit_gb = data_limit_gb
         self.session_cookie = None
+        self.inbound_cache_ttl = inbound_cache_ttl
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inbounds: Optional[List[Dict]] = None
+        self._inbounds_loaded_at = 0.0
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент с пулом соединений к панели"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
+    
+    async def open(self):
+        """Открыть пул соединений"""
+        self._get_client()
+    
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def warm_up(self):
+        """Авторизоваться в панели и загрузить каталог inbound'ов"""
+        try:
+            if await self._login():
+                await self.get_inbounds(force=True)
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть каталог inbound'ов: {e}")
         
+    @instrument_call("panel", "login")
     async def _login(self) -> bool:
         """Авторизация в 3x-ui панели"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/login",
-                    data={
-                        "username": self.username,
-                        "password": self.password
-                    },
-                    follow_redirects=True
-                )
-                
-                if response.status_code == 200:
-                    # Сохраняем все cookies
-                    self.session_cookie = "; ".join([f"{k}={v}" for k, v in response.cookies.items()])
-                    if self.session_cookie:
-                        logger.info("Успешная авторизация в 3x-ui")
-                        return True
-                    else:
-                        # Проверяем ответ
-                        try:
-                            data = response.json()
-                            if data.get("success"):
-                                logger.info("Успешная авторизация в 3x-ui (по ответу)")
-                                return True
-                        except:
-                            pass
-                        logger.error("Не получены cookies после авторизации")
-                        return False
+            client = self._get_client()
+            response = await client.post(
+                f"{self.api_url}/login",
+                data={
+                    "username": self.username,
+                    "password": self.password
+                },
+                follow_redirects=True
+            )
+            
+            if response.status_code == 200:
+                # Сохраняем все cookies
+                self.session_cookie = "; ".join([f"{k}={v}" for k, v in response.cookies.items()])
+                if self.session_cookie:
+                    logger.info("Успешная авторизация в 3x-ui")
+                    return True
                 else:
-                    logger.error(f"Ошибка авторизации в 3x-ui: {response.status_code}")
+                    # Проверяем ответ
+                    try:
+                        data = response.json()
+                        if data.get("success"):
+                            logger.info("Успешная авторизация в 3x-ui (по ответу)")
+                            return True
+                    except:
+                        pass
+                    logger.error("Не получены cookies после авторизации")
                     return False
-                    
+            else:
+                logger.error(f"Ошибка авторизации в 3x-ui: {response.status_code}")
+                return False
+                
         except Exception as e:
             logger.error(f"Ошибка при авторизации в 3x-ui: {e}")
             return False
             
+    @instrument_call("panel", "check")
+    async def check(self) -> Dict[str, bool]:
+        """
+        Доступность панели и состояние сессии (для /ready)
+        
+        Запрашивает короткий список клиентов онлайн вместо тяжёлого
+        inbounds/list. Если сессия истекла, пробует авторизоваться заново,
+        чтобы следующий платёж не тратил на это время.
+        
+        Returns:
+            {"reachable": ..., "logged_in": ...}
+        """
+        headers = {"Accept": "application/json"}
+        if self.session_cookie:
+            headers["Cookie"] = self.session_cookie
+        client = self._get_client()
+        try:
+            response = await client.post(f"{self.api_url}/panel/api/inbounds/onlines", headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Панель 3x-ui недоступна: {e}")
+            return {"reachable": False, "logged_in": False}
+        
+        try:
+            logged_in = bool(self.session_cookie) and response.status_code == 200 and response.json().get("success", False)
+        except (ValueError, AttributeError):
+            # Без сессии 3x-ui отвечает страницей входа или 404
+            logged_in = False
+        if not logged_in:
+            if self.session_cookie:
+                logger.warning(f"Сессия 3x-ui недействительна ({response.status_code}), авторизуемся заново")
+            self.session_cookie = None
+            logged_in = await self._login()
+        return {"reachable": True, "logged_in": logged_in}
+    
+    async def get_inbounds(self, force: bool = False) -> Optional[List[Dict]]:
+        """
+        Каталог inbound'ов панели
+        
+        Список кэшируется на inbound_cache_ttl секунд. В кэше хранятся только
+        поля, нужные для выдачи ключей (без списков клиентов), а streamSettings
+        уже распарсен в словарь.
+        
+        Args:
+            force: Загрузить заново, игнорируя кэш
+            
+        Returns:
+            Список inbound'ов или None при ошибке
+        """
+        if (
+            not force
+            and self._inbounds is not None
+            and time.monotonic() - self._inbounds_loaded_at < self.inbound_cache_ttl
+        ):
+            return self._inbounds
+        
+        return await self._load_inbounds()
+    
+    @instrument_call("panel", "list_inbounds")
+    async def _load_inbounds(self) -> Optional[List[Dict]]:
+        """Загрузить каталог inbound'ов из панели"""
+        if not self.session_cookie:
+            if not await self._login():
+                return None
+        
+        client = self._get_client()
+        response = await client.get(
+            f"{self.api_url}/panel/api/inbounds/list",
+            headers={
+                "Cookie": self.session_cookie,
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            }
+        )
+        
+        if response.status_code != 200:
+            logger.error(f"Не удалось получить список inbound'ов: {response.status_code}")
+            return None
+        
+        inbounds_data = response.json()
+        if not inbounds_data.get("success") or not inbounds_data.get("obj"):
+            logger.error("Нет созданных inbound'ов в 3x-ui. Создайте inbound через веб-интерфейс!")
+            return None
+        
+        inbounds = parse_inbounds(inbounds_data["obj"])
+        
+        self._inbounds = inbounds
+        self._inbounds_loaded_at = time.monotonic()
+        return inbounds
+    
+    def invalidate_inbounds(self):
+        """Сбросить кэш каталога inbound'ов"""
+        self._inbounds = None
+    
+    async def select_inbound(self, use_antiblock: bool = False) -> Optional[Dict]:
+        """
+        Выбрать inbound для нового клиента
+        
+        Args:
+            use_antiblock: Режим обхода глушилок
+            
+        Returns:
+            Inbound из каталога или None
+        """
+        inbounds = await self.get_inbounds()
+        if not inbounds:
+            return None
+        
+        return choose_inbound(inbounds, use_antiblock)
+    
+    @instrument_call("panel")
     async def create_user(self, expire_days: int, use_antiblock: bool = False) -> Optional[Dict[str, str]]:
         """
         Создать VPN-пользователя в X-UI
@@ -69,7 +217,7 @@ class HiddifyService:
             use_antiblock: Использовать режим обхода глушилок (inbound 2)
             
         Returns:
-            {"uuid": "...", "subscription_url": "..."}
+            {"uuid": "...", "subscription_url": "...", "inbound_id": ...}
         """
         try:
             # Авторизуемся, если еще не авторизованы
@@ -77,255 +225,70 @@ class HiddifyService:
                 if not await self._login():
                     return None
             
-            # Сначала получим список inbound'ов
-            headers = {
-                "Cookie": self.session_cookie,
-                "Content-Type": "application/json",
-                "Accept": "application/json"
+            # Выбираем inbound в зависимости от режима (из кэшированного каталога)
+            inbound = await self.select_inbound(use_antiblock)
+            if not inbound:
+                return None
+            
+            inbound_id = inbound["id"]
+            
+            # Генерируем UUID и email для клиента
+            client_uuid = str(uuid.uuid4())
+            user_email = f"user_{int(time.time())}@vpn.local"
+            
+            # Вычисляем дату истечения (timestamp в миллисекундах)
+            expire_time = int((time.time() + (expire_days * 86400)) * 1000)
+            
+            # Payload для 3x-ui API (settings должен быть JSON-строкой!)
+            settings_json = json.dumps({
+                "clients": [self._new_client(inbound, client_uuid, user_email, expire_time)]
+            })
+            
+            client_data = {
+                "id": inbound_id,  # Числовой ID inbound
+                "settings": settings_json  # JSON-строка, не объект!
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # Получаем список inbound'ов
-                inbound_response = await client.get(
-                    f"{self.api_url}/panel/api/inbounds/list",
-                    headers=headers
-                )
-                
-                if inbound_response.status_code != 200:
-                    logger.error(f"Не удалось получить список inbound'ов: {inbound_response.status_code}")
-                    return None
-                
-                inbounds_data = inbound_response.json()
-                if not inbounds_data.get("success") or not inbounds_data.get("obj"):
-                    logger.error("Нет созданных inbound'ов в 3x-ui. Создайте inbound через веб-интерфейс!")
-                    return None
-                
-                # Выбираем inbound в зависимости от режима
-                inbound = None
-                if use_antiblock:
-                    # Режим обхода глушилок - ищем Reality inbound с "antiblock" в названии
-                    # Приоритет: Reality на порту 441 или 443
-                    antiblock_candidates = []
-                    for ib in inbounds_data["obj"]:
-                        if "antiblock" in ib.get("remark", "").lower():
-                            stream_settings = ib.get("streamSettings", "{}")
-                            if isinstance(stream_settings, str):
-                                stream_settings = json.loads(stream_settings)
-                            
-                            # Проверяем, что это Reality (не WebSocket!)
-                            if stream_settings.get("security") == "reality":
-                                antiblock_candidates.append(ib)
+            # Добавляем клиента
+            client = self._get_client()
+            response = await client.post(
+                f"{self.api_url}/panel/api/inbounds/addClient",
+                json=client_data,  # Используем JSON
+                headers={
+                    "Cookie": self.session_cookie,
+                    "Content-Type": "application/json"
+                }
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("success"):
+                    vless_link = build_vless_link(client_uuid, self.server_host, inbound, display_name(use_antiblock))
+                    stream_settings = inbound["streamSettings"]
                     
-                    # Выбираем Reality inbound с наивысшим приоритетом (порт 441 или 443)
-                    if antiblock_candidates:
-                        # Сортируем: сначала порт 441, потом 443, потом остальные
-                        antiblock_candidates.sort(key=lambda x: (
-                            0 if x.get("port") == 441 else (1 if x.get("port") == 443 else 2)
-                        ))
-                        inbound = antiblock_candidates[0]
-                        logger.info(f"✅ ANTIBLOCK Reality inbound: ID={inbound['id']}, Port={inbound['port']}, Remark={inbound['remark']}")
-                    else:
-                        logger.error("❌ Reality inbound для антиглушилки не найден! Создайте 'VPN-AntiBlock-Reality' с security=reality.")
-                        return None
-                else:
-                    # Обычный режим - ищем Reality inbound с "bot" или "vpn" в названии
-                    for ib in inbounds_data["obj"]:
-                        remark = ib.get("remark", "").lower()
-                        # Исключаем antiblock inbound'ы
-                        if "antiblock" in remark:
-                            continue
-                        
-                        if "bot" in remark or "vpn" in remark:
-                            stream_settings = ib.get("streamSettings", "{}")
-                            if isinstance(stream_settings, str):
-                                stream_settings = json.loads(stream_settings)
-                            
-                            if stream_settings.get("security") == "reality":
-                                inbound = ib
-                                logger.info(f"✅ NORMAL Reality inbound: ID={ib['id']}, Port={ib['port']}, Remark={ib['remark']}")
-                                break
+                    logger.info(f"VPN пользователь создан: {user_email} (UUID: {client_uuid})")
+                    logger.info(
+                        f"Security: {stream_settings.get('security', 'none')}, "
+                        f"Network: {stream_settings.get('network', 'tcp')}"
+                    )
+                    logger.info(f"VLESS: {vless_link}")
                     
-                    # Если не нашли Reality, берём первый доступный (кроме antiblock)
-                    if not inbound:
-                        for ib in inbounds_data["obj"]:
-                            if "antiblock" not in ib.get("remark", "").lower():
-                                inbound = ib
-                                logger.info(f"⚠️ Используем первый доступный inbound: ID={inbound['id']}")
-                                break
-                
-                inbound_id = inbound["id"]
-                
-                # Генерируем UUID и email для клиента
-                client_uuid = str(uuid.uuid4())
-                user_email = f"user_{int(time.time())}@vpn.local"
-                
-                # Красивое название для отображения в приложении
-                if use_antiblock:
-                    display_name = "🛡️ AI VPN | Обход глушилок"
-                else:
-                    display_name = "🇳🇱 AI VPN | Netherlands"
-                
-                # Вычисляем дату истечения (timestamp в миллисекундах)
-                expire_time = int((time.time() + (expire_days * 86400)) * 1000)
-                
-                # Лимит трафика в байтах
-                total_gb = self.data_limit_gb * 1024 * 1024 * 1024
-                
-                # Определяем flow в зависимости от security (используем уже полученный inbound)
-                stream_settings = inbound.get("streamSettings", "{}")
-                if isinstance(stream_settings, str):
-                    stream_settings = json.loads(stream_settings)
-                
-                security = stream_settings.get("security", "none")
-                flow = "xtls-rprx-vision" if security == "reality" else ""
-                
-                # Payload для 3x-ui API (settings должен быть JSON-строкой!)
-                settings_json = json.dumps({
-                    "clients": [{
-                        "id": client_uuid,
-                        "flow": flow,
-                        "email": user_email,
-                        "limitIp": 0,
-                        "totalGB": total_gb,
-                        "expiryTime": expire_time,
-                        "enable": True,
-                        "tgId": "",
-                        "subId": "",
-                        "comment": "",
-                        "reset": 0
-                    }]
-                })
-                
-                client_data = {
-                    "id": inbound_id,  # Числовой ID inbound
-                    "settings": settings_json  # JSON-строка, не объект!
-                }
-                
-                # Добавляем клиента
-                response = await client.post(
-                    f"{self.api_url}/panel/api/inbounds/addClient",
-                    json=client_data,  # Используем JSON
-                    headers={
-                        "Cookie": self.session_cookie,
-                        "Content-Type": "application/json"
+                    return {
+                        "uuid": client_uuid,
+                        "subscription_url": vless_link,
+                        "vless_link": vless_link,
+                        "inbound_id": inbound_id
                     }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success"):
-                        # Получаем данные inbound для формирования VLESS-ссылки (уже определен выше)
-                        port = inbound.get("port", 443)
-                        remark = inbound.get("remark", "VPN")
-                        
-                        # Парсим streamSettings для определения типа security
-                        stream_settings = inbound.get("streamSettings", "{}")
-                        if isinstance(stream_settings, str):
-                            stream_settings = json.loads(stream_settings)
-                        
-                        network = stream_settings.get("network", "tcp")
-                        security = stream_settings.get("security", "none")
-                        
-                        # Базовые параметры
-                        params = {
-                            "type": network,
-                            "encryption": "none"
-                        }
-                        
-                        # Добавляем параметры в зависимости от типа security
-                        if security == "reality":
-                            reality_settings = stream_settings.get("realitySettings", {})
-                            logger.info(f"Reality settings: {reality_settings}")
-                            params["security"] = "reality"
-                            
-                            # Public Key (обязательно!)
-                            pbk = reality_settings.get("publicKey", "")
-                            if not pbk:
-                                # Пытаемся получить из других возможных полей
-                                pbk = reality_settings.get("settings", {}).get("publicKey", "")
-                            
-                            if pbk:
-                                params["pbk"] = pbk
-                            else:
-                                logger.warning("Public Key не найден в настройках Reality!")
-                            
-                            params["fp"] = reality_settings.get("fingerprint", "chrome")
-                            
-                            # SNI из serverNames (берём первый)
-                            server_names = reality_settings.get("serverNames", [])
-                            if isinstance(server_names, str):
-                                server_names = [server_names]
-                            if server_names:
-                                params["sni"] = server_names[0]
-                            
-                            # Short IDs (берём первый)
-                            short_ids = reality_settings.get("shortIds", [])
-                            if isinstance(short_ids, str):
-                                short_ids = [short_ids]
-                            if short_ids:
-                                params["sid"] = short_ids[0]
-                            
-                            # Flow для Reality (обязательно!)
-                            params["flow"] = "xtls-rprx-vision"
-                            
-                        elif security == "tls":
-                            params["security"] = "tls"
-                            tls_settings = stream_settings.get("tlsSettings", {})
-                            server_names = tls_settings.get("serverName", "")
-                            if server_names:
-                                params["sni"] = server_names
-                            params["fp"] = "chrome"
-                        else:
-                            params["security"] = "none"
-                        
-                        # Добавляем параметры WebSocket (если используется)
-                        if network == "ws":
-                            ws_settings = stream_settings.get("wsSettings", {})
-                            ws_path = ws_settings.get("path", "/")
-                            
-                            # Host может быть в разных местах
-                            ws_host = ""
-                            if "headers" in ws_settings and isinstance(ws_settings["headers"], dict):
-                                ws_host = ws_settings["headers"].get("Host", "")
-                            
-                            # Если host не найден, берём из SNI
-                            if not ws_host and "sni" in params:
-                                ws_host = params["sni"]
-                            
-                            if ws_path:
-                                params["path"] = ws_path
-                            if ws_host:
-                                params["host"] = ws_host
-                            
-                            logger.info(f"WebSocket settings: path={ws_path}, host={ws_host}")
-                        
-                        # Для TLS с самоподписанным сертификатом добавляем allowInsecure
-                        if security == "tls":
-                            params["allowInsecure"] = "1"
-                        
-                        # Формируем query string
-                        query_parts = [f"{k}={quote(str(v))}" for k, v in params.items() if v]
-                        query_string = "&".join(query_parts)
-                        
-                        # Формируем VLESS-ссылку с красивым названием
-                        vless_link = f"vless://{client_uuid}@{self.server_host}:{port}?{query_string}#{quote(display_name)}"
-                        
-                        logger.info(f"VPN пользователь создан: {user_email} (UUID: {client_uuid})")
-                        logger.info(f"Security: {security}, Network: {network}")
-                        logger.info(f"VLESS: {vless_link}")
-                        
-                        return {
-                            "uuid": client_uuid,
-                            "subscription_url": vless_link,
-                            "vless_link": vless_link
-                        }
-                    else:
-                        logger.error(f"3x-ui вернул ошибку: {data.get('msg')}")
-                        return None
                 else:
-                    logger.error(f"Ошибка создания VPN: {response.status_code} - {response.text}")
+                    logger.error(f"3x-ui вернул ошибку: {data.get('msg')}")
+                    # Inbound мог быть удалён или изменён - перечитаем каталог
+                    self.invalidate_inbounds()
                     return None
-                    
+            else:
+                logger.error(f"Ошибка создания VPN: {response.status_code} - {response.text}")
+                self.invalidate_inbounds()
+                return None
+                
         except httpx.RequestError as e:
             logger.error(f"Ошибка подключения к X-UI API: {e}")
             return None
@@ -333,6 +296,140 @@ class HiddifyService:
             logger.error(f"Неожиданная ошибка при создании VPN: {e}")
             return None
     
+    def _new_client(self, inbound: Dict, client_uuid: str, email: str, expire_time: int) -> Dict:
+        """Клиент для addClient: flow по security inbound'а, лимит трафика из настроек"""
+        return {
+            "id": client_uuid,
+            "flow": client_flow(inbound),
+            "email": email,
+            "limitIp": 0,
+            "totalGB": self.data_limit_gb * 1024 * 1024 * 1024,
+            "expiryTime": expire_time,
+            "enable": True,
+            "tgId": "",
+            "subId": "",
+            "comment": "",
+            "reset": 0
+        }
+    
+    @instrument_call("panel")
+    async def add_clients(
+        self,
+        inbound: Dict,
+        expire_times: List[int],
+        use_antiblock: bool = False
+    ) -> Optional[List[Dict]]:
+        """
+        Добавить несколько клиентов в inbound одним запросом addClient
+        
+        Args:
+            inbound: Inbound из каталога
+            expire_times: Даты истечения клиентов (unix time в миллисекундах)
+            use_antiblock: Название подключения для режима обхода глушилок
+            
+        Returns:
+            [{"uuid", "subscription_url", "inbound_id", "client"}] в порядке
+            expire_times или None, если панель отказала (не добавлен ни один)
+        """
+        if not self.session_cookie:
+            if not await self._login():
+                return None
+        
+        clients = []
+        for expire_time in expire_times:
+            client_uuid = str(uuid.uuid4())
+            # Email в 3x-ui уникален: время в секундах совпало бы у всей пачки
+            clients.append(self._new_client(inbound, client_uuid, f"user_{client_uuid[:13]}@vpn.local", expire_time))
+        
+        client = self._get_client()
+        response = await client.post(
+            f"{self.api_url}/panel/api/inbounds/addClient",
+            json={"id": inbound["id"], "settings": json.dumps({"clients": clients})},
+            headers={
+                "Cookie": self.session_cookie,
+                "Content-Type": "application/json"
+            }
+        )
+        data = response.json() if response.status_code == 200 else {}
+        if not data.get("success"):
+            logger.error(f"3x-ui не добавил {len(clients)} клиентов в inbound {inbound['id']}: {response.text[:200]}")
+            self.invalidate_inbounds()
+            return None
+        
+        name = display_name(use_antiblock)
+        return [
+            {
+                "uuid": item["id"],
+                "subscription_url": build_vless_link(item["id"], self.server_host, inbound, name),
+                "inbound_id": inbound["id"],
+                "client": item
+            }
+            for item in clients
+        ]
+    
+    @instrument_call("panel")
+    async def get_client_index(self) -> Optional[Dict[str, Tuple[int, Dict]]]:
+        """
+        Все клиенты панели по UUID
+        
+        В отличие от каталога inbound'ов (get_inbounds) читает полные
+        списки клиентов, поэтому нужен только массовым операциям.
+        
+        Returns:
+            {uuid: (ID inbound'а, клиент из settings)} или None при ошибке
+        """
+        if not self.session_cookie:
+            if not await self._login():
+                return None
+        
+        client = self._get_client()
+        response = await client.get(
+            f"{self.api_url}/panel/api/inbounds/list",
+            headers={"Cookie": self.session_cookie, "Accept": "application/json"}
+        )
+        # Самый большой ответ панели (все клиенты всех inbound'ов) - разбираем один раз
+        data = response.json() if response.status_code == 200 else {}
+        if not data.get("success"):
+            logger.error(f"Не удалось получить клиентов панели: {response.status_code}")
+            return None
+        
+        index = {}
+        for inbound in data.get("obj") or []:
+            settings = inbound.get("settings") or "{}"
+            if isinstance(settings, str):
+                settings = json.loads(settings)
+            for item in settings.get("clients", []):
+                index[item["id"]] = (inbound["id"], item)
+        return index
+    
+    @instrument_call("panel")
+    async def disable_client(self, inbound_id: int, client_data: Dict) -> bool:
+        """
+        Отключить клиента (enable=false), не удаляя его из панели
+        
+        Args:
+            inbound_id: ID inbound'а клиента
+            client_data: Клиент целиком (updateClient заменяет все его поля)
+        """
+        if not self.session_cookie:
+            if not await self._login():
+                return False
+        
+        client = self._get_client()
+        response = await client.post(
+            f"{self.api_url}/panel/api/inbounds/updateClient/{client_data['id']}",
+            json={"id": inbound_id, "settings": json.dumps({"clients": [{**client_data, "enable": False}]})},
+            headers={
+                "Cookie": self.session_cookie,
+                "Content-Type": "application/json"
+            }
+        )
+        if response.status_code == 200 and response.json().get("success"):
+            return True
+        logger.error(f"3x-ui не отключил клиента {client_data.get('email')}: {response.status_code}")
+        return False
+    
+    @instrument_call("panel")
     async def disable_user(self, uuid: str) -> bool:
         """
         Деактивировать VPN-пользователя
@@ -363,29 +460,30 @@ class HiddifyService:
                 }
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/xui/inbound/updateClient/{uuid}",
-                    json=payload,
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success"):
-                        logger.info(f"VPN пользователь деактивирован: {uuid}")
-                        return True
-                    else:
-                        logger.error(f"Ошибка деактивации: {data.get('msg')}")
-                        return False
+            client = self._get_client()
+            response = await client.post(
+                f"{self.api_url}/xui/inbound/updateClient/{uuid}",
+                json=payload,
+                headers=headers
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("success"):
+                    logger.info(f"VPN пользователь деактивирован: {uuid}")
+                    return True
                 else:
-                    logger.error(f"Ошибка деактивации VPN: {response.status_code}")
+                    logger.error(f"Ошибка деактивации: {data.get('msg')}")
                     return False
-                    
+            else:
+                logger.error(f"Ошибка деактивации VPN: {response.status_code}")
+                return False
+                
         except Exception as e:
             logger.error(f"Ошибка при деактивации VPN: {e}")
             return False
     
+    @instrument_call("panel")
     async def get_user_info(self, uuid: str) -> Optional[Dict]:
         """
         Получить информацию о VPN-пользователе
@@ -406,31 +504,31 @@ class HiddifyService:
                 "Content-Type": "application/json"
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/xui/inbound/list",
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success"):
-                        # Ищем клиента по email в списке inbound'ов
-                        for inbound in data.get("obj", []):
-                            settings = inbound.get("settings", {})
-                            clients = settings.get("clients", [])
-                            for client in clients:
-                                if client.get("email") == uuid:
-                                    return client
-                        logger.warning(f"Пользователь {uuid} не найден")
-                        return None
-                    else:
-                        logger.error(f"X-UI вернул ошибку: {data.get('msg')}")
-                        return None
+            client = self._get_client()
+            response = await client.post(
+                f"{self.api_url}/xui/inbound/list",
+                headers=headers
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("success"):
+                    # Ищем клиента по email в списке inbound'ов
+                    for inbound in data.get("obj", []):
+                        settings = inbound.get("settings", {})
+                        clients = settings.get("clients", [])
+                        for client in clients:
+                            if client.get("email") == uuid:
+                                return client
+                    logger.warning(f"Пользователь {uuid} не найден")
+                    return None
                 else:
-                    logger.error(f"Ошибка получения инфо VPN: {response.status_code}")
+                    logger.error(f"X-UI вернул ошибку: {data.get('msg')}")
                     return None
-                    
+            else:
+                logger.error(f"Ошибка получения инфо VPN: {response.status_code}")
+                return None
+                
         except Exception as e:
             logger.error(f"Ошибка при получении инфо VPN: {e}")
             return None
@@ -0,0 +1,223 @@
+"""Каталог inbound'ов 3x-ui: разбор ответа панели, выбор inbound'а и VLESS-ссылки"""
+import json
+import logging
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Flow клиента для Reality (для остальных security пустой)
+REALITY_FLOW = "xtls-rprx-vision"
+
+# Название подключения в приложении
+DISPLAY_NAME = "🇳🇱 AI VPN | Netherlands"
+ANTIBLOCK_DISPLAY_NAME = "🛡️ AI VPN | Обход глушилок"
+
+
+def parse_inbounds(items: List[Dict]) -> List[Dict]:
+    """
+    Каталог из ответа inbounds/list (поле obj)
+
+    Остаются только поля, нужные для выдачи ключей (без списков
+    клиентов), streamSettings разбирается из JSON-строки в словарь.
+    """
+    inbounds = []
+    for ib in items:
+        stream_settings = ib.get("streamSettings", "{}")
+        if isinstance(stream_settings, str):
+            stream_settings = json.loads(stream_settings) if stream_settings else {}
+        inbounds.append({
+            "id": ib["id"],
+            "remark": ib.get("remark", ""),
+            "port": ib.get("port") or 443,
+            "protocol": ib.get("protocol"),
+            "streamSettings": stream_settings
+        })
+    return inbounds
+
+
+def is_antiblock(inbound: Dict) -> bool:
+    """Inbound режима обхода глушилок (по названию, как в choose_inbound)"""
+    return "antiblock" in inbound["remark"].lower()
+
+
+def choose_inbound(inbounds: List[Dict], use_antiblock: bool = False) -> Optional[Dict]:
+    """
+    Выбрать inbound для нового клиента
+
+    Args:
+        inbounds: Каталог (см. parse_inbounds)
+        use_antiblock: Режим обхода глушилок
+
+    Returns:
+        Inbound из каталога или None
+    """
+    inbound = None
+    if use_antiblock:
+        # Режим обхода глушилок - ищем Reality inbound с "antiblock" в названии
+        # Приоритет: Reality на порту 441 или 443
+        antiblock_candidates = [
+            ib for ib in inbounds
+            if "antiblock" in ib["remark"].lower()
+            # Проверяем, что это Reality (не WebSocket!)
+            and ib["streamSettings"].get("security") == "reality"
+        ]
+
+        # Выбираем Reality inbound с наивысшим приоритетом (порт 441 или 443)
+        if antiblock_candidates:
+            # Сортируем: сначала порт 441, потом 443, потом остальные
+            antiblock_candidates.sort(key=lambda x: (
+                0 if x.get("port") == 441 else (1 if x.get("port") == 443 else 2)
+            ))
+            inbound = antiblock_candidates[0]
+            logger.info(f"✅ ANTIBLOCK Reality inbound: ID={inbound['id']}, Port={inbound['port']}, Remark={inbound['remark']}")
+        else:
+            logger.error("❌ Reality inbound для антиглушилки не найден! Создайте 'VPN-AntiBlock-Reality' с security=reality.")
+            return None
+    else:
+        # Обычный режим - ищем Reality inbound с "bot" или "vpn" в названии
+        for ib in inbounds:
+            remark = ib["remark"].lower()
+            # Исключаем antiblock inbound'ы
+            if "antiblock" in remark:
+                continue
+
+            if ("bot" in remark or "vpn" in remark) and ib["streamSettings"].get("security") == "reality":
+                inbound = ib
+                logger.info(f"✅ NORMAL Reality inbound: ID={ib['id']}, Port={ib['port']}, Remark={ib['remark']}")
+                break
+
+        # Если не нашли Reality, берём первый доступный (кроме antiblock)
+        if not inbound:
+            for ib in inbounds:
+                if "antiblock" not in ib["remark"].lower():
+                    inbound = ib
+                    logger.info(f"⚠️ Используем первый доступный inbound: ID={inbound['id']}")
+                    break
+
+    if not inbound:
+        logger.error("Не найден подходящий inbound в 3x-ui")
+    return inbound
+
+
+def display_name(use_antiblock: bool = False) -> str:
+    """Название подключения в приложении для режима inbound'а"""
+    return ANTIBLOCK_DISPLAY_NAME if use_antiblock else DISPLAY_NAME
+
+
+def _stream_settings(inbound: Dict) -> Dict:
+    stream_settings = inbound.get("streamSettings", "{}")
+    if isinstance(stream_settings, str):
+        stream_settings = json.loads(stream_settings)
+    return stream_settings
+
+
+def client_flow(inbound: Dict) -> str:
+    """Flow клиента в addClient: xtls-rprx-vision для Reality"""
+    security = _stream_settings(inbound).get("security", "none")
+    return REALITY_FLOW if security == "reality" else ""
+
+
+def link_params(stream_settings: Dict) -> Dict[str, str]:
+    """Параметры query string VLESS-ссылки по streamSettings inbound'а"""
+    network = stream_settings.get("network", "tcp")
+    security = stream_settings.get("security", "none")
+
+    # Базовые параметры
+    params = {
+        "type": network,
+        "encryption": "none"
+    }
+
+    # Добавляем параметры в зависимости от типа security
+    if security == "reality":
+        reality_settings = stream_settings.get("realitySettings", {})
+        logger.debug(f"Reality settings: {reality_settings}")
+        params["security"] = "reality"
+
+        # Public Key (обязательно!)
+        pbk = reality_settings.get("publicKey", "")
+        if not pbk:
+            # Пытаемся получить из других возможных полей
+            pbk = reality_settings.get("settings", {}).get("publicKey", "")
+
+        if pbk:
+            params["pbk"] = pbk
+        else:
+            logger.warning("Public Key не найден в настройках Reality!")
+
+        params["fp"] = reality_settings.get("fingerprint", "chrome")
+
+        # SNI из serverNames (берём первый)
+        server_names = reality_settings.get("serverNames", [])
+        if isinstance(server_names, str):
+            server_names = [server_names]
+        if server_names:
+            params["sni"] = server_names[0]
+
+        # Short IDs (берём первый)
+        short_ids = reality_settings.get("shortIds", [])
+        if isinstance(short_ids, str):
+            short_ids = [short_ids]
+        if short_ids:
+            params["sid"] = short_ids[0]
+
+        # Flow для Reality (обязательно!)
+        params["flow"] = REALITY_FLOW
+
+    elif security == "tls":
+        params["security"] = "tls"
+        tls_settings = stream_settings.get("tlsSettings", {})
+        server_names = tls_settings.get("serverName", "")
+        if server_names:
+            params["sni"] = server_names
+        params["fp"] = "chrome"
+    else:
+        params["security"] = "none"
+
+    # Добавляем параметры WebSocket (если используется)
+    if network == "ws":
+        ws_settings = stream_settings.get("wsSettings", {})
+        ws_path = ws_settings.get("path", "/")
+
+        # Host может быть в разных местах
+        ws_host = ""
+        if "headers" in ws_settings and isinstance(ws_settings["headers"], dict):
+            ws_host = ws_settings["headers"].get("Host", "")
+
+        # Если host не найден, берём из SNI
+        if not ws_host and "sni" in params:
+            ws_host = params["sni"]
+
+        if ws_path:
+            params["path"] = ws_path
+        if ws_host:
+            params["host"] = ws_host
+
+        logger.debug(f"WebSocket settings: path={ws_path}, host={ws_host}")
+
+    # Для TLS с самоподписанным сертификатом добавляем allowInsecure
+    if security == "tls":
+        params["allowInsecure"] = "1"
+
+    return params
+
+
+def build_vless_link(client_uuid: str, server_host: str, inbound: Dict, display_name: str) -> str:
+    """
+    VLESS-ссылка клиента для импорта в приложение
+
+    Args:
+        client_uuid: UUID клиента в панели
+        server_host: Внешний IP или домен сервера
+        inbound: Inbound из каталога
+        display_name: Название подключения в приложении
+    """
+    port = inbound.get("port", 443)
+    params = link_params(_stream_settings(inbound))
+
+    # Формируем query string
+    query_string = "&".join(f"{k}={quote(str(v))}" for k, v in params.items() if v)
+
+    # Формируем VLESS-ссылку с красивым названием
+    return f"vless://{client_uuid}@{server_host}:{port}?{query_string}#{quote(display_name)}"
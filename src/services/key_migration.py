@@ -0,0 +1,369 @@
+"""Массовый перевод ключей подписчиков на другой inbound"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from src.config.settings import settings
+from src.database.models import Database
+from src.monitoring.metrics import KEY_MIGRATION_TOTAL, QUEUE_DEPTH
+from src.services.broadcast_service import (
+    RESULT_BLOCKED,
+    RESULT_SENT,
+    STATUS_CANCELLED,
+    STATUS_COMPLETED,
+    STATUS_PAUSED,
+    STATUS_PENDING,
+    STATUS_RUNNING,
+    BroadcastService
+)
+from src.services.hiddify_service import HiddifyService
+from src.services.inbounds import is_antiblock
+from src.services.lease import Lease
+
+logger = logging.getLogger(__name__)
+
+KEY_MIGRATED_TEXT = (
+    "🔄 <b>Мы обновили ваш VPN-ключ</b>\n\n"
+    "Подключение переведено на новый сервер, старый ключ отключён.\n\n"
+    "🔗 <b>Ваш ключ:</b>\n"
+    "<code>{key}</code>\n\n"
+    "📱 Если в приложении добавлена ссылка подписки - обновите подписку в приложении. "
+    "Иначе скопируйте ключ и добавьте его заново: '+' → 'Вставить из буфера'.\n\n"
+    "❓ Вопросы? Пишите @tipss94"
+)
+
+
+class KeyMigrationError(Exception):
+    """Перевод нельзя продолжить: панель недоступна или целевой inbound удалён"""
+
+
+class KeyMigrationService:
+    """
+    Перевод активных подписок на целевой inbound с контрольными точками в SQLite
+
+    Подписки читаются пачками по возрастанию subscriptions.id. На пачку
+    панель получает один запрос addClient со всеми новыми клиентами, затем
+    ключи подписок, контрольная точка и список "старый клиент не отключён,
+    уведомление не отправлено" (key_migration_pending) сохраняются одной
+    транзакцией. После этого старые клиенты отключаются (не больше
+    concurrency запросов к панели одновременно), а пользователи получают
+    новый ключ через общий с рассылками token bucket. Перевод можно
+    приостановить, отменить или продолжить после перезапуска; выполняет
+    его процесс, владеющий арендой.
+
+    После падения процесса незавершённые отключения и уведомления
+    доделываются при возобновлении (уведомление может прийти дважды).
+    Если процесс упадёт между addClient и записью в базу, добавленные
+    клиенты пачки останутся в панели неиспользуемыми (их срок равен сроку
+    подписки), а пачка будет переведена заново.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        hiddify_service: HiddifyService,
+        broadcast_service: BroadcastService,
+        batch_size: int = 100,
+        concurrency: int = 5
+    ):
+        self.db = db
+        self.hiddify_service = hiddify_service
+        self.broadcast_service = broadcast_service
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._tasks: Dict[int, asyncio.Task] = {}
+        QUEUE_DEPTH.track(lambda: len(self._tasks), "key_migration_jobs")
+
+    async def preview(self, target_inbound_id: int) -> Optional[dict]:
+        """
+        Целевой inbound и число подписок, которые будут переведены
+
+        Returns:
+            {"inbound", "antiblock", "total"} или None, если inbound'а нет в панели
+        """
+        inbounds = await self.hiddify_service.get_inbounds(force=True) or []
+        inbound = next((ib for ib in inbounds if ib["id"] == target_inbound_id), None)
+        if inbound is None:
+            return None
+        antiblock = is_antiblock(inbound)
+        total = await self.db.count_key_migration_candidates(target_inbound_id, antiblock)
+        return {"inbound": inbound, "antiblock": antiblock, "total": total}
+
+    async def create(self, target_inbound_id: int, created_by: int) -> Optional[int]:
+        """
+        Создать задание перевода на inbound
+
+        Переводятся подписки того же режима, что и inbound (обычный или
+        антиглушилка, по названию как в choose_inbound).
+
+        Returns:
+            ID задания или None, если inbound'а нет в панели
+        """
+        preview = await self.preview(target_inbound_id)
+        if preview is None:
+            return None
+        migration_id = await self.db.create_key_migration(
+            target_inbound_id, preview["antiblock"], created_by, preview["total"]
+        )
+        logger.info(
+            f"Создан перевод ключей #{migration_id} на inbound {target_inbound_id}: "
+            f"{preview['total']} подписок"
+        )
+        return migration_id
+
+    async def get(self, migration_id: int) -> Optional[dict]:
+        """Получить задание перевода"""
+        return await self.db.get_key_migration(migration_id)
+
+    def is_running(self, migration_id: int) -> bool:
+        """Выполняется ли перевод в этом процессе"""
+        task = self._tasks.get(migration_id)
+        return task is not None and not task.done()
+
+    async def start(self, migration_id: int, bot: Bot) -> bool:
+        """
+        Запустить (или продолжить) перевод в фоне
+
+        Returns:
+            True если перевод выполняется
+        """
+        migration = await self.db.get_key_migration(migration_id)
+        if not migration or migration["status"] in (STATUS_CANCELLED, STATUS_COMPLETED):
+            return False
+
+        await self.db.set_key_migration_status(migration_id, STATUS_RUNNING)
+        if self.is_running(migration_id):
+            return True
+
+        lease = self._lease(migration_id)
+        if not await lease.acquire():
+            logger.info(f"Перевод ключей #{migration_id} выполняется другим процессом")
+            return True
+
+        task = asyncio.create_task(self._run(migration_id, bot, lease))
+        self._tasks[migration_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(migration_id, None))
+        return True
+
+    def _lease(self, migration_id: int) -> Lease:
+        # Пачка - запрос к панели, отключение клиентов и уведомления под лимитом Telegram
+        return Lease(
+            self.db,
+            f"key_migration:{migration_id}",
+            ttl=max(60.0, self.batch_size * 2 / self.broadcast_service.bucket.rate)
+        )
+
+    async def pause(self, migration_id: int):
+        """Приостановить перевод (после текущей пачки)"""
+        await self._stop(migration_id, STATUS_PAUSED)
+
+    async def cancel(self, migration_id: int):
+        """Отменить перевод (после текущей пачки)"""
+        await self._stop(migration_id, STATUS_CANCELLED)
+
+    async def _stop(self, migration_id: int, status: str):
+        migration = await self.db.get_key_migration(migration_id)
+        if not migration or migration["status"] in (STATUS_CANCELLED, STATUS_COMPLETED):
+            return
+        await self.db.set_key_migration_status(migration_id, status)
+
+    async def shutdown(self):
+        """Остановить выполняющиеся переводы; статус running сохраняется до перезапуска"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def resume_interrupted(self, bot: Bot):
+        """Продолжить переводы, прерванные перезапуском или падением процесса"""
+        for migration in await self.db.get_key_migrations_by_status(STATUS_RUNNING):
+            logger.info(
+                f"Возобновление перевода ключей #{migration['id']} "
+                f"с subscriptions.id > {migration['last_subscription_id']}"
+            )
+            await self.start(migration["id"], bot)
+
+    async def _run(self, migration_id: int, bot: Bot, lease: Lease):
+        """Основной цикл перевода"""
+        migration = await self.db.get_key_migration(migration_id)
+        target_inbound_id = migration["target_inbound_id"]
+        antiblock = bool(migration["antiblock"])
+
+        final_status = STATUS_COMPLETED
+        error = None
+        try:
+            inbounds = await self.hiddify_service.get_inbounds(force=True) or []
+            inbound = next((ib for ib in inbounds if ib["id"] == target_inbound_id), None)
+            if inbound is None:
+                raise KeyMigrationError(f"Inbound {target_inbound_id} не найден в панели")
+            # Старые клиенты ищутся по UUID один раз на запуск: перевод их не меняет
+            client_index = await self.hiddify_service.get_client_index()
+            if client_index is None:
+                raise KeyMigrationError("Не удалось получить список клиентов панели")
+            # Пачка, прерванная падением процесса после записи в базу
+            await self._finish_pending(migration_id, client_index, bot)
+
+            last_subscription_id = migration["last_subscription_id"]
+            while True:
+                # Пауза или отмена могли прийти из другого процесса
+                current = await self.db.get_key_migration(migration_id)
+                if current["status"] != STATUS_RUNNING:
+                    final_status = current["status"]
+                    break
+
+                if not await lease.acquire():
+                    logger.warning(f"Аренда перевода ключей #{migration_id} перехвачена другим процессом")
+                    return
+
+                batch = await self.db.get_key_migration_batch(
+                    target_inbound_id, antiblock, last_subscription_id, self.batch_size
+                )
+                if not batch:
+                    break
+                orphans = await self._migrate_batch(migration_id, batch, inbound, antiblock)
+                await self._finish_pending(migration_id, client_index, bot, orphans)
+                last_subscription_id = batch[-1]["id"]
+        except asyncio.CancelledError:
+            logger.info(f"Перевод ключей #{migration_id} прерван остановкой процесса")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка перевода ключей #{migration_id}: {e}", exc_info=True)
+            final_status = STATUS_PAUSED
+            error = str(e)
+        finally:
+            await lease.release()
+
+        if not await self.db.set_key_migration_status(migration_id, final_status, expected=STATUS_RUNNING):
+            # Пауза или отмена пришли после последней пачки
+            final_status = (await self.db.get_key_migration(migration_id))["status"]
+        logger.info(f"Перевод ключей #{migration_id} завершён со статусом {final_status}")
+
+        if final_status == STATUS_COMPLETED or error:
+            await self._report(migration_id, bot, error)
+
+    async def _migrate_batch(
+        self,
+        migration_id: int,
+        batch: List[dict],
+        inbound: Dict,
+        antiblock: bool
+    ) -> List[Tuple[int, Dict]]:
+        """
+        Выдать пачке новых клиентов одним addClient и записать ключи в базу
+
+        Returns:
+            Новые клиенты подписок, ключ которых сменился во время пачки
+            (пользователь сам перевыпустил ключ) - их нужно отключить
+        """
+        expire_times = [int(datetime.fromisoformat(row["expires_at"]).timestamp() * 1000) for row in batch]
+        issued = await self.hiddify_service.add_clients(inbound, expire_times, antiblock)
+        if issued is None:
+            raise KeyMigrationError(f"Панель не добавила клиентов в inbound {inbound['id']}")
+
+        applied = set(await self.db.apply_key_migration(
+            migration_id,
+            [
+                (row["id"], row["hiddify_uuid"], new["uuid"], new["subscription_url"], new["inbound_id"])
+                for row, new in zip(batch, issued)
+            ],
+            batch[-1]["id"]
+        ))
+        KEY_MIGRATION_TOTAL.inc("migrated", amount=len(applied))
+        if len(applied) < len(batch):
+            KEY_MIGRATION_TOTAL.inc("skipped", amount=len(batch) - len(applied))
+        return [
+            (new["inbound_id"], new["client"])
+            for row, new in zip(batch, issued)
+            if row["id"] not in applied
+        ]
+
+    async def _finish_pending(
+        self,
+        migration_id: int,
+        client_index: Dict[str, Tuple[int, Dict]],
+        bot: Bot,
+        orphans: Optional[List[Tuple[int, Dict]]] = None
+    ):
+        """Отключить старых клиентов переведённых подписок и отправить пользователям новый ключ"""
+        pending = await self.db.get_key_migration_pending(migration_id)
+        to_disable = list(orphans or [])
+        messages = []
+        for row in pending:
+            old = client_index.pop(row["old_uuid"], None)
+            if old is not None:
+                to_disable.append(old)
+            if not row["bot_blocked"]:
+                key = settings.subscription_link(row["sub_token"]) or row["subscription_url"]
+                messages.append((row["telegram_id"], KEY_MIGRATED_TEXT.format(key=key)))
+        if not to_disable and not messages and not pending:
+            return
+
+        disabled = await self._disable(to_disable)
+        results = await self.broadcast_service.send_batch(bot, messages) if messages else []
+        blocked = [telegram_id for telegram_id, result in results if result == RESULT_BLOCKED]
+        sent = sum(1 for _, result in results if result == RESULT_SENT)
+        failed = (len(to_disable) - disabled) + (len(results) - sent - len(blocked))
+
+        await self.db.mark_users_blocked(blocked)
+        await self.db.finish_key_migration_pending(
+            migration_id, [row["subscription_id"] for row in pending], disabled, sent, failed
+        )
+        for result, amount in (("disabled", disabled), ("notified", sent), ("failed", failed)):
+            if amount:
+                KEY_MIGRATION_TOTAL.inc(result, amount=amount)
+
+    async def _disable(self, clients: List[Tuple[int, Dict]]) -> int:
+        """Отключить клиентов, не больше concurrency запросов одновременно"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def disable(inbound_id: int, client_data: Dict) -> bool:
+            async with semaphore:
+                try:
+                    return await self.hiddify_service.disable_client(inbound_id, client_data)
+                except Exception as e:
+                    logger.error(f"Ошибка отключения клиента {client_data.get('email')}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(disable(inbound_id, item) for inbound_id, item in clients))
+        return sum(results)
+
+    async def _report(self, migration_id: int, bot: Bot, error: Optional[str] = None):
+        """Отправить итог перевода создавшему его администратору"""
+        migration = await self.db.get_key_migration(migration_id)
+        if not migration or not migration["created_by"]:
+            return
+        text = format_key_migration_status(migration)
+        if error:
+            text += f"\n\n⚠️ Остановлен из-за ошибки: {error}"
+        try:
+            await bot.send_message(migration["created_by"], text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчёт о переводе ключей #{migration_id}: {e}")
+
+
+def format_key_migration_status(migration: dict) -> str:
+    """Текст с прогрессом перевода ключей для админ-панели"""
+    status_names = {
+        STATUS_PENDING: "⏳ Ожидает запуска",
+        STATUS_RUNNING: "🔄 Выполняется",
+        STATUS_PAUSED: "⏸ Приостановлен",
+        STATUS_CANCELLED: "🚫 Отменён",
+        STATUS_COMPLETED: "✅ Завершён",
+    }
+    processed = migration["migrated_count"] + migration["skipped_count"]
+    mode = "🛡️ Антиглушилка" if migration["antiblock"] else "⚡️ Обычный VPN"
+    return (
+        f"🔄 <b>Перевод ключей #{migration['id']}</b>\n\n"
+        f"Статус: {status_names.get(migration['status'], migration['status'])}\n"
+        f"🎯 Inbound: {migration['target_inbound_id']} ({mode})\n"
+        f"👥 Обработано: {processed} из {migration['total']}\n"
+        f"✅ Переведено: {migration['migrated_count']}\n"
+        f"↩️ Пропущено (ключ сменился): {migration['skipped_count']}\n"
+        f"🔌 Отключено старых клиентов: {migration['disabled_count']}\n"
+        f"📤 Уведомлено: {migration['notified_count']}\n"
+        f"❌ Ошибок: {migration['failed_count']}"
+    )
@@ -0,0 +1,93 @@
+"""Координация фоновых задач между процессами через аренды в SQLite"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from src.database.models import Database
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор текущего процесса для таблицы leases
+PROCESS_OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """
+    Аренда с ограниченным сроком
+
+    Пока владелец продлевает аренду, другие процессы не могут её захватить.
+    Если процесс умер, аренда освобождается по истечении ttl.
+    """
+
+    def __init__(self, db: Database, name: str, ttl: float = 60.0, owner: str = PROCESS_OWNER_ID):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner
+
+    async def acquire(self) -> bool:
+        """Захватить или продлить аренду"""
+        return await self.db.acquire_lease(self.name, self.owner, self.ttl)
+
+    async def release(self):
+        """Освободить аренду"""
+        await self.db.release_lease(self.name, self.owner)
+
+
+class LeasedJob:
+    """
+    Периодическая фоновая задача, которая выполняется только в одном процессе
+
+    Каждый процесс (воркер API, бот) запускает цикл, но job() вызывается
+    только у владельца аренды. Остальные ждут и подхватывают задачу,
+    если владелец перестал продлевать аренду.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        interval: float,
+        job: Callable[[], Awaitable[None]],
+        ttl: Optional[float] = None
+    ):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        # Аренда должна пережить один цикл, иначе её перехватят во время выполнения
+        self.lease = Lease(db, f"job:{name}", ttl or interval * 3)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запустить цикл задачи"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Остановить цикл и освободить аренду"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.lease.release()
+        except Exception as e:
+            logger.warning(f"Не удалось освободить аренду {self.lease.name}: {e}")
+
+    async def _loop(self):
+        while True:
+            try:
+                if await self.lease.acquire():
+                    await self.job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи {self.name}: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
@@ -3,16 +3,46 @@ import httpx
 import logging
 from typing import Optional
 
+from src.monitoring.metrics import instrument_call
+
 logger = logging.getLogger(__name__)
 
 
 class NotificationService:
     """Сервис для отправки сообщений через Telegram Bot API"""
     
-    def __init__(self, bot_token: str):
+    def __init__(self, bot_token: str, api_base: str = "https://api.telegram.org"):
         self.bot_token = bot_token
-        self.api_url = f"https://api.telegram.org/bot{bot_token}"
+        self.api_url = f"{api_base.rstrip('/')}/bot{bot_token}"
+        self.bot = None
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент с пулом соединений к Bot API"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        return self._client
+    
+    async def open(self):
+        """Открыть пул соединений"""
+        self._get_client()
+    
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def attach_bot(self, bot):
+        """
+        Отправлять сообщения через сессию работающего бота aiogram
         
+        Используется, когда бот и API работают в одном процессе:
+        уведомления идут через уже открытый пул соединений бота.
+        """
+        self.bot = bot
+        
+    @instrument_call("telegram")
     async def send_message(
         self,
         chat_id: int,
@@ -32,25 +62,38 @@ class NotificationService:
         Returns:
             True если успешно отправлено
         """
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/sendMessage",
-                    json={
-                        "chat_id": chat_id,
-                        "text": text,
-                        "parse_mode": parse_mode,
-                        "disable_web_page_preview": disable_web_page_preview
-                    }
+        if self.bot is not None:
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=parse_mode,
+                    disable_web_page_preview=disable_web_page_preview
                 )
+                logger.info(f"Сообщение отправлено пользователю {chat_id}")
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения: {e}")
+                return False
+        
+        try:
+            response = await self._get_client().post(
+                f"{self.api_url}/sendMessage",
+                json={
+                    "chat_id": chat_id,
+                    "text": text,
+                    "parse_mode": parse_mode,
+                    "disable_web_page_preview": disable_web_page_preview
+                }
+            )
+            
+            if response.status_code == 200:
+                logger.info(f"Сообщение отправлено пользователю {chat_id}")
+                return True
+            else:
+                logger.error(f"Ошибка отправки сообщения: {response.text}")
+                return False
                 
-                if response.status_code == 200:
-                    logger.info(f"Сообщение отправлено пользователю {chat_id}")
-                    return True
-                else:
-                    logger.error(f"Ошибка отправки сообщения: {response.text}")
-                    return False
-                    
         except Exception as e:
             logger.error(f"Ошибка при отправке сообщения: {e}")
             return False
@@ -1,19 +1,46 @@
 """Сервис работы с платежами YooKassa"""
 import uuid
 import logging
-from yookassa import Configuration, Payment
 from typing import Optional, Dict
 
+from src.monitoring.metrics import instrument_call
+
 logger = logging.getLogger(__name__)
 
 
 class PaymentService:
     """Сервис для работы с YooKassa"""
     
-    def __init__(self, shop_id: str, secret_key: str):
-        Configuration.account_id = shop_id
-        Configuration.secret_key = secret_key
+    def __init__(self, shop_id: str, secret_key: str, api_url: Optional[str] = None):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.api_url = api_url
+        self._configured = False
+    
+    def configure(self):
+        """
+        Передать учётные данные в SDK YooKassa
+        
+        SDK хранит настройки в глобальном классе Configuration, поэтому
+        это делается один раз при старте бота, а не в конструкторе.
+        SDK (вместе со стеком requests) импортируется здесь, а не при
+        импорте модуля: процессу API он не нужен.
+        """
+        from yookassa import Configuration
+        from yookassa.client import ApiClient
         
+        Configuration.configure(self.shop_id, self.secret_key)
+        if self.api_url:
+            # ApiClient запоминает адрес API при импорте SDK
+            Configuration.api_url = ApiClient.endpoint = self.api_url.rstrip("/")
+        self._configured = True
+    
+    def _ensure_configured(self):
+        """Настроить SDK, если startup() не вызывался (скрипты)"""
+        if not self._configured:
+            self.configure()
+        
+    @instrument_call("yookassa")
     def create_payment(
         self,
         amount: int,
@@ -35,6 +62,7 @@ class PaymentService:
         Returns:
             {"payment_id": "...", "confirmation_url": "..."}
         """
+        self._ensure_configured()
         try:
             idempotence_key = str(uuid.uuid4())
             
@@ -55,6 +83,8 @@ class PaymentService:
                 }
             }
             
+            from yookassa import Payment
+            
             payment = Payment.create(payment_data, idempotence_key)
             
             logger.info(f"Платёж создан: {payment.id} для user {telegram_id}")
@@ -69,6 +99,7 @@ class PaymentService:
             logger.error(f"Ошибка создания платежа: {e}")
             return None
     
+    @instrument_call("yookassa")
     def get_payment_info(self, payment_id: str) -> Optional[Dict]:
         """
         Получить информацию о платеже
@@ -79,7 +110,10 @@ class PaymentService:
         Returns:
             Информация о платеже
         """
+        self._ensure_configured()
         try:
+            from yookassa import Payment
+            
             payment = Payment.find_one(payment_id)
             
             return {
@@ -94,6 +128,34 @@ class PaymentService:
             logger.error(f"Ошибка получения платежа: {e}")
             return None
     
+    @instrument_call("yookassa", "check")
+    async def check_credentials(self, timeout: float = 10.0) -> Dict:
+        """
+        Проверить учётные данные магазина (для /ready)
+        
+        Запрос GET /me напрямую через httpx: синхронный SDK заблокировал
+        бы event loop, а процессу API его импорт не нужен.
+        
+        Returns:
+            {"reachable": ..., "valid": ..., "test": тестовый магазин}
+        """
+        import httpx
+        
+        url = f"{(self.api_url or 'https://api.yookassa.ru/v3').rstrip('/')}/me"
+        try:
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                response = await client.get(url, auth=(self.shop_id, self.secret_key))
+        except httpx.HTTPError as e:
+            logger.warning(f"API ЮKassa недоступен: {e}")
+            return {"reachable": False, "valid": False}
+        
+        if response.status_code in (401, 403):
+            logger.error(f"ЮKassa отклонила учётные данные магазина: {response.status_code}")
+            return {"reachable": True, "valid": False}
+        if response.status_code != 200:
+            return {"reachable": False, "valid": False, "status_code": response.status_code}
+        return {"reachable": True, "valid": True, "test": bool(response.json().get("test", False))}
+    
     def verify_webhook_signature(self, webhook_data: dict) -> bool:
         """
         Проверить подпись webhook от YooKassa
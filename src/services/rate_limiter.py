@@ -0,0 +1,72 @@
+"""Ограничители частоты запросов"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket для ограничения частоты операций
+
+    Ведро пополняется со скоростью `rate` токенов в секунду
+    и вмещает не более `capacity` токенов (допустимый всплеск).
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at", "_lock")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = None
+
+    def _refill(self, now: float):
+        """Пополнить ведро за прошедшее время"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def configure(self, rate: float, capacity: float):
+        """Сменить скорость и ёмкость (после перезагрузки настроек), накопленные токены сохраняются"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Забрать токены без ожидания
+
+        Returns:
+            True если токенов хватило
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0):
+        """Дождаться и забрать токены"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Ожидающие обслуживаются по очереди, чтобы не было голодания
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """
+        Заморозить ведро на указанное время (например, после 429 от Telegram)
+
+        Заморозки не складываются: одновременные 429 от параллельных
+        запросов оставляют самую долгую из них.
+        """
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
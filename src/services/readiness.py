@@ -0,0 +1,166 @@
+"""Готовность инстанса к трафику: фоновые проверки зависимостей для /ready"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.monitoring.metrics import QUEUE_DEPTH, READINESS_CHECK
+
+if TYPE_CHECKING:
+    from src.database.models import Database
+    from src.services.hiddify_service import HiddifyService
+    from src.services.payment_service import PaymentService
+
+logger = logging.getLogger(__name__)
+
+Probe = Callable[[], Awaitable[Dict]]
+
+# Очереди, переполнение которых снимает инстанс с балансировки: апдейты Telegram
+# в обработке (webhook) и выдачи ключей, ждущие панель
+BACKLOG_QUEUES = ("telegram_updates", "provisioning_in_flight")
+
+# Учётные данные ЮKassa меняются редко, а проверка идёт во внешний API
+YOOKASSA_PROBE_INTERVAL = 300.0
+
+# Результат старше стольких периодов проверки считается неизвестным
+STALE_PERIODS = 3
+
+
+class ReadinessMonitor:
+    """
+    Кэш проверок зависимостей
+
+    Проверки выполняются в фоновой задаче каждые interval секунд (каждая
+    со своим периодом, все с общим таймаутом), /ready только читает последние
+    результаты. Поэтому ответ занимает микросекунды, а частые запросы
+    балансировщика не создают нагрузку на базу, панель и ЮKassa.
+
+    Инстанс готов, если все критичные проверки прошли и их результаты
+    не устарели. Некритичные (ЮKassa: обработка webhook'ов к ней не
+    обращается) только отображаются.
+    """
+
+    def __init__(self, interval: float = 15.0, timeout: float = 5.0):
+        self.interval = interval
+        self.timeout = timeout
+        self._probes: Dict[str, Tuple[Probe, bool, float]] = {}
+        self._results: Dict[str, Dict] = {}
+        self._due: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_check(self, name: str, probe: Probe, critical: bool = True, interval: Optional[float] = None):
+        """
+        Зарегистрировать проверку
+
+        Args:
+            name: Название в ответе /ready и в метрике readiness_check
+            probe: Корутина, возвращающая словарь с ключом ok и подробностями
+            critical: Влияет ли результат на готовность
+            interval: Период проверки (по умолчанию общий)
+        """
+        self._probes[name] = (probe, critical, interval or self.interval)
+
+    def start(self):
+        """Запустить фоновые проверки (вызывать из работающего event loop)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновые проверки"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [name for name in self._probes if self._due.get(name, 0.0) <= now]
+            await asyncio.gather(*(self._check(name) for name in due))
+            await asyncio.sleep(self.interval)
+
+    async def _check(self, name: str):
+        probe, _, interval = self._probes[name]
+        started = time.monotonic()
+        try:
+            result = dict(await asyncio.wait_for(probe(), self.timeout))
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"нет ответа за {self.timeout:g} с"}
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+        finished = time.monotonic()
+        result["latency_ms"] = round((finished - started) * 1000, 1)
+        previous = self._results.get(name)
+        if previous is not None and previous["ok"] != result["ok"]:
+            log = logger.info if result["ok"] else logger.warning
+            log(f"Проверка готовности {name}: {'в порядке' if result['ok'] else 'ошибка'} {result}")
+        self._results[name] = {**result, "checked_at": finished}
+        self._due[name] = finished + interval
+        READINESS_CHECK.set(1 if result["ok"] else 0, name)
+
+    def snapshot(self) -> Tuple[bool, Dict]:
+        """
+        Последние результаты проверок
+
+        Returns:
+            (готов ли инстанс, тело ответа /ready)
+        """
+        now = time.monotonic()
+        ready = True
+        checks = {}
+        for name, (_, critical, interval) in self._probes.items():
+            result = self._results.get(name)
+            if result is None:
+                check = {"ok": False, "error": "проверка ещё не выполнялась"}
+            else:
+                check = {key: value for key, value in result.items() if key != "checked_at"}
+                check["age_s"] = round(now - result["checked_at"], 1)
+                if check["age_s"] > interval * STALE_PERIODS:
+                    check["ok"] = False
+                    check["error"] = "результат устарел"
+            check["critical"] = critical
+            checks[name] = check
+            if critical and not check["ok"]:
+                ready = False
+        return ready, {"status": "ready" if ready else "not_ready", "checks": checks}
+
+
+# Проверки зависимостей
+
+
+def database_probe(db: "Database", timeout: float) -> Probe:
+    """База открывается и берёт блокировку записи"""
+    async def probe() -> Dict:
+        await db.check_writable(timeout=timeout)
+        return {"ok": True}
+    return probe
+
+
+def panel_probe(hiddify_service: "HiddifyService") -> Probe:
+    """Панель отвечает и сессия действительна"""
+    async def probe() -> Dict:
+        state = await hiddify_service.check()
+        return {"ok": state["reachable"] and state["logged_in"], **state}
+    return probe
+
+
+def yookassa_probe(payment_service: "PaymentService") -> Probe:
+    """ЮKassa принимает учётные данные магазина"""
+    async def probe() -> Dict:
+        state = await payment_service.check_credentials()
+        return {"ok": state["valid"], **state}
+    return probe
+
+
+def queues_probe(max_depth: int) -> Probe:
+    """Очереди процесса не превышают max_depth"""
+    async def probe() -> Dict:
+        depth = {labels[0]: value for labels, value in QUEUE_DEPTH.values().items()}
+        backlog = max((depth.get(name, 0) for name in BACKLOG_QUEUES), default=0)
+        return {"ok": backlog <= max_depth, "backlog": backlog, "limit": max_depth, "depth": depth}
+    return probe
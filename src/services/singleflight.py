@@ -0,0 +1,102 @@
+"""Защита от параллельного повторения одних и тех же операций"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from src.database.models import Database
+from src.monitoring.metrics import QUEUE_DEPTH
+from src.services.lease import Lease
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningInProgress(Exception):
+    """Такая же операция уже выполняется в другом процессе"""
+
+
+class SingleFlight:
+    """
+    Реестр выполняющихся операций по ключу
+
+    Пока операция с ключом выполняется, повторные вызовы с тем же ключом
+    не запускают её заново, а дожидаются общего результата.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Выполняется ли операция с ключом"""
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполнить операцию или присоединиться к уже выполняющейся
+
+        Returns:
+            (результат, shared) - shared=True если результат получен
+            от операции, запущенной другим вызовом
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        # Отмена одного из ожидающих не должна прерывать общую операцию
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Исключение получают ожидающие, здесь только помечаем его обработанным
+            task.exception()
+
+
+class ProvisioningGuard:
+    """
+    Защита выдачи VPN-ключей от двойных нажатий
+
+    Внутри процесса одинаковые запросы пользователя объединяются через
+    SingleFlight, между процессами (воркеры API, бот) операцию
+    выполняет только владелец аренды provision:<действие>:<telegram_id>.
+    """
+
+    def __init__(self, db: Database, ttl: float = 120.0):
+        self.db = db
+        self.ttl = ttl
+        self._flights = SingleFlight()
+        QUEUE_DEPTH.track(lambda: len(self._flights), "provisioning_in_flight")
+
+    async def run(
+        self,
+        action: str,
+        telegram_id: int,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Выполнить операцию выдачи ключа один раз
+
+        Raises:
+            ProvisioningInProgress: операция уже выполняется другим процессом
+
+        Returns:
+            (результат, shared) как у SingleFlight.do
+        """
+        key = f"{action}:{telegram_id}"
+        return await self._flights.do(key, lambda: self._leased(key, fn))
+
+    async def _leased(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lease = Lease(self.db, f"provision:{key}", ttl=self.ttl)
+        if not await lease.acquire():
+            logger.info(f"Операция {key} уже выполняется другим процессом")
+            raise ProvisioningInProgress(key)
+        try:
+            return await fn()
+        finally:
+            await lease.release()
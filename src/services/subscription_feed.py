@@ -0,0 +1,142 @@
+"""Ссылка подписки /sub/{token}: ключи пользователя в формате подписки V2Box, v2rayNG и Happ"""
+import base64
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+from src.config.settings import settings
+from src.services.inbounds import build_vless_link, display_name
+
+if TYPE_CHECKING:
+    from src.database.models import Database
+    from src.services.hiddify_service import HiddifyService
+
+logger = logging.getLogger(__name__)
+
+# Название профиля в приложении (Happ, v2rayN)
+PROFILE_TITLE = "AI VPN"
+
+# Поля подписки, от которых зависит ответ: их смена (продление, перевыпуск
+# или перевод ключа) делает закэшированный ответ устаревшим
+FEED_VERSION_FIELDS = ("id", "hiddify_uuid", "inbound_id", "expires_at")
+
+
+async def user_key(db: "Database", telegram_id: int, vless_link: str) -> str:
+    """Ключ для показа пользователю: ссылка подписки, если SUBSCRIPTION_BASE_URL задан, иначе vless-ссылка"""
+    if not settings.subscription_base_url:
+        return vless_link
+    return settings.subscription_link(await db.get_sub_token(telegram_id)) or vless_link
+
+
+class FeedResponse(NamedTuple):
+    """Собранный ответ /sub/{token}"""
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+
+
+class SubscriptionFeed:
+    """
+    Ответы /sub/{token} с кэшем в памяти процесса
+
+    Приложения опрашивают ссылку раз в profile-update-interval часов и
+    присылают ETag прошлого ответа. Ответ собирается из активной подписки
+    пользователя и текущего каталога inbound'ов панели, поэтому смена
+    протокола или параметров inbound'а доходит до клиентов без повторного
+    импорта ключа.
+
+    Собранный ответ хранится cache_ttl секунд (LRU на cache_size
+    пользователей) вместе с версией подписки (FEED_VERSION_FIELDS).
+    Каждый опрос читает подписку одним запросом по индексу, и ответ из
+    кэша отдаётся, только если версия не изменилась: ключ, сменённый
+    ботом в другом процессе (перевыпуск, перевод на другой inbound,
+    продление), приложение получит при первом же опросе, без похода
+    в панель для остальных. ETag - хэш тела, ключа и заголовков, он не
+    меняется при повторной сборке того же ответа, так что и после
+    истечения кэша неизменённая подписка отдаётся как 304.
+    """
+
+    def __init__(
+        self,
+        db: "Database",
+        hiddify_service: "HiddifyService",
+        server_host: str,
+        data_limit_gb: int = 100,
+        update_hours: int = 12,
+        cache_ttl: float = 300.0,
+        cache_size: int = 100000
+    ):
+        self.db = db
+        self.hiddify_service = hiddify_service
+        self.server_host = server_host
+        self.data_limit_bytes = data_limit_gb * 1024 ** 3
+        self.update_hours = update_hours
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[Optional[FeedResponse], float, Optional[tuple]]]" = OrderedDict()
+
+    async def get(self, sub_token: str) -> Tuple[Optional[FeedResponse], bool]:
+        """
+        Ответ для токена
+
+        Returns:
+            (ответ или None для неизвестного токена, взят ли он из кэша)
+        """
+        subscription = await self.db.get_feed_subscription(sub_token)
+        version = None
+        if subscription is not None:
+            version = tuple(subscription[field] for field in FEED_VERSION_FIELDS)
+
+        entry = self._cache.get(sub_token)
+        if entry is not None and time.monotonic() < entry[1] and entry[2] == version:
+            self._cache.move_to_end(sub_token)
+            return entry[0], True
+
+        feed = await self._render(subscription) if subscription is not None else None
+        self._cache[sub_token] = (feed, time.monotonic() + self.cache_ttl, version)
+        self._cache.move_to_end(sub_token)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return feed, False
+
+    async def _render(self, subscription: Dict) -> FeedResponse:
+        headers = {
+            "profile-update-interval": str(self.update_hours),
+            "profile-title": "base64:" + base64.b64encode(PROFILE_TITLE.encode()).decode(),
+        }
+        links = []
+        if subscription["id"] is not None:
+            links = await self._links(subscription)
+            expire = int(datetime.fromisoformat(subscription["expires_at"]).timestamp())
+            headers["subscription-userinfo"] = (
+                f"upload=0; download=0; total={self.data_limit_bytes}; expire={expire}"
+            )
+
+        # Без активной подписки - пустой список: приложение уберёт ключи до продления
+        body = base64.b64encode("\n".join(links).encode())
+        digest = hashlib.blake2b(body, digest_size=12)
+        digest.update((subscription["hiddify_uuid"] or "").encode())
+        digest.update(headers.get("subscription-userinfo", "").encode())
+        return FeedResponse(body, f'"{digest.hexdigest()}"', headers)
+
+    async def _links(self, subscription: Dict) -> List[str]:
+        """Ссылки подписки по текущему каталогу, иначе сохранённая при выдаче"""
+        inbound = None
+        if subscription["inbound_id"] is not None:
+            try:
+                inbounds = await self.hiddify_service.get_inbounds() or []
+            except Exception as e:
+                logger.warning(f"Каталог inbound'ов недоступен, отдаём сохранённую ссылку: {e}")
+                inbounds = []
+            inbound = next((ib for ib in inbounds if ib["id"] == subscription["inbound_id"]), None)
+
+        if inbound is None:
+            # Подписка выдана до появления inbound_id или inbound удалён из панели
+            return [subscription["subscription_url"]]
+        use_antiblock = "antiblock" in subscription["tariff"]
+        return [build_vless_link(
+            subscription["hiddify_uuid"], self.server_host, inbound, display_name(use_antiblock)
+        )]